@@ -8,6 +8,8 @@ from tkinterdnd2 import DND_FILES, TkinterDnD
 from matplotlib.colors import ListedColormap
 import plotly.graph_objects as go
 
+from src.grid_io import read_field
+
 # Глобальная переменная для хранения загруженных данных
 loaded_data = None
 
@@ -72,14 +74,9 @@ def handle_file(file_path):
     """
     global loaded_data
     if file_path:
-        try:
-            data = np.loadtxt(file_path)
-            loaded_data = data
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось загрузить файл:\n{e}")
-            return
-
-        # Если активирована галочка, обрезаем данные по выбранной зоне
+        # Если активирована галочка, данные читаются сразу по выбранной зоне: для двоичной сетки
+        # с диска берутся только строки зоны, а разреженная по зоне сетка не разворачивается в полное поле
+        coords = None
         if zone_var.get():
             try:
                 with open("../config/zones.json", "r") as f:
@@ -88,16 +85,17 @@ def handle_file(file_path):
                 messagebox.showerror("Ошибка", f"Не удалось загрузить zones.json:\n{e}")
                 return
             zone_key = zone_option.get()
-            if zone_key in zones_config:
-                coords = zones_config[zone_key]  # [y_min, y_max, x_min, x_max]
-                try:
-                    data = data[coords[0]:coords[1], coords[2]:coords[3]]
-                except Exception as e:
-                    messagebox.showerror("Ошибка", f"Ошибка при обрезке данных:\n{e}")
-                    return
-            else:
+            if zone_key not in zones_config:
                 messagebox.showerror("Ошибка", "Выбранная зона не найдена в конфигурации.")
                 return
+            coords = zones_config[zone_key]  # [y_min, y_max, x_min, x_max]
+
+        try:
+            data = read_field(file_path, coords)
+            loaded_data = data
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось загрузить файл:\n{e}")
+            return
 
         mode = display_mode.get()
         if mode == "отобразить 2д":
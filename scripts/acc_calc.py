@@ -1,8 +1,7 @@
 import argparse
 import os.path
 
-from src.calc_total_acc import TotalAccuracy
-from utils import plot_arrays, save_array
+from src.sweep import SweepSpec, run_sweep
 
 basises = [
     "basis_6",
@@ -29,22 +28,33 @@ waves = [
     "async_gaus_single_2",
 ]
 
-# Настраиваем парсер аргументов командной строки
-parser = argparse.ArgumentParser(description="Запуск расчёта точности для выбранного bath и набора базисов.")
-parser.add_argument("--bath", required=True, help="Имя набора bath (например, parabola_200_2000)")
-args = parser.parse_args()
+if __name__ == "__main__":
+    # Настраиваем парсер аргументов командной строки
+    parser = argparse.ArgumentParser(description="Запуск расчёта точности для выбранного bath и набора базисов.")
+    parser.add_argument("--bath", required=True, help="Имя набора bath (например, parabola_200_2000)")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Читать коэффициенты по блокам строк из memory-mapped кеша вместо загрузки JSON целиком")
+    parser.add_argument("--workers", type=int, default=1, help="Число процессов-исполнителей")
+    parser.add_argument("--memory-limit", default=None,
+                        help="Лимит пиковой памяти одного процесса (например 8G); при превышении чанк уменьшается")
+    parser.add_argument("--engine", default=None,
+                        help="Движок расчёта из src.engines.ENGINES (по умолчанию эталонный; "
+                             "проверка совпадения: scripts/check_engines.py)")
+    args = parser.parse_args()
 
-bath = args.bath
+    bath = args.bath
 
-for wave in waves:
-    for basis in basises:
-        print(f"working {os.path.join("..","data","res_real",bath,wave,basis)}")
-        if (os.path.exists(os.path.join("..","data","res_real",bath,wave,basis))):
-            print("skipped")
-            continue
-        calculator = TotalAccuracy(r"E:\tsunami_res_dir\n_accurate_set", bath, basis,wave)
-        accuracy_dict = calculator.get_accuracy()
-        aprox_error = calculator.errors
-        save_array(aprox_error, f"aprox_error_{bath}_{basis}_check.txt")
-        for key, value in accuracy_dict.items():
-            save_array(value,os.path.join("..","data","res_real",bath,wave,basis,f"{key}.txt"))
\ No newline at end of file
+    # Задачи упорядочиваются по базисам, завершённые (с актуальным хешем входов) пропускаются,
+    # а прерванные - доделываются с места остановки
+    spec = SweepSpec(
+        root_folder=r"E:\tsunami_res_dir\n_accurate_set",
+        output_root=os.path.join("..", "data", "res_real"),
+        baths=[bath],
+        waves=waves,
+        basises=basises,
+        streaming=args.streaming,
+        workers=args.workers,
+        engine=args.engine,
+        memory_limit=args.memory_limit,
+    )
+    run_sweep(spec)
@@ -1,6 +1,7 @@
 import numpy as np
 import matplotlib.pyplot as plt
-import os
+
+from src.result_cube import load_tree_maps
 
 # Увеличиваем шрифт в 2 раза (если базовый размер был 13, теперь 26)
 plt.rcParams.update({'font.size': 26})
@@ -61,12 +62,9 @@ for base_dir, linestyle in base_dirs:
 
 # Проходим по базовым директориям и наборам
 for base_dir, linestyle in base_dirs:
-    for folder in basises:
-        file_path = os.path.join(base_dir, folder, "rms_accuracy.txt")
-        try:
-            data = np.loadtxt(file_path)
-        except Exception as e:
-            print(f"Ошибка загрузки {file_path}: {e}")
+    # Все карты набора - одна выборка из куба результатов (src.result_cube), если он есть
+    for data in load_tree_maps(base_dir, basises, "rms_accuracy"):
+        if data is None:
             # Если файл не найден или произошла ошибка загрузки, заполняем результат nan
             for j in range(len(region_thresholds)):
                 results_percentage[(base_dir, j)].append(np.nan)
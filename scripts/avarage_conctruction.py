@@ -1,10 +1,10 @@
 import json
 import os
-import re
 import numpy as np
 from tqdm import tqdm
 
-from scripts.utils import save_array
+from src.array_cache import cached_basis, cached_wave
+from src.grid_io import RESULT_SUFFIX, write_result
 
 
 def average_reconstructions(reconstruction_list, basis_name):
@@ -74,24 +74,9 @@ def load_basis(basis_directory, sub_y_min, sub_y_max, sub_x_min, sub_x_max, rege
       regex_pattern: шаблон для извлечения индекса из имени файла.
 
     Возвращает:
-      numpy-массив базисных функций с формой (n_layers, H, W).
+      numpy-массив базисных функций с формой (n_layers, H, W) (из кеша src.array_cache).
     """
-    files = os.listdir(basis_directory)
-    basis_files = {}
-
-    for filename in files:
-        match = re.search(regex_pattern, filename)
-        if match:
-            index = int(match.group(1))
-            full_path = os.path.join(basis_directory, filename)
-            basis_files[index] = full_path
-
-    loaded_bases = []
-    for index in sorted(basis_files.keys()):
-        data = np.loadtxt(basis_files[index])
-        cropped = data[sub_y_min:sub_y_max, sub_x_min:sub_x_max]
-        loaded_bases.append(cropped)
-    return np.stack(loaded_bases, axis=0)
+    return cached_basis(basis_directory, [sub_y_min, sub_y_max, sub_x_min, sub_x_max], regex_pattern, dense=True)
 
 
 def get_accuracy(wave_path, config_path, basis_dirs, coef_paths, chunk_size=20, regex_pattern=r".*?(\d+)\.wave"):
@@ -130,8 +115,7 @@ def get_accuracy(wave_path, config_path, basis_dirs, coef_paths, chunk_size=20,
     sub_y_min, sub_y_max, sub_x_min, sub_x_max = subduction_zone
 
     # Загружаем волну и обрезаем её до области subduction_zone
-    wave_data = np.loadtxt(wave_path)
-    wave = wave_data[sub_y_min:sub_y_max, sub_x_min:sub_x_max]
+    wave = cached_wave(wave_path, subduction_zone)
 
     # Загружаем базисные функции для каждого базиса
     basis = {}
@@ -208,4 +192,5 @@ for basis in basises:
 # Вызов функции get_accuracy с заданными параметрами
 accuracy_dict = get_accuracy(wave_path, config_path, basis_dirs, coef_paths, chunk_size=20)
 for key, value in accuracy_dict.items():
-    save_array(value, os.path.join("..", "data", "res_real_mean", bath, f"{key}.txt"))
\ No newline at end of file
+    write_result(os.path.join("..", "data", "res_real_mean", bath, f"{key}{RESULT_SUFFIX}"), value,
+                 meta={"bath": bath, "wave": wave_name, "basises": list(basises)})
\ No newline at end of file
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+# Полосы прогресса tqdm искажают замеры и засоряют вывод
+os.environ.setdefault("TQDM_DISABLE", "1")
+
+import numpy as np
+
+from src.basis_generator import BasisGenerator
+from src.calc_total_acc import TotalAccuracy, load_json_data
+from src.calc_total_acc_mean import TotalAccuracyMean
+from src.coef_store import convert_json_to_memmap
+from src.data_generator import ShapeGenerator
+from src.engines import ENGINES, METRICS
+from src.grid_io import write_result
+from src.loaders import load_basis_stack, load_config, load_wave
+from src.result_store import atomic_savetxt
+from src.synthetic import COEFS_PATTERN, build_dataset, synthetic_wave, tile_shape
+
+RESULT_VERSION = 1
+
+# Предустановки масштаба: small - быстрая проверка, production - размеры config/zones.json
+SCALES = {
+    "small": {"size": [300, 300], "zone_size": [60, 120], "grid": [16, 16],
+              "tiles": [6, 12, 24, 48], "ensemble": 3},
+    "production": {"size": [3000, 2496], "zone_size": [200, 400], "grid": [64, 64],
+                   "tiles": [6, 8, 10, 16, 20, 25, 32, 40, 48], "ensemble": 5},
+}
+
+
+def machine_info():
+    """Сведения о машине и окружении, сохраняемые вместе с замерами."""
+    info = {
+        "hostname": socket.gethostname(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+    }
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    info["mem_total"] = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        info["git_commit"] = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return info
+
+
+def time_case(func, repeat, warmup=1):
+    """Замеряет func() repeat раз после warmup прогонов. Возвращает список времён в секундах."""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def prepare_dataset(data_dir, params):
+    """
+    Строит синтетический набор в data_dir или переиспользует уже построенный с теми же параметрами
+    (параметры хранятся в data_dir/dataset.json).
+    """
+    manifest_path = os.path.join(data_dir, "dataset.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("params") == params:
+            return manifest["dataset"]
+        shutil.rmtree(data_dir)
+    print(f"Генерация синтетических данных в {data_dir} ...")
+    dataset = build_dataset(data_dir, params["size"], params["zone_size"], params["grid"], params["tiles"],
+                            ensemble=params["ensemble"], seed=params["seed"])
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump({"params": params, "dataset": dataset}, f, indent=2)
+    return dataset
+
+
+def benchmark_cases(dataset, params):
+    """
+    Список замеряемых горячих путей: (имя, функция, число обработанных единиц, единица).
+    Данные, нужные для замера, загружаются заранее и в замер не входят.
+    """
+    root = dataset["root_folder"]
+    config_path = dataset["config_path"]
+    zone = load_config(config_path)["subduction_zone"]
+    wave_path = os.path.join(root, "waves", f"{dataset['wave']}.wave")
+    wave = load_wave(wave_path, zone)
+    rows, cols = params["grid"]
+    points = rows * cols
+    scratch = os.path.join(root, "scratch")
+    os.makedirs(scratch, exist_ok=True)
+
+    def coefs_path(basis_name):
+        name = COEFS_PATTERN.format(wave=dataset["wave"], basis=basis_name, bath=dataset["bath"])
+        return os.path.join(root, "coeffs", name)
+
+    pixels_full = params["size"][0] * params["size"][1]
+    cases = [
+        ("generate.bath", lambda: ShapeGenerator(config_path).parabola_sine(), pixels_full, "pixels"),
+        ("generate.wave", lambda: synthetic_wave(config_path), pixels_full, "pixels"),
+        ("load.wave", lambda: load_wave(wave_path, zone), pixels_full, "pixels"),
+        ("save.map", lambda: atomic_savetxt(os.path.join(scratch, "map.txt"), np.zeros((rows, cols))),
+         points, "points"),
+        ("save.map.binary", lambda: write_result(os.path.join(scratch, "map.res"), np.zeros((rows, cols))),
+         points, "points"),
+    ]
+
+    for basis_name, n_tiles in zip(dataset["basises"], params["tiles"]):
+        basis_directory = os.path.join(root, "basises", basis_name)
+        stack = load_basis_stack(basis_directory, zone)
+        coefs, errors = load_json_data(coefs_path(basis_name))
+
+        def generate_basis(n_tiles=n_tiles):
+            generator = BasisGenerator(config_path)
+            zone_height = generator.sub_y_max - generator.sub_y_min
+            zone_width = generator.sub_x_max - generator.sub_x_min
+            generator.generate_tiles(*tile_shape(zone_height, zone_width, n_tiles))
+            return [generator.generate_basis(i) for i in range(len(generator.tiles))]
+
+        def accuracy(engine, stack=stack, coefs=coefs, errors=errors):
+            metrics = tuple(m for m in METRICS if m in ENGINES[engine].metrics)
+            return TotalAccuracy.from_arrays(wave, stack, coefs, errors).get_accuracy(
+                chunk_size=params["chunk_size"], metrics=metrics, engine=engine)
+
+        cases += [
+            (f"generate.basis[{n_tiles}]", generate_basis, n_tiles * pixels_full, "pixels"),
+            (f"load.basis[{n_tiles}]", lambda d=basis_directory: load_basis_stack(d, zone), n_tiles * pixels_full,
+             "pixels"),
+            (f"load.json[{n_tiles}]", lambda p=coefs_path(basis_name): load_json_data(p), points, "points"),
+            (f"load.json_streaming[{n_tiles}]",
+             lambda p=coefs_path(basis_name): convert_json_to_memmap(p, os.path.join(scratch, "memmap")),
+             points, "points"),
+        ]
+        # Все движки расчёта (см. src/engines.py) на одном и том же базисе
+        cases += [(f"accuracy.{engine}[{n_tiles}]", lambda a=accuracy, e=engine: a(e), points, "points")
+                  for engine in ENGINES]
+
+    if dataset["ensemble"]:
+        calculator = TotalAccuracyMean(root, dataset["bath"], dataset["ensemble"], dataset["wave"],
+                                       config_path=config_path)
+        cases.append((f"accuracy.mean[{len(dataset['ensemble'])}]",
+                      lambda: calculator.get_accuracy(chunk_size=params["chunk_size"]), points, "points"))
+    return cases
+
+
+def run(args):
+    params = dict(SCALES[args.scale])
+    for key in ("size", "zone_size", "grid", "tiles"):
+        if getattr(args, key) is not None:
+            params[key] = getattr(args, key)
+    if args.ensemble is not None:
+        params["ensemble"] = args.ensemble
+    params["seed"] = args.seed
+    params["chunk_size"] = args.chunk_size
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="diser_bench_")
+    try:
+        dataset = prepare_dataset(os.path.abspath(data_dir), {k: v for k, v in params.items() if k != "chunk_size"})
+        cases = benchmark_cases(dataset, params)
+        results = {}
+        for name, func, units, unit_name in cases:
+            if args.only and not any(pattern in name for pattern in args.only):
+                continue
+            samples = time_case(func, args.repeat, args.warmup)
+            median = float(np.median(samples))
+            results[name] = {"samples": samples, "median": median, "min": min(samples),
+                             "units": units, "unit": unit_name}
+            print(f"{name:<36}{median:>12.4f} с{units / median if median > 0 else 0:>16.4g} {unit_name}/с")
+    finally:
+        if args.data_dir is None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        "version": RESULT_VERSION,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "machine": machine_info(),
+        "params": params,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Результаты сохранены в {args.output}")
+
+
+def compare_reports(base, new, threshold=0.1, min_seconds=0.005):
+    """
+    Сравнивает медианы общих замеров двух запусков.
+    Регрессия - замедление больше threshold (доля) и больше min_seconds по абсолютной величине.
+
+    Возвращает список (имя, медиана base, медиана new, отношение, статус).
+    """
+    rows = []
+    for name in sorted(set(base["results"]) & set(new["results"])):
+        old_median = base["results"][name]["median"]
+        new_median = new["results"][name]["median"]
+        ratio = new_median / old_median if old_median > 0 else float("inf")
+        status = ""
+        if abs(new_median - old_median) > min_seconds:
+            if ratio > 1 + threshold:
+                status = "РЕГРЕССИЯ"
+            elif ratio < 1 - threshold:
+                status = "ускорение"
+        rows.append((name, old_median, new_median, ratio, status))
+    return rows
+
+
+def compare(args):
+    with open(args.base, "r", encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, "r", encoding="utf-8") as f:
+        new = json.load(f)
+
+    for key in ("hostname", "cpu_count", "numpy"):
+        if base["machine"].get(key) != new["machine"].get(key):
+            print(f"Внимание: запуски сделаны в разном окружении ({key}: "
+                  f"{base['machine'].get(key)} -> {new['machine'].get(key)})")
+    if base["params"] != new["params"]:
+        print("Внимание: параметры синтетических данных различаются, сравнение может быть некорректным")
+
+    rows = compare_reports(base, new, args.threshold, args.min_seconds)
+    print(f"{'замер':<36}{'base, с':>12}{'new, с':>12}{'new/base':>10}")
+    for name, old_median, new_median, ratio, status in rows:
+        print(f"{name:<36}{old_median:>12.4f}{new_median:>12.4f}{ratio:>10.2f}  {status}")
+    unmatched = sorted(set(base["results"]) ^ set(new["results"]))
+    if unmatched:
+        print(f"Замеров только в одном из запусков: {len(unmatched)} ({', '.join(unmatched)})")
+
+    regressions = [row for row in rows if row[4] == "РЕГРЕССИЯ"]
+    if regressions:
+        print(f"Регрессий: {len(regressions)}")
+        sys.exit(1)
+    print("Регрессий нет")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замеры производительности расчёта точности на синтетических данных")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Сгенерировать данные, выполнить замеры и сохранить JSON")
+    run_parser.add_argument("--output", required=True, help="JSON-файл для результатов")
+    run_parser.add_argument("--scale", choices=sorted(SCALES), default="small", help="Предустановка масштаба")
+    run_parser.add_argument("--size", type=int, nargs=2, default=None, help="Размер области: height width")
+    run_parser.add_argument("--zone-size", type=int, nargs=2, default=None, help="Размер зоны: height width")
+    run_parser.add_argument("--grid", type=int, nargs=2, default=None, help="Размер коэффициентной сетки: rows cols")
+    run_parser.add_argument("--tiles", type=int, nargs="+", default=None, help="Числа плиток базисов (6-48)")
+    run_parser.add_argument("--ensemble", type=int, default=None, help="Размер ансамбля для TotalAccuracyMean (0 - без)")
+    run_parser.add_argument("--chunk-size", type=int, default=37, help="Число строк сетки в чанке")
+    run_parser.add_argument("--repeat", type=int, default=5, help="Число замеров каждого пути")
+    run_parser.add_argument("--warmup", type=int, default=1, help="Число прогревочных прогонов")
+    run_parser.add_argument("--seed", type=int, default=0, help="Зерно генератора шума коэффициентов")
+    run_parser.add_argument("--data-dir", default=None,
+                            help="Каталог синтетических данных (переиспользуется между запусками); "
+                                 "по умолчанию временный")
+    run_parser.add_argument("--only", nargs="+", default=None, help="Замерять только пути, содержащие эти строки")
+
+    compare_parser = commands.add_parser("compare", help="Сравнить два запуска и отметить регрессии")
+    compare_parser.add_argument("base", help="JSON базового запуска")
+    compare_parser.add_argument("new", help="JSON нового запуска")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="Допустимое относительное замедление (0.1 = 10%%)")
+    compare_parser.add_argument("--min-seconds", type=float, default=0.005,
+                                help="Разница медиан меньше этой величины не считается регрессией")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        compare(args)
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+import argparse
+
+from src.data_catalog import DEFAULT_COEFS_PATTERN, DataCatalog
+from src.sweep import SweepSpec
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Каталог корня данных: сканирование, поиск и проверка входов серии")
+    parser.add_argument("--root", default=None, help="Корень данных (waves/, bath/, basises/, coeffs/)")
+    parser.add_argument("--spec", default=None,
+                        help="JSON-описание серии (scripts/run_sweep.py): корень, шаблон имён и проверка её входов")
+    parser.add_argument("--pattern", default=None,
+                        help=f"Шаблон имени файла коэффициентов (по умолчанию {DEFAULT_COEFS_PATTERN})")
+    parser.add_argument("--no-hash", action="store_true", help="Не хешировать содержимое новых файлов")
+    parser.add_argument("--query", nargs=3, default=None, metavar=("BATH", "WAVE", "BASIS"),
+                        help="Найти файлы коэффициентов ('-' - любое значение)")
+    args = parser.parse_args()
+    if (args.root is None) == (args.spec is None):
+        parser.error("нужен ровно один из --root и --spec")
+
+    spec = SweepSpec.from_file(args.spec) if args.spec else None
+    root = spec.root_folder if spec else args.root
+    pattern = args.pattern or (spec.coefs_pattern if spec else DEFAULT_COEFS_PATTERN)
+    catalog = DataCatalog(root, pattern).refresh(hash_contents=not args.no_hash)
+    print(f"Каталог {catalog.path}: файлов {catalog.n_files()}, волн {len(catalog.names('waves'))}, "
+          f"базисов {len(catalog.names('basises'))}, файлов коэффициентов {len(catalog.entries['coeffs'])}")
+    unparsed = [name for name, entry in catalog.entries["coeffs"].items() if entry["key"] is None]
+    if unparsed:
+        print(f"Имена не соответствуют шаблону {pattern}: {', '.join(unparsed)}")
+
+    if args.query:
+        bath, wave, basis = (None if value == "-" else value for value in args.query)
+        for entry in catalog.query(bath, wave, basis):
+            print(f"  {entry['path']} ({entry['size']} байт)")
+    if spec is not None:
+        problems = catalog.preflight(spec.baths, spec.waves, spec.basises)
+        for problem in problems:
+            print(f"  {problem}")
+        print("Все входы серии на месте" if not problems else f"Проблем: {len(problems)}")
+        raise SystemExit(1 if problems else 0)
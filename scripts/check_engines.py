@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import sys
+
+# Полосы прогресса tqdm не нужны при сотнях коротких расчётов
+os.environ.setdefault("TQDM_DISABLE", "1")
+
+import numpy as np
+
+from src.engines import ENGINES, METRICS
+from src.equivalence import CASE_KINDS, run_equivalence
+
+
+def summarize(results):
+    """Сводка по движкам: случаев, пропусков, провалов, максимальные отклонения и медианное ускорение."""
+    summary = {}
+    for result in results:
+        item = summary.setdefault(result["engine"], {"cases": 0, "skipped": 0, "failed": [], "max_dev": {},
+                                                     "speedups": []})
+        item["cases"] += 1
+        if result["skipped"]:
+            item["skipped"] += 1
+            continue
+        item["speedups"].append(result["speedup"])
+        for metric, report in result["metrics"].items():
+            item["max_dev"][metric] = max(item["max_dev"].get(metric, 0.0), report["max_dev"])
+            if not report["ok"]:
+                item["failed"].append((result["case"], metric, report))
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Проверка совпадения ускоренных движков расчёта точности с эталонным tensordot")
+    parser.add_argument("--cases", type=int, default=40, help="Число случайных случаев")
+    parser.add_argument("--seed", type=int, default=0, help="Зерно генератора случаев")
+    parser.add_argument("--engines", nargs="+", default=None, choices=sorted(ENGINES),
+                        help="Проверяемые движки (по умолчанию все)")
+    parser.add_argument("--kinds", nargs="+", default=list(CASE_KINDS), choices=CASE_KINDS,
+                        help="Виды случаев")
+    parser.add_argument("--max-side", type=int, default=96, help="Максимальная сторона зоны в пикселях")
+    parser.add_argument("--repeat", type=int, default=1, help="Число замеров времени (берётся лучший)")
+    parser.add_argument("--output", default=None, help="Сохранить подробные результаты в JSON")
+    args = parser.parse_args()
+
+    results = run_equivalence(args.cases, args.seed, args.engines, tuple(args.kinds), args.max_side, args.repeat)
+    summary = summarize(results)
+
+    print(f"{'движок':<12}{'случаев':>9}{'пропущено':>11}{'провалов':>10}{'ускорение':>11}  "
+          + "  ".join(f"max|d| {metric}" for metric in METRICS))
+    for name, item in summary.items():
+        speedup = f"{np.median(item['speedups']):.2f}x" if item["speedups"] else "-"
+        deviations = "  ".join(
+            f"{item['max_dev'][metric]:.3g}".rjust(len(f"max|d| {metric}")) if metric in item["max_dev"]
+            else "-".rjust(len(f"max|d| {metric}"))
+            for metric in METRICS
+        )
+        print(f"{name:<12}{item['cases']:>9}{item['skipped']:>11}{len(item['failed']):>10}{speedup:>11}  {deviations}")
+
+    failures = [(name, failure) for name, item in summary.items() for failure in item["failed"]]
+    for name, (case, metric, report) in failures:
+        print(f"ПРОВАЛ {name}: {metric} max|d|={report['max_dev']:.3g} (допуск {report['tolerance']:.0e}), "
+              f"расхождений NaN: {report['nan_mismatch']}; случай {case}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    sys.exit(1 if failures else 0)
@@ -2,7 +2,8 @@ import argparse
 import os.path
 
 from src.calc_total_acc import TotalAccuracy
-from utils import plot_arrays, save_array
+from src.grid_io import RESULT_SUFFIX, write_result
+from utils import plot_arrays
 
 basises = [
     "basis_6",
@@ -48,4 +49,5 @@ if __name__ == "__main__":
             coefs_path = rf"E:\tsunami_res_dir\coefs_nessesary\case_statistics_hd_y_gaus_single_1_real_{basis}_{bath}_last.json"
             accuracy_dict = TotalAccuracy.get_accuracy_static(config_path,wave_path, basis_directory, coefs_path)
             for key, value in accuracy_dict.items():
-                save_array(value, os.path.join("..", "data", "final", bath,basis, f"{key}.txt"))
\ No newline at end of file
+                write_result(os.path.join("..", "data", "final", bath, basis, f"{key}{RESULT_SUFFIX}"), value,
+                             meta={"bath": bath, "wave": wave_name, "basis": basis})
\ No newline at end of file
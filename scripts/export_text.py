@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+import argparse
+
+from src.grid_io import export_text, is_result_file, result_header
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Текстовая копия двоичной карты (%.6f, как save_array) для просмотра")
+    parser.add_argument("paths", nargs="+", help="Файлы карт (карты результатов, двоичные сетки или текст)")
+    parser.add_argument("--output", default=None,
+                        help="Путь текстового файла (только для одного входного файла; по умолчанию <path>.export.txt)")
+    parser.add_argument("--meta", action="store_true", help="Вывести сведения о расчёте из заголовка карты")
+    args = parser.parse_args()
+    if args.output is not None and len(args.paths) > 1:
+        parser.error("--output задаётся только для одного файла")
+
+    for path in args.paths:
+        if args.meta and is_result_file(path):
+            print(f"{path}: {result_header(path)['meta']}")
+        print(f"{path} -> {export_text(path, args.output)}")
@@ -4,34 +4,104 @@ import os
 import numpy as np
 
 from scripts.utils import save_array
-from src.basis_generator import BasisGenerator
+from src.basis_generator import ADAPTIVE_CRITERIA, SMOOTH_KINDS, BasisGenerator, image_labels
+from src.grid_io import read_field, write_grid
+from src.sparse_basis import SPARSE_BASIS_NAME
 
 
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Генерация базисных функций для субдукционной зоны')
-    parser.add_argument('--tile-height', type=int, required=True, help='Высота плитки (в пикселях)')
-    parser.add_argument('--tile-width', type=int, required=True, help='Ширина плитки (в пикселях)')
+    parser.add_argument('--tile-height', type=int, help='Высота плитки (в пикселях)')
+    parser.add_argument('--tile-width', type=int, help='Ширина плитки (в пикселях)')
     parser.add_argument('--output-dir', type=str, required=True, help='Директория для сохранения базисных функций')
     parser.add_argument('--value', type=float, default=1.0,
                         help='Значение, которым заполняется выбранная плитка (по умолчанию 1.0)')
+    parser.add_argument('--binary', action='store_true',
+                        help='Сохранить в двоичном формате сетки: только значения плитки и её положение')
+    # Адаптивное разбиение вместо равномерного: плитки делятся там, где волна плохо приближается константой
+    parser.add_argument('--adaptive-wave', type=str, default=None,
+                        help='Файл волны для адаптивного разбиения (квадродерево); без него - равномерные плитки')
+    parser.add_argument('--min-tile', type=int, nargs=2, default=[10, 10], metavar=('HEIGHT', 'WIDTH'),
+                        help='Минимальный размер адаптивной плитки (по умолчанию 10 10)')
+    parser.add_argument('--max-tiles', type=int, default=None,
+                        help='Целевое (наибольшее) число адаптивных плиток')
+    parser.add_argument('--threshold', type=float, default=None,
+                        help='Плитки со значением критерия не больше порога не делятся')
+    parser.add_argument('--criterion', choices=ADAPTIVE_CRITERIA, default='energy',
+                        help='Критерий разбиения: остаточная энергия или дисперсия волны на плитке')
+    # Непрямоугольные разбиения зоны картой меток
+    parser.add_argument('--voronoi', type=int, default=None,
+                        help='Разбить зону на заданное число ячеек Вороного со случайными центрами')
+    parser.add_argument('--seed', type=int, default=0, help='Зерно случайных центров ячеек Вороного')
+    parser.add_argument('--bath-contours', type=str, default=None,
+                        help='Файл батиметрии: зона делится изолиниями на уровнях --levels')
+    parser.add_argument('--levels', type=float, nargs='+', default=None,
+                        help='Уровни изолиний батиметрии для --bath-contours')
+    parser.add_argument('--connected', action='store_true',
+                        help='Делить полосы между изолиниями на связные части (нужен scipy)')
+    parser.add_argument('--label-image', type=str, default=None,
+                        help='Изображение-маска размера зоны: каждый цвет - отдельная область')
+    # Гладкие функции с перекрывающимися носителями по центрам плиток, хранятся разреженно (CSR)
+    parser.add_argument('--smooth', choices=SMOOTH_KINDS, default=None,
+                        help='Вместо индикаторов плиток - гладкие функции в центрах плиток, файл basis.csr.npz')
+    parser.add_argument('--smooth-scale', type=float, default=1.0,
+                        help='Ширина гладкой функции в размерах плитки (по умолчанию 1.0)')
+    parser.add_argument('--truncate', type=float, default=3.0,
+                        help='Обрезка гауссианы в sigma (по умолчанию 3.0)')
 
     args = parser.parse_args()
+    modes = [args.adaptive_wave, args.voronoi, args.bath_contours, args.label_image]
+    if sum(mode is not None for mode in modes) > 1:
+        parser.error('--adaptive-wave, --voronoi, --bath-contours и --label-image взаимоисключающие')
+    if all(mode is None for mode in modes) and (args.tile_height is None or args.tile_width is None):
+        parser.error('нужны --tile-height и --tile-width или один из способов разбиения')
+    if args.bath_contours is not None and not args.levels:
+        parser.error('для --bath-contours нужны --levels')
+    if args.adaptive_wave is not None and args.max_tiles is None and args.threshold is None:
+        parser.error('для --adaptive-wave нужен --max-tiles или --threshold')
 
     # Создаем выходную директорию, если её нет
     os.makedirs(args.output_dir, exist_ok=True)
 
     generator = BasisGenerator()
-    # Генерация плиток по заданным размерам
-    tiles = generator.generate_tiles(tile_height=args.tile_height, tile_width=args.tile_width)
+    if args.adaptive_wave is not None:
+        wave = read_field(args.adaptive_wave, generator.subduction_zone)
+        tiles = generator.generate_adaptive_tiles(wave, min_tile=args.min_tile, max_tiles=args.max_tiles,
+                                                  threshold=args.threshold, criterion=args.criterion)
+    elif args.voronoi is not None:
+        tiles = generator.generate_voronoi(args.voronoi, seed=args.seed)
+    elif args.bath_contours is not None:
+        bath = read_field(args.bath_contours, generator.subduction_zone)
+        tiles = generator.generate_contour_regions(bath, args.levels, connected=args.connected)
+    elif args.label_image is not None:
+        tiles = generator.set_label_map(image_labels(args.label_image),
+                                        {"method": "image", "path": args.label_image})
+    else:
+        # Генерация плиток по заданным размерам
+        tiles = generator.generate_tiles(tile_height=args.tile_height, tile_width=args.tile_width)
+    if args.smooth is not None:
+        basis = generator.generate_smooth_basis(args.smooth, scale=args.smooth_scale, truncate=args.truncate)
+        generator.write_tiles(args.output_dir)
+        output_file = basis.save(os.path.join(args.output_dir, SPARSE_BASIS_NAME))
+        print(f'Гладкий базис из {basis.n_layers} функций ({basis.nnz} ненулевых значений) сохранён в: {output_file}')
+        raise SystemExit(0)
+
+    # Манифест плиток и карта меток - одинаковые для равномерного и адаптивного разбиений
+    generator.write_tiles(args.output_dir)
 
     # Визуализация разбиения subduction_zone на плитки
     # generator.visualize_tiles()
 
     # Генерация и сохранение базисных функций для каждой плитки
     for i in range(len(tiles)):
-        basis = generator.generate_basis(tile_index=i, value=args.value)
         output_file = os.path.join(args.output_dir, f'basis_{i}.wave')
-        save_array(basis, output_file)
+        if args.binary and generator.labels is not None:
+            # Область произвольной формы хранится в пределах своего ограничивающего прямоугольника
+            write_grid(output_file, generator.generate_basis(tile_index=i, value=args.value), zone="auto")
+        elif args.binary:
+            generator.generate_basis(tile_index=i, value=args.value, lazy=True).write_to(output_file)
+        else:
+            save_array(generator.generate_basis(tile_index=i, value=args.value), output_file)
         print(f'Базисная функция для плитки {i} сохранена в: {output_file}')
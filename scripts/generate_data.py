@@ -25,6 +25,8 @@ if __name__ == "__main__":
                         help="Период синуса по оси X (только для параболы с синусом)")
     parser.add_argument('--sin_period_y', type=int, default=50,
                         help="Период синуса по оси Y (только для параболы с синусом)")
+    parser.add_argument('--binary', action='store_true',
+                        help="Сохранить в двоичном формате сетки (потоково, без полного массива в памяти)")
 
     args = parser.parse_args()
 
@@ -32,16 +34,19 @@ if __name__ == "__main__":
     data = None
 
     if args.form == 'gradient_x':
-        data = generator.gradient_x(min_value=args.min_value, max_value=args.max_value)
+        data = generator.gradient_x(min_value=args.min_value, max_value=args.max_value, lazy=True)
     elif args.form == 'gradient_y':
-        data = generator.gradient_y(min_value=args.min_value, max_value=args.max_value)
+        data = generator.gradient_y(min_value=args.min_value, max_value=args.max_value, lazy=True)
     elif args.form == 'parabola':
-        data = generator.parabola(min_value=args.min_value, max_value=args.max_value)
+        data = generator.parabola(min_value=args.min_value, max_value=args.max_value, lazy=True)
     elif args.form == 'parabola_sine':
         data = generator.parabola_sine(min_value=args.min_value, max_value=args.max_value,
                                        sin_amp=args.sin_amp, sin_period_x=args.sin_period_x,
-                                       sin_period_y=args.sin_period_y)
+                                       sin_period_y=args.sin_period_y, lazy=True)
 
     if data is not None:
-        save_array(data, args.output)
+        if args.binary:
+            data.write_to(args.output)
+        else:
+            save_array(data.to_array(), args.output)
         print(f"Сгенерированные данные сохранены в: {args.output}")
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+import argparse
+import os
+
+from src import instrumentation
+from src.field_sweep import FieldSweepSpec, run_field_sweep
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Пакетная генерация семейств волн и батиметрий по описанию в JSON")
+    parser.add_argument("--spec", required=True,
+                        help="JSON-файл с описанием (root_folder, families, config_path, workers, binary)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Число процессов (по умолчанию из описания, 0 - по числу ядер)")
+    parser.add_argument("--force", action="store_true",
+                        help="Генерировать заново и поля, уже записанные в каталоге")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Только вывести поля, которые будут сгенерированы")
+    parser.add_argument("--trace", default=None,
+                        help="Записывать замеры этапов в JSON lines файл (сводка: scripts/trace_report.py)")
+    args = parser.parse_args()
+
+    if args.trace:
+        os.environ[instrumentation.TRACE_ENV] = os.path.abspath(args.trace)
+        instrumentation.enable(os.path.abspath(args.trace))
+
+    spec = FieldSweepSpec.from_file(args.spec)
+    workers = args.workers
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    generated = run_field_sweep(spec, workers=workers, force=args.force, dry_run=args.dry_run)
+    if generated:
+        print(f"Сгенерировано полей: {len(generated)}, каталог: {spec.catalog_path()}")
@@ -26,6 +26,8 @@ if __name__ == '__main__':
                         help='Амплитуда для верхней половины (double_gaussian, по умолчанию 1.0)')
     parser.add_argument('--amplitude2', type=float, default=1.0,
                         help='Амплитуда для нижней половины (double_gaussian, по умолчанию 1.0)')
+    parser.add_argument('--binary', action='store_true',
+                        help='Сохранить в двоичном формате сетки (потоково; хранятся только значения зоны и её положение)')
 
     args = parser.parse_args()
 
@@ -33,11 +35,14 @@ if __name__ == '__main__':
     data = None
 
     if args.form == 'gaussian':
-        data = generator.gaussian(amplitude=args.amplitude, sigma_x=args.sigma_x, sigma_y=args.sigma_y)
+        data = generator.gaussian(amplitude=args.amplitude, sigma_x=args.sigma_x, sigma_y=args.sigma_y, lazy=True)
     elif args.form == 'double_gaussian':
         data = generator.double_gaussian(sigma_x=args.sigma_x, sigma_y=args.sigma_y,
-                                         amplitude1=args.amplitude1, amplitude2=args.amplitude2)
+                                         amplitude1=args.amplitude1, amplitude2=args.amplitude2, lazy=True)
 
     if data is not None:
-        save_array(data, args.output)
+        if args.binary:
+            data.write_to(args.output)
+        else:
+            save_array(data.to_array(), args.output)
         print(f"Сгенерированные данные сохранены в: {args.output}")
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+
+from src import instrumentation
+from src.grid_io import read_field
+from src.tiling_set import TilingSet
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Генерация всех разбиений зоны за один запуск: карты меток, вложенность и статистики волн")
+    parser.add_argument("--spec", required=True,
+                        help="JSON-файл с описанием (output_root, config_path, tilings, waves)")
+    parser.add_argument("--output-root", default=None,
+                        help="Корень для директорий разбиений (по умолчанию output_root из описания)")
+    parser.add_argument("--wave", nargs="*", default=None,
+                        help="Файлы волн, статистики которых по плиткам записываются в wave_stats.json")
+    parser.add_argument("--trace", default=None,
+                        help="Записывать замеры этапов в JSON lines файл (сводка: scripts/trace_report.py)")
+    args = parser.parse_args()
+
+    if args.trace:
+        instrumentation.enable(os.path.abspath(args.trace))
+
+    with open(args.spec, "r", encoding="utf-8") as f:
+        spec = json.load(f)
+    output_root = args.output_root or spec["output_root"]
+    config_path = spec.get("config_path", os.path.join("config", "zones.json"))
+    tiling_set = TilingSet.from_spec(spec["tilings"], config_path)
+    tiling_set.build_hierarchy()
+
+    wave_paths = args.wave if args.wave is not None else spec.get("waves", [])
+    waves = {}
+    for path in wave_paths:
+        # Имя волны - имя файла без расширения, как в waves/<name>.wave
+        waves[os.path.splitext(os.path.basename(path))[0]] = read_field(path, tiling_set.generator.subduction_zone)
+
+    manifest_path = tiling_set.write(output_root, waves)
+    for name, entry in tiling_set.manifest()["tilings"].items():
+        parent = f", родитель {entry['parent']}" if entry["parent"] else ""
+        print(f"{name}: {entry['n_tiles']} плиток{parent}")
+    print(f"Разбиений: {len(tiling_set.tilings)}, манифест: {manifest_path}")
@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+import argparse
+
+from src.result_cube import FINAL_WAVE, ResultCube, import_text_tree
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Перенос дерева карт метрик (<bath>/[<wave>/]<basis>/<metric>.res или .txt) в куб результатов")
+    parser.add_argument("--tree", required=True, help="Корень дерева, например data/res_real или data/final")
+    parser.add_argument("--cube", default=None, help="Директория куба (по умолчанию - корень дерева)")
+    parser.add_argument("--wave-label", default=FINAL_WAVE,
+                        help=f"Метка волны для дерева без оси волн, как data/final (по умолчанию {FINAL_WAVE})")
+    parser.add_argument("--force", action="store_true", help="Перечитать и карты, уже записанные в куб")
+    args = parser.parse_args()
+
+    imported = import_text_tree(args.tree, args.cube, wave=args.wave_label, force=args.force)
+    cube = ResultCube(args.cube or args.tree)
+    sizes = ", ".join(f"{axis}: {len(cube.labels(axis))}" for axis in cube.axes)
+    print(f"Перенесено карт: {imported}; куб {sizes}, карта {cube.map_shape[0]}x{cube.map_shape[1]}")
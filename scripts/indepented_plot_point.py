@@ -1,10 +1,11 @@
 import json
 import os
-import re
 import numpy as np
 import matplotlib.pyplot as plt
 import plotly.graph_objects as go
 
+from src.array_cache import cached_basis, cached_wave
+
 def load_json_data(filename):
     """
     Загружает данные из JSON-файла и преобразует их в два массива:
@@ -54,30 +55,17 @@ def load_config(config_path):
 
 def load_wave(wave_path, sub_y_min, sub_y_max, sub_x_min, sub_x_max):
     """Загружает волну из файла и обрезает её по заданной области."""
-    data = np.loadtxt(wave_path)
-    return data[sub_y_min:sub_y_max, sub_x_min:sub_x_max]
+    return cached_wave(wave_path, [sub_y_min, sub_y_max, sub_x_min, sub_x_max])
 
 
 def load_basis_functions(basis_directory, sub_y_min, sub_y_max, sub_x_min, sub_x_max, regex_pattern=r".*?(\d+)\.wave"):
     """
     Загружает базисные функции из файлов в директории basis_directory.
     Имена файлов сортируются по числовому индексу, извлекаемому регулярным выражением.
-    Каждая базисная функция обрезается до заданной области.
+    Каждая базисная функция обрезается до заданной области. Повторная загрузка берётся из кеша src.array_cache.
     """
-    files = os.listdir(basis_directory)
-    basis_files = {}
-    for filename in files:
-        match = re.search(regex_pattern, filename)
-        if match:
-            index = int(match.group(1))
-            full_path = os.path.join(basis_directory, filename)
-            basis_files[index] = full_path
-    loaded_bases = []
-    for index in sorted(basis_files.keys()):
-        data = np.loadtxt(basis_files[index])
-        cropped = data[sub_y_min:sub_y_max, sub_x_min:sub_x_max]
-        loaded_bases.append(cropped)
-    return loaded_bases
+    return list(cached_basis(basis_directory, [sub_y_min, sub_y_max, sub_x_min, sub_x_max], regex_pattern,
+                             dense=True))
 
 
 def plot(x, y, config_path, wave_path, basis_directory, coefs_path):
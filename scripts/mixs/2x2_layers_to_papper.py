@@ -1,8 +1,9 @@
 import numpy as np
 import matplotlib.pyplot as plt
-import os
 from matplotlib.colors import ListedColormap, BoundaryNorm
 
+from src.result_cube import load_tree_maps
+
 # Увеличиваем размер шрифта в 2 раза
 plt.rcParams['font.size'] *= 2
 
@@ -35,12 +36,8 @@ plt.subplots_adjust(bottom=0.15 + vertical_shift, wspace=0.3, hspace=0.3)
 
 im = None
 
-for i, folder in enumerate(basises):
-    file_path = os.path.join(base_dir, folder, "rms_accuracy.txt")
-    try:
-        data = np.loadtxt(file_path)
-    except Exception as e:
-        print(f"Ошибка загрузки {file_path}: {e}")
+for i, (folder, data) in enumerate(zip(basises, load_tree_maps(base_dir, basises, "rms_accuracy"))):
+    if data is None:
         continue
 
     # Если нужно можно добавить сглаживание, например, с помощью uniform_filter
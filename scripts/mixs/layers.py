@@ -1,9 +1,10 @@
 import numpy as np
 import plotly.graph_objects as go
 from scipy.ndimage import uniform_filter
-import os
 from skimage import measure
 
+from src.result_cube import load_tree_maps
+
 # Флаг: если True, то отрисовываются только контуры, иначе – заполненные области
 only_contours = False
 
@@ -65,7 +66,8 @@ base_dir = r"/data/res_real/parabola_200_2000/async_gaus_single_1_real"
 
 fig = go.Figure()
 
-for folder in basises:
+# Все карты - одна выборка из куба результатов (src.result_cube), если он есть
+for folder, data in zip(basises, load_tree_maps(base_dir, basises, "rms_accuracy")):
     # Извлекаем значение для оси Z из имени папки (например, "basis_6" -> 6)
     try:
         z_val = int(folder.split('_')[1])
@@ -73,12 +75,7 @@ for folder in basises:
         print(f"Ошибка при извлечении z для {folder}: {e}")
         continue
 
-    file_path = os.path.join(base_dir, folder, "rms_accuracy.txt")
-    try:
-        # Загружаем 2D-массив из файла
-        data = np.loadtxt(file_path)
-    except Exception as e:
-        print(f"Не удалось загрузить {file_path}: {e}")
+    if data is None:
         continue
 
     # Сглаживаем данные (окно можно подбирать, здесь 15x15)
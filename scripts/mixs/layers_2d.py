@@ -1,9 +1,10 @@
 import numpy as np
 import matplotlib.pyplot as plt
-import os
 from scipy.ndimage import uniform_filter
 from matplotlib.colors import ListedColormap, BoundaryNorm
 
+from src.result_cube import load_tree_maps
+
 # Список папок
 basises = [
     "basis_6",
@@ -45,12 +46,8 @@ fig, axes = plt.subplots(4, 4, figsize=(12, 12))
 plt.subplots_adjust(wspace=0.3, hspace=0.3, right=0.8)
 
 # Проходим по списку папок
-for i, folder in enumerate(basises):
-    file_path = os.path.join(base_dir, folder, "rms_accuracy.txt")
-    try:
-        data = np.loadtxt(file_path)
-    except Exception as e:
-        print(f"Ошибка загрузки {file_path}: {e}")
+for i, (folder, data) in enumerate(zip(basises, load_tree_maps(base_dir, basises, "rms_accuracy"))):
+    if data is None:
         continue
 
     # Сглаживаем данные (окно 15x15)
@@ -1,10 +1,10 @@
 import os
 import json
 import numpy as np
-import re
-from tqdm import tqdm
 import plotly.graph_objects as go
 
+from src.array_cache import cached_basis, cached_wave
+
 def average_reconstructions(reconstruction_list):
     """
     Вычисляет среднее арифметическое реконструкций.
@@ -53,23 +53,10 @@ def load_json_data(filename):
 
 def load_basis(basis_directory, sub_y_min, sub_y_max, sub_x_min, sub_x_max, regex_pattern=r".*?(\d+)\.wave"):
     """
-    Загружает базисные функции из файлов в указанной директории и обрезает их до заданной области.
+    Загружает базисные функции из файлов в указанной директории и обрезает их до заданной области
+    (повторная загрузка - из кеша src.array_cache).
     """
-    files = os.listdir(basis_directory)
-    basis_files = {}
-    for filename in files:
-        match = re.search(regex_pattern, filename)
-        if match:
-            index = int(match.group(1))
-            full_path = os.path.join(basis_directory, filename)
-            basis_files[index] = full_path
-
-    loaded_bases = []
-    for index in tqdm(sorted(basis_files.keys()), desc=f"Загрузка базиса из {basis_directory}"):
-        data = np.loadtxt(basis_files[index])
-        cropped = data[sub_y_min:sub_y_max, sub_x_min:sub_x_max]
-        loaded_bases.append(cropped)
-    return np.stack(loaded_bases, axis=0)
+    return cached_basis(basis_directory, [sub_y_min, sub_y_max, sub_x_min, sub_x_max], regex_pattern, dense=True)
 
 def plot_from_files(basises, wave_name, bath, config_path, root_folder, x, y):
     """
@@ -99,11 +86,10 @@ def plot_from_files(basises, wave_name, bath, config_path, root_folder, x, y):
     # Загрузка волны
     wave_path = os.path.join(root_folder, "waves", f"{wave_name}.wave")
     try:
-        data = np.loadtxt(wave_path)
+        wave = cached_wave(wave_path, subduction_zone)
     except Exception as e:
         print(f"Не удалось загрузить волну {wave_path}: {e}")
         return
-    wave = data[sub_y_min:sub_y_max, sub_x_min:sub_x_max]
 
     reconstruction_list = []
     for bn in basises:
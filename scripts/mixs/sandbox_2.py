@@ -1,4 +1,6 @@
 import  numpy as np
 
-data = np.loadtxt(r"/data/res_real_mean/parabola_sine_200_2000/rms_accuracy.txt")
+from src.grid_io import read_field
+
+data = read_field(r"/data/res_real_mean/parabola_sine_200_2000/rms_accuracy.res")
 np.save(r"/data/res_real_mean/parabola_sine_200_2000/rms.npy", data)
\ No newline at end of file
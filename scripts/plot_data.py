@@ -3,16 +3,18 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os
 
+from src.grid_io import read_field
+
 
 def main():
     parser = argparse.ArgumentParser(description='Plot generated 2D data')
-    parser.add_argument('--input', type=str, help='Путь к входному файлу с 2D массивом (текстовый файл)')
+    parser.add_argument('--input', type=str, help='Путь к входному файлу с 2D массивом (текст или двоичная сетка)')
     parser.add_argument('--output', type=str, help='Путь к выходному файлу для сохранения изображения')
     args = parser.parse_args()
 
     # Если указан входной файл и он существует, загружаем данные, иначе создаем тестовый массив
     if args.input and os.path.exists(args.input):
-        data = np.loadtxt(args.input)
+        data = read_field(args.input)
     else:
         print("Параметр --input не задан или файл не найден. Используем тестовый 2D массив.")
         # Генерируем тестовый массив (например, линейный градиент)
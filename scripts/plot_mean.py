@@ -1,10 +1,11 @@
 import json
 import os
-import re
 import numpy as np
-from tqdm import tqdm  # Импорт tqdm для отображения прогресса
 import plotly.graph_objects as go
 
+from src.array_cache import cached_basis, cached_wave
+
+
 def average_reconstructions(reconstruction_list, basis_name):
     """
     Вычисляет среднее арифметическое реконструкций.
@@ -109,33 +110,15 @@ class PlotMeanForm:
         Загружает базисные функции из файлов в заданной директории.
         Имена файлов должны соответствовать шаблону regex_pattern для извлечения индекса.
         Каждая функция обрезается до области subduction_zone.
-        Возвращает массив базисных функций с формой (n_layers, H, W).
+        Возвращает массив базисных функций с формой (n_layers, H, W) (из кеша src.array_cache).
         """
-        files = os.listdir(basis_directory)
-        basis_files = {}
-
-        # Фильтрация файлов по регулярному выражению и извлечение индекса
-        for filename in files:
-            match = re.search(regex_pattern, filename)
-            if match:
-                index = int(match.group(1))
-                full_path = os.path.join(basis_directory, filename)
-                basis_files[index] = full_path
-
-        loaded_bases = []
-        for index in tqdm(sorted(basis_files.keys())):
-            data = np.loadtxt(basis_files[index])
-            cropped = data[self.sub_y_min:self.sub_y_max, self.sub_x_min:self.sub_x_max]
-            loaded_bases.append(cropped)
-        return np.stack(loaded_bases, axis=0)
+        return cached_basis(basis_directory, self.subduction_zone, regex_pattern, dense=True)
 
     def _load_wave(self):
         """
         Загружает волну из файла self.wave_path и обрезает её до области subduction_zone.
         """
-        data = np.loadtxt(self.wave_path)
-        wave = data[self.sub_y_min:self.sub_y_max, self.sub_x_min:self.sub_x_max]
-        return wave
+        return cached_wave(self.wave_path, self.subduction_zone)
 
     def plot(self, x, y):
         """
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import shutil
+from functools import partial
+
+from src.sweep import SweepSpec, execute_queued_task, fill_cube, submit_sweep
+from src.work_queue import WorkQueue, run_worker
+
+SPEC_NAME = "spec.json"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Очередь задач серии расчётов на общей файловой системе: любое число узлов "
+                    "запускает worker с одним и тем же --queue")
+    parser.add_argument("command", choices=["submit", "worker", "status", "requeue", "cube"],
+                        help="submit - поставить серию в очередь; worker - выполнять задачи; "
+                             "status - состояние очереди; requeue - вернуть просроченные и упавшие задачи; "
+                             "cube - записать карты завершённых задач в куб серии (один процесс, после расчёта)")
+    parser.add_argument("--queue", required=True, help="Каталог очереди на общей файловой системе")
+    parser.add_argument("--spec", help="JSON-описание серии (для submit; копируется в каталог очереди)")
+    parser.add_argument("--lease", type=float, default=600.0,
+                        help="Время жизни аренды без heartbeat в секундах (по умолчанию 600)")
+    parser.add_argument("--max-attempts", type=int, default=3, help="Число попыток выполнения задачи")
+    parser.add_argument("--worker-id", default=None, help="Идентификатор исполнителя (по умолчанию <host>-<pid>)")
+    parser.add_argument("--wait", action="store_true", help="Не завершать worker, когда очередь пуста")
+    parser.add_argument("--force", action="store_true", help="submit: поставить заново уже выполненные задачи")
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.queue, lease_seconds=args.lease, max_attempts=args.max_attempts)
+    spec_path = os.path.join(args.queue, SPEC_NAME)
+
+    if args.command == "submit":
+        if not args.spec:
+            parser.error("для submit нужен --spec")
+        if os.path.abspath(args.spec) != os.path.abspath(spec_path):
+            shutil.copyfile(args.spec, spec_path)
+        added = submit_sweep(queue, SweepSpec.from_file(spec_path), force=args.force)
+        print(f"Добавлено задач: {added}")
+    elif args.command == "worker":
+        spec = SweepSpec.from_file(spec_path)
+        completed = run_worker(queue, partial(execute_queued_task, spec), worker_id=args.worker_id, wait=args.wait)
+        print(f"Выполнено задач: {completed}")
+    elif args.command == "cube":
+        spec = SweepSpec.from_file(spec_path)
+        if spec.cube is None:
+            parser.error("в описании серии не задан cube")
+        print(f"Записано в куб задач: {fill_cube(spec)}")
+    elif args.command == "requeue":
+        expired = queue.requeue_expired()
+        failed = queue.requeue_failed()
+        print(f"Возвращено просроченных: {len(expired)}, упавших: {len(failed)}")
+
+    for state, count in queue.status().items():
+        print(f"{state}: {count}")
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+import argparse
+import os
+
+from src import instrumentation
+from src.sweep import SweepSpec, run_sweep
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Возобновляемый запуск серии расчётов точности по описанию в JSON")
+    parser.add_argument("--spec", required=True,
+                        help="JSON-файл с описанием серии (root_folder, output_root, baths, waves, basises, ...)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Число процессов-исполнителей (по умолчанию из описания серии)")
+    parser.add_argument("--prefetch", type=int, default=None,
+                        help="Загружать входы стольких следующих задач в фоне и писать результаты в фоне "
+                             "(по умолчанию из описания серии; 0 - без конвейера)")
+    parser.add_argument("--checkpoint", action="store_true",
+                        help="Сохранять готовые чанки задачи: после прерывания задача досчитывает оставшиеся строки")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Только вывести незавершённые задачи, ничего не вычисляя")
+    parser.add_argument("--trace", default=None,
+                        help="Записывать замеры этапов в JSON lines файл (сводка: scripts/trace_report.py)")
+    args = parser.parse_args()
+
+    if args.trace:
+        # Через переменную окружения трасса включается и в процессах-исполнителях
+        os.environ[instrumentation.TRACE_ENV] = os.path.abspath(args.trace)
+        instrumentation.enable(os.path.abspath(args.trace))
+
+    spec = SweepSpec.from_file(args.spec)
+    if args.prefetch is not None:
+        spec.prefetch = args.prefetch
+    if args.checkpoint:
+        spec.checkpoint = True
+    run_sweep(spec, workers=args.workers, dry_run=args.dry_run)
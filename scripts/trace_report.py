@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+import argparse
+import json
+from collections import defaultdict
+
+
+def load_records(path):
+    """Читает события трассы (JSON lines), пропуская повреждённые строки."""
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def summarize(records, group_by=None):
+    """
+    Агрегирует этапы по имени (и, если задано, по полю group_by):
+    число вызовов, суммарное/среднее/максимальное время, пиковый RSS и суммы счётчиков.
+    Этапы фоновых потоков пик RSS не измеряют (peak_rss = None); если таковы все вызовы этапа, пик - None.
+    """
+    summary = defaultdict(lambda: {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "peak_rss": None,
+                                   "counters": defaultdict(float)})
+    for record in records:
+        if record.get("type") != "stage":
+            continue
+        key = record["stage"] if group_by is None else f"{record['stage']}[{record.get(group_by)}]"
+        item = summary[key]
+        item["calls"] += 1
+        item["seconds"] += record["seconds"]
+        item["max_seconds"] = max(item["max_seconds"], record["seconds"])
+        if record.get("peak_rss") is not None:
+            item["peak_rss"] = max(item["peak_rss"] or 0, record["peak_rss"])
+        for name, value in record.get("counters", {}).items():
+            item["counters"][name] += value
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сводка по трассе этапов расчёта (JSON lines)")
+    parser.add_argument("trace", help="Файл трассы, записанный при DISER_TRACE=<файл> или --trace")
+    parser.add_argument("--group-by", default=None, help="Дополнительно группировать по полю события (например basis)")
+    args = parser.parse_args()
+
+    records = load_records(args.trace)
+    summary = summarize(records, args.group_by)
+    # Доля считается от общего времени трассы; у параллельных исполнителей сумма может превышать 100%
+    stages = [r for r in records if r.get("type") == "stage"]
+    total = (max(r["time"] for r in stages) - min(r["time"] - r["seconds"] for r in stages)) if stages else 0.0
+    total = total or 1.0
+    print(f"Время трассы: {total:.3f} с, процессов: {len({r['pid'] for r in stages})}")
+
+    print(f"{'этап':<32}{'вызовов':>9}{'всего, с':>12}{'доля':>8}{'макс, с':>10}{'пик RSS, МБ':>13}  счётчики")
+    for name, item in sorted(summary.items(), key=lambda kv: -kv[1]["seconds"]):
+        rates = ", ".join(
+            f"{counter}={value:.4g} ({value / item['seconds']:.4g}/с)" if item["seconds"] > 0
+            else f"{counter}={value:.4g}"
+            for counter, value in sorted(item["counters"].items())
+        )
+        peak = f"{item['peak_rss'] / 2 ** 20:>13.1f}" if item["peak_rss"] is not None else f"{'-':>13}"
+        print(f"{name:<32}{item['calls']:>9}{item['seconds']:>12.3f}{item['seconds'] / total:>8.1%}"
+              f"{item['max_seconds']:>10.3f}{peak}  {rates}")
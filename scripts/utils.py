@@ -2,13 +2,17 @@ import os
 import matplotlib.pyplot as plt
 import numpy as np
 
+from src.instrumentation import stage
+
 def save_array(data, path):
     """Сохраняет 2D массив в текстовый файл (значения разделены пробелами, строки – переносами).
     Создает необходимые директории, если их нет."""
     directory = os.path.dirname(path)
     if directory:
         os.makedirs(directory, exist_ok=True)
-    np.savetxt(path, data, fmt='%.6f')
+    with stage("save", path=path) as st:
+        np.savetxt(path, data, fmt='%.6f')
+        st.add(pixels=np.size(data))
 
 
 def plot_arrays(arrays):
@@ -0,0 +1,354 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from src.data_catalog import file_hash
+from src.engines import gram_matrix, wave_projection
+from src.grid_io import atomic_write_json
+from src.instrumentation import stage
+from src.loaders import BASIS_EXTRA_FILES, BASIS_REGEX, list_basis_files, load_basis, load_wave, load_wave_frames
+from src.memory import parse_size
+from src.sparse_basis import SPARSE_BASIS_NAME, SparseBasis
+
+# Директория кеша на диске; "off" - только кеш процесса
+CACHE_ENV = "DISER_CACHE"
+# Предел размера кеша на диске ('8G', '512M' или число байт)
+CACHE_LIMIT_ENV = "DISER_CACHE_LIMIT"
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "diser")
+DEFAULT_DISK_LIMIT = 8 * 2 ** 30
+DEFAULT_MEMORY_LIMIT = 2 * 2 ** 30
+# Индекс хешей исходных файлов в директории кеша: путь -> [размер, время изменения, sha1]
+FINGERPRINTS_NAME = "fingerprints.json"
+# Вытеснение освобождает место с запасом - до этой доли disk_limit, чтобы следующие записи
+# не обходили директорию кеша каждый раз
+EVICT_TARGET = 0.9
+
+_default = None
+
+
+class ArrayCache:
+    """
+    Кеш массивов с адресацией по содержимому: ключ - sha1 от вида массива, хешей исходных файлов,
+    зоны и dtype, значение - файл .npy в <directory>/<ключ[:2]>/<ключ>.npy, который открывается
+    как memory-mapped массив только для чтения. Перед диском - LRU процесса с пределом памяти.
+    При превышении предела размера на диске удаляются давно не использованные файлы.
+
+        cache = ArrayCache("/tmp/cache")
+        stack = cache.get_or_compute(("basis", hashes, zone, "float64"), lambda: load_basis_stack(...))
+    """
+
+    def __init__(self, directory=None, disk_limit=DEFAULT_DISK_LIMIT, memory_limit=DEFAULT_MEMORY_LIMIT):
+        """
+        directory - директория кеша на диске или None (только кеш процесса);
+        disk_limit, memory_limit - пределы размера на диске и в памяти (байты или строка '8G').
+        """
+        self.directory = directory
+        self.disk_limit = parse_size(disk_limit)
+        self.memory_limit = parse_size(memory_limit)
+        self._memory = OrderedDict()  # ключ -> (значение, размер в байтах)
+        self._memory_bytes = 0
+        self._fingerprints = None
+        # Размер файлов кеша на диске, известный процессу (None - ещё не подсчитан обходом директории)
+        self._disk_bytes = None
+        # Кеш используют поток фоновой загрузки (src.pipeline) и основной поток
+        self._lock = threading.RLock()
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+
+    @staticmethod
+    def key(parts):
+        """Ключ кеша: sha1 от JSON-представления частей ключа (строки, числа, списки)."""
+        text = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.npy")
+
+    # --- хеши исходных файлов ---
+
+    def _fingerprints_path(self):
+        return os.path.join(self.directory, FINGERPRINTS_NAME)
+
+    def fingerprint(self, path):
+        """sha1 содержимого файла (см. fingerprints)."""
+        return self.fingerprints([path])[0]
+
+    def fingerprints(self, paths):
+        """
+        sha1 содержимого файлов paths по порядку. С директорией кеша хеши запоминаются в fingerprints.json
+        вместе с размером и временем изменения, и повторный запуск не читает неизменённые файлы.
+        Индекс переписывается один раз на вызов и только если появились новые хеши.
+        """
+        if self.directory is None:
+            return [file_hash(path) for path in paths]
+        with self._lock:
+            if self._fingerprints is None:
+                try:
+                    with open(self._fingerprints_path(), "r", encoding="utf-8") as f:
+                        self._fingerprints = json.load(f)
+                except (OSError, ValueError):
+                    self._fingerprints = {}
+            digests = []
+            changed = False
+            for path in paths:
+                st = os.stat(path)
+                absolute = os.path.abspath(path)
+                record = self._fingerprints.get(absolute)
+                if record is not None and record[0] == st.st_size and record[1] == st.st_mtime_ns:
+                    digests.append(record[2])
+                    continue
+                digest = file_hash(path)
+                self._fingerprints[absolute] = [st.st_size, st.st_mtime_ns, digest]
+                digests.append(digest)
+                changed = True
+            if changed:
+                self._save_fingerprints()
+            return digests
+
+    def _save_fingerprints(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # Процессы пула пишут индекс независимо: потерянная запись лишь перехешируется
+        atomic_write_json(self._fingerprints_path(), self._fingerprints, per_process=True)
+
+    # --- значения ---
+
+    def _remember(self, key, value, size):
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= self._memory.pop(key)[1]
+            if size > self.memory_limit:
+                return
+            self._memory[key] = (value, size)
+            self._memory_bytes += size
+            while self._memory_bytes > self.memory_limit:
+                _, (_, old_size) = self._memory.popitem(last=False)
+                self._memory_bytes -= old_size
+
+    def get(self, key):
+        """Значение по ключу из кеша процесса или с диска (memory-mapped, только чтение); None, если нет."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits["memory"] += 1
+                return self._memory[key][0]
+        if self.directory is None:
+            return None
+        path = self.path(key)
+        try:
+            value = np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        # Время изменения - время последнего использования для вытеснения
+        os.utime(path)
+        self.hits["disk"] += 1
+        self._remember(key, value, value.nbytes)
+        return value
+
+    def put(self, key, value):
+        """
+        Сохраняет массив (атомарно) и возвращает его memory-mapped копию; без директории кеша -
+        сам массив. Объекты, отличные от ndarray (например, SparseBasis), хранятся только в памяти.
+        """
+        if isinstance(value, SparseBasis):
+            self._remember(key, value, value.nnz * 16)
+            return value
+        value = np.asarray(value)
+        if self.directory is None:
+            self._remember(key, value, value.nbytes)
+            return value
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, value)
+        replaced = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+        self._account(os.path.getsize(path) - replaced)
+        if not os.path.exists(path):
+            # Массив больше предела размера кеша на диске
+            self._remember(key, value, value.nbytes)
+            return value
+        value = np.load(path, mmap_mode="r")
+        self._remember(key, value, value.nbytes)
+        return value
+
+    def get_or_compute(self, parts, compute, kind="array"):
+        """Значение по частям ключа parts; при промахе вычисляется compute() и сохраняется."""
+        key = self.key(parts)
+        value = self.get(key)
+        if value is not None:
+            return value
+        self.misses += 1
+        with stage("cache_fill", kind=kind) as st:
+            value = self.put(key, compute())
+            st.add(bytes=getattr(value, "nbytes", 0))
+        return value
+
+    def entries(self):
+        """Файлы кеша на диске: список (путь, размер, время использования)."""
+        if self.directory is None or not os.path.isdir(self.directory):
+            return []
+        found = []
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith(".npy") and ".tmp" not in filename:
+                    path = os.path.join(root, filename)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    found.append((path, st.st_size, st.st_mtime))
+        return found
+
+    def _account(self, size):
+        """
+        Учитывает записанный файл в размере кеша на диске. Директория обходится один раз при первой
+        записи процесса и затем только когда учтённый размер превысил disk_limit (evict).
+        """
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(entry_size for _, entry_size, _ in self.entries())
+            else:
+                self._disk_bytes += size
+            over = self._disk_bytes > self.disk_limit
+        if over:
+            self.evict()
+
+    def evict(self):
+        """
+        Если кеш на диске больше disk_limit, удаляет давно не использованные файлы, пока размер
+        не станет не больше EVICT_TARGET * disk_limit. Возвращает число удалённых.
+        """
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.disk_limit * EVICT_TARGET if total > self.disk_limit else total
+        removed = 0
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        with self._lock:
+            self._disk_bytes = total
+        return removed
+
+    def clear(self):
+        """Очищает кеш процесса и удаляет файлы кеша на диске."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        for path, _, _ in self.entries():
+            os.remove(path)
+        with self._lock:
+            self._disk_bytes = 0
+
+
+def default_cache():
+    """
+    Общий кеш процесса: директория из DISER_CACHE (по умолчанию ~/.cache/diser, "off" - без диска),
+    предел размера на диске из DISER_CACHE_LIMIT (по умолчанию 8 ГБ).
+
+    Постоянный кеш на диске включён по умолчанию для всех загрузчиков, которые идут через кеш
+    (cached_wave, cached_basis, cached_frames, матрицы Грама и проекции), в том числе в скриптах
+    построения графиков: первый запуск пишет в ~/.cache/diser до 8 ГБ .npy-файлов. Отключить диск -
+    DISER_CACHE=off (остаётся только кеш процесса в памяти), перенести - DISER_CACHE=<директория>,
+    уменьшить - DISER_CACHE_LIMIT=512M; удалить накопленное - default_cache().clear().
+    """
+    global _default
+    if _default is None:
+        directory = os.environ.get(CACHE_ENV, DEFAULT_CACHE_DIR)
+        limit = os.environ.get(CACHE_LIMIT_ENV) or DEFAULT_DISK_LIMIT
+        _default = ArrayCache(None if directory.lower() == "off" else directory, disk_limit=limit)
+    return _default
+
+
+def wave_key(wave_path, zone, dtype=np.float64, cache=None):
+    cache = cache or default_cache()
+    return ["wave", cache.fingerprint(wave_path), [int(v) for v in zone], np.dtype(dtype).name]
+
+
+def frames_key(wave_path, zone, regex_pattern=BASIS_REGEX, dtype=np.float64, cache=None):
+    """Части ключа кадров временного ряда: хеши файлов кадров по порядку или файла куба кадров."""
+    cache = cache or default_cache()
+    paths = list_basis_files(wave_path, regex_pattern) if os.path.isdir(wave_path) else [wave_path]
+    return ["frames", cache.fingerprints(paths), [int(v) for v in zone], np.dtype(dtype).name]
+
+
+def basis_key(basis_directory, zone, regex_pattern=BASIS_REGEX, dtype=np.float64, cache=None):
+    """
+    Части ключа базиса: хеши файлов функций по порядку номеров, а также разреженного файла
+    и карты меток с манифестом, если они есть (см. src.loaders.load_basis).
+    """
+    cache = cache or default_cache()
+    paths = list_basis_files(basis_directory, regex_pattern)
+    for name in BASIS_EXTRA_FILES:
+        if os.path.exists(os.path.join(basis_directory, name)):
+            paths.append(os.path.join(basis_directory, name))
+    return ["basis", cache.fingerprints(paths), [int(v) for v in zone], np.dtype(dtype).name]
+
+
+def cached_wave(wave_path, zone, dtype=np.float64, cache=None):
+    """Обрезанная волна (src.loaders.load_wave) из кеша; при промахе читается и сохраняется."""
+    cache = cache or default_cache()
+    return cache.get_or_compute(wave_key(wave_path, zone, dtype, cache),
+                                lambda: load_wave(wave_path, zone).astype(dtype, copy=False), kind="wave")
+
+
+def cached_frames(wave_path, zone, regex_pattern=BASIS_REGEX, dtype=np.float64, cache=None):
+    """Кадры временного ряда волны (src.loaders.load_wave_frames) из кеша; при промахе читаются и сохраняются."""
+    cache = cache or default_cache()
+    return cache.get_or_compute(frames_key(wave_path, zone, regex_pattern, dtype, cache),
+                                lambda: load_wave_frames(wave_path, zone, regex_pattern).astype(dtype, copy=False),
+                                kind="frames")
+
+
+def cached_basis(basis_directory, zone, regex_pattern=BASIS_REGEX, dtype=np.float64, dense=False, cache=None):
+    """
+    Базис директории (src.loaders.load_basis) из кеша: плотный массив (n_layers, H, W) -
+    memory-mapped, SparseBasis - только в кеше процесса (его файл и так двоичный).
+    dense=True - всегда плотный массив (разреженный базис кешируется развёрнутым).
+    """
+    cache = cache or default_cache()
+    parts = basis_key(basis_directory, zone, regex_pattern, dtype, cache)
+
+    def compute():
+        basis = load_basis(basis_directory, zone, regex_pattern)
+        if isinstance(basis, SparseBasis):
+            return basis.toarray().astype(dtype, copy=False) if dense else basis
+        return basis.astype(dtype, copy=False)
+
+    if dense and os.path.exists(os.path.join(basis_directory, SPARSE_BASIS_NAME)):
+        parts.append("dense")
+    return cache.get_or_compute(parts, compute, kind="basis")
+
+
+def cached_gram(basis_directory, zone, basis_stack, regex_pattern=BASIS_REGEX, cache=None):
+    """Матрица Грама базиса директории (для SparseBasis - разреженная сборка) из кеша."""
+    cache = cache or default_cache()
+    parts = ["gram", basis_key(basis_directory, zone, regex_pattern, cache=cache)]
+    if isinstance(basis_stack, SparseBasis):
+        return cache.get_or_compute(parts, basis_stack.gram, kind="gram")
+    return cache.get_or_compute(parts, lambda: gram_matrix(basis_stack), kind="gram")
+
+
+def cached_projection(wave_path, basis_directory, zone, basis_stack, wave=None, regex_pattern=BASIS_REGEX,
+                      cache=None):
+    """Проекции волны на функции базиса p[k] = <b_k, wave> из кеша; wave - уже загруженная волна."""
+    cache = cache or default_cache()
+    parts = ["projection", wave_key(wave_path, zone, cache=cache), basis_key(basis_directory, zone, regex_pattern,
+                                                                            cache=cache)]
+
+    def compute():
+        field = wave if wave is not None else cached_wave(wave_path, zone, cache=cache)
+        if isinstance(basis_stack, SparseBasis):
+            return basis_stack.project(field)
+        return wave_projection(basis_stack, field)
+
+    return cache.get_or_compute(parts, compute, kind="projection")
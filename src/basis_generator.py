@@ -1,21 +1,147 @@
+import heapq
 import os
 import json
 import re
 
 import numpy as np
-import matplotlib.pyplot as plt
+
+from src.fields import SeparableField
+from src.grid_io import atomic_write_json, open_grid, read_field, write_grid
+from src.sparse_basis import SparseBasis
+
+# Критерии разбиения адаптивной плиточной сетки (generate_adaptive_tiles)
+ADAPTIVE_CRITERIA = ("energy", "variance")
+# Гладкие базисы с компактным носителем (generate_smooth_basis)
+SMOOTH_KINDS = ("hat", "gaussian")
+TILES_MANIFEST = "tiles.json"
+LABELS_GRID = "labels.grid"
+
+
+def integral_image(data):
+    """
+    Интегральное изображение с нулевыми первой строкой и столбцом, shape (H + 1, W + 1):
+    сумма data[y0:y1, x0:x1] = S[y1, x1] - S[y0, x1] - S[y1, x0] + S[y0, x0].
+    """
+    summed = np.zeros((data.shape[0] + 1, data.shape[1] + 1))
+    np.cumsum(np.cumsum(data, axis=0), axis=1, out=summed[1:, 1:])
+    return summed
+
+
+def _box_sum(summed, y0, y1, x0, x1):
+    return summed[y1, x1] - summed[y0, x1] - summed[y1, x0] + summed[y0, x0]
+
+
+def load_label_map(path):
+    """Загружает карту меток плиток (labels.grid), записанную BasisGenerator.write_tiles."""
+    grid = open_grid(path)
+    labels = np.array(grid, dtype=np.int32)
+    del grid
+    return labels
+
+
+def compact_labels(labels):
+    """
+    Перенумеровывает метки подряд: неотрицательные значения -> 0..n-1 в порядке возрастания,
+    отрицательные (непокрытые пиксели) -> -1. Пустые номера (например, ячейки Вороного без
+    пикселей) исчезают. Возвращает (labels int32, n_regions).
+    """
+    labels = np.asarray(labels)
+    compact = np.full(labels.shape, -1, dtype=np.int32)
+    inside = labels >= 0
+    values, inverse = np.unique(labels[inside], return_inverse=True)
+    compact[inside] = inverse
+    return compact, int(values.size)
+
+
+def voronoi_labels(shape, seeds, rows_per_block=64):
+    """
+    Ячейки Вороного: номер ближайшей точки seeds (массив (n, 2) координат (y, x) в той же системе,
+    что и shape) для каждого пикселя. Считается блоками строк, чтобы не держать (H, W, n) расстояний.
+    """
+    seeds = np.asarray(seeds, dtype=np.float64).reshape(-1, 2)
+    labels = np.empty(shape, dtype=np.int32)
+    xs = np.arange(shape[1], dtype=np.float64)
+    for start in range(0, shape[0], rows_per_block):
+        ys = np.arange(start, min(start + rows_per_block, shape[0]), dtype=np.float64)
+        distance = (ys[:, None, None] - seeds[:, 0]) ** 2 + (xs[None, :, None] - seeds[:, 1]) ** 2
+        labels[start:start + ys.size] = np.argmin(distance, axis=-1)
+    return labels
+
+
+def contour_labels(bath, levels, connected=False):
+    """
+    Области между изолиниями батиметрии: номер интервала levels, в который попадает bath (np.digitize).
+    connected=True дополнительно делит каждую полосу на связные части (нужен scipy).
+    """
+    bands = np.digitize(bath, np.sort(np.asarray(levels, dtype=np.float64)))
+    if not connected:
+        return bands
+    from scipy import ndimage
+
+    labels = np.full(bands.shape, -1, dtype=np.int64)
+    offset = 0
+    for band in np.unique(bands):
+        parts, n_parts = ndimage.label(bands == band)
+        labels[parts > 0] = parts[parts > 0] - 1 + offset
+        offset += n_parts
+    return labels
+
+
+def image_labels(path, background=None):
+    """
+    Карта меток из изображения-маски: каждый различный цвет (или значение) - отдельная область.
+    Пиксели цвета background (например, [0, 0, 0]) не покрыты (-1). Изображения читаются через
+    Pillow, файлы .npy - через numpy, остальные - как поля (двоичная сетка или текст).
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".npy":
+        image = np.load(path)
+    elif extension in (".png", ".bmp", ".gif", ".tif", ".tiff", ".jpg", ".jpeg"):
+        from PIL import Image
+
+        with Image.open(path) as img:
+            image = np.asarray(img)
+    else:
+        image = read_field(path)
+    flat = image.reshape(image.shape[0] * image.shape[1], -1)
+    _, inverse = np.unique(flat, axis=0, return_inverse=True)
+    labels = inverse.reshape(image.shape[:2]).astype(np.int64)
+    if background is not None:
+        labels[np.all(flat == np.asarray(background).reshape(1, -1), axis=1).reshape(image.shape[:2])] = -1
+    return labels
+
+
+def label_basis_stack(labels, values=1.0):
+    """
+    Базис карты меток: функция k равна values[k] (или values) на области k и нулю вне её, shape (n, H, W).
+    Метки перенумеровываются compact_labels, values задаются в новой нумерации.
+    """
+    labels, n_regions = compact_labels(labels)
+    values = np.broadcast_to(np.asarray(values, dtype=np.float64), (n_regions,))
+    stack = np.zeros((n_regions,) + labels.shape)
+    ys, xs = np.nonzero(labels >= 0)
+    stack[labels[ys, xs], ys, xs] = values[labels[ys, xs]]
+    return stack
+
+
+def write_tile_files(output_dir, manifest, labels):
+    """Записывает манифест плиток (tiles.json) и карту меток зоны (labels.grid) в output_dir."""
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, TILES_MANIFEST)
+    atomic_write_json(manifest_path, manifest, indent=2)
+    write_grid(os.path.join(output_dir, LABELS_GRID), labels)
+    return manifest_path
 
 
 class BasisGenerator:
-    def __init__(self):
+    def __init__(self, config_path=os.path.join("config", "zones.json")):
         """
         Инициализация генератора базисных функций.
-        Загружает конфигурацию напрямую из файла config/zones.json.
+        Загружает конфигурацию напрямую из файла config/zones.json (или из файла config_path).
         Ожидается, что zones.json содержит:
             "size": [height, width]
             "subduction_zone": [y_min, y_max, x_min, x_max]
         """
-        config_path = os.path.join("config", "zones.json")
         with open(config_path, 'r', encoding='utf-8') as f:
             config = json.load(f)
         self.size = config["size"]
@@ -23,6 +149,9 @@ class BasisGenerator:
         self.subduction_zone = config["subduction_zone"]
         self.sub_y_min, self.sub_y_max, self.sub_x_min, self.sub_x_max = self.subduction_zone
         self.tiles = []  # Список плиток (каждая плитка – кортеж (y_min, y_max, x_min, x_max))
+        self.tiling = None  # Параметры, которыми получены плитки (для манифеста)
+        # Карта меток произвольного разбиения зоны (set_label_map); None - плитки-прямоугольники self.tiles
+        self.labels = None
 
     def generate_tiles(self, tile_height, tile_width):
         """
@@ -51,24 +180,249 @@ class BasisGenerator:
                 tile_x_min = self.sub_x_min + j * tile_width
                 tile_x_max = tile_x_min + tile_width
                 self.tiles.append((tile_y_min, tile_y_max, tile_x_min, tile_x_max))
+        self.tiling = {"method": "uniform", "tile_height": tile_height, "tile_width": tile_width}
+        self.labels = None
+        return self.tiles
+
+    def _zone_wave(self, wave):
+        """Волна в координатах subduction_zone: полное поле обрезается, поле размера зоны берётся как есть."""
+        wave = np.asarray(wave, dtype=np.float64)
+        zone_shape = (self.sub_y_max - self.sub_y_min, self.sub_x_max - self.sub_x_min)
+        if wave.shape == (self.height, self.width):
+            return wave[self.sub_y_min:self.sub_y_max, self.sub_x_min:self.sub_x_max]
+        if wave.shape == zone_shape:
+            return wave
+        raise ValueError(f"Ожидалась волна размера {tuple(self.size)} или {zone_shape}, получено {wave.shape}")
+
+    def generate_adaptive_tiles(self, wave, min_tile=(10, 10), max_tiles=None, threshold=None, criterion="energy"):
+        """
+        Адаптивное разбиение subduction_zone (квадродерево): начиная со всей зоны, плитка с наибольшим
+        значением критерия делится на четыре (или на две, если по одной оси делить уже нельзя),
+        пока критерий самой "плохой" плитки больше threshold и число плиток не превысит max_tiles.
+
+        Критерий считается за O(1) на плитку по интегральным изображениям волны и её квадрата:
+          "energy"   - остаточная энергия sum((w - mean)^2) приближения волны константой на плитке,
+                       то есть вклад плитки в квадрат RMS-ошибки плиточного базиса;
+          "variance" - дисперсия волны на плитке (energy / число пикселей).
+
+        Параметры:
+          wave - волна: полное поле или поле размера subduction_zone;
+          min_tile - минимальный размер плитки (высота, ширина) или одно число для обеих осей;
+          max_tiles - целевое (наибольшее) число плиток;
+          threshold - плитки с критерием не больше threshold не делятся;
+          criterion - "energy" или "variance".
+
+        Нужно задать хотя бы одно из max_tiles и threshold. Плитки упорядочены по строкам,
+        как у generate_tiles, и сохраняются в self.tiles.
+        """
+        if criterion not in ADAPTIVE_CRITERIA:
+            raise ValueError(f"Неизвестный критерий {criterion}, доступны: {', '.join(ADAPTIVE_CRITERIA)}")
+        if max_tiles is None and threshold is None:
+            raise ValueError("Нужно задать max_tiles или threshold")
+        min_height, min_width = (min_tile, min_tile) if np.isscalar(min_tile) else min_tile
+        zone_wave = self._zone_wave(wave)
+        sums = integral_image(zone_wave)
+        sq_sums = integral_image(zone_wave ** 2)
+
+        def score(tile):
+            y0, y1, x0, x1 = tile
+            count = (y1 - y0) * (x1 - x0)
+            total = _box_sum(sums, y0, y1, x0, x1)
+            energy = max(_box_sum(sq_sums, y0, y1, x0, x1) - total * total / count, 0.0)
+            return energy if criterion == "energy" else energy / count
+
+        def split(tile):
+            y0, y1, x0, x1 = tile
+            ys = [y0, y0 + (y1 - y0) // 2, y1] if y1 - y0 >= 2 * min_height else [y0, y1]
+            xs = [x0, x0 + (x1 - x0) // 2, x1] if x1 - x0 >= 2 * min_width else [x0, x1]
+            return [(ys[i], ys[i + 1], xs[j], xs[j + 1]) for i in range(len(ys) - 1) for j in range(len(xs) - 1)]
+
+        root = (0, zone_wave.shape[0], 0, zone_wave.shape[1])
+        # Куча по убыванию критерия; счётчик делает порядок детерминированным при равных значениях
+        heap = [(-score(root), 0, root)]
+        final, counter, n_tiles = [], 1, 1
+        while heap:
+            neg_score, _, tile = heapq.heappop(heap)
+            if threshold is not None and -neg_score <= threshold:
+                final.append(tile)
+                final.extend(item[2] for item in heap)
+                break
+            children = split(tile)
+            if len(children) == 1 or (max_tiles is not None and n_tiles + len(children) - 1 > max_tiles):
+                final.append(tile)
+                continue
+            n_tiles += len(children) - 1
+            for child in children:
+                heapq.heappush(heap, (-score(child), counter, child))
+                counter += 1
+
+        self.tiles = [(self.sub_y_min + y0, self.sub_y_min + y1, self.sub_x_min + x0, self.sub_x_min + x1)
+                      for y0, y1, x0, x1 in sorted(final)]
+        self.tiling = {"method": "adaptive", "criterion": criterion, "threshold": threshold,
+                       "min_tile": [int(min_height), int(min_width)], "max_tiles": max_tiles}
+        self.labels = None
         return self.tiles
 
-    def generate_basis(self, tile_index, value=1.0):
+    def set_label_map(self, labels, tiling=None):
+        """
+        Задаёт разбиение subduction_zone произвольной целочисленной картой меток (ячейки Вороного,
+        полосы батиметрии, маски из изображения): базисная функция k равна value на области k.
+        Отрицательные метки - непокрытые пиксели. Метки перенумеровываются подряд (compact_labels),
+        в self.tiles записываются ограничивающие прямоугольники областей.
+
+        Параметры:
+          labels - карта меток размера subduction_zone или полного поля (тогда обрезается);
+          tiling - описание способа разбиения для манифеста.
+        """
+        labels = np.asarray(labels)
+        if labels.shape == (self.height, self.width):
+            labels = labels[self.sub_y_min:self.sub_y_max, self.sub_x_min:self.sub_x_max]
+        zone_shape = (self.sub_y_max - self.sub_y_min, self.sub_x_max - self.sub_x_min)
+        if labels.shape != zone_shape:
+            raise ValueError(f"Ожидалась карта меток размера {zone_shape}, получено {labels.shape}")
+        labels, n_regions = compact_labels(labels)
+        if n_regions == 0:
+            raise ValueError("Карта меток не содержит ни одной области")
+
+        ys, xs = np.nonzero(labels >= 0)
+        region = labels[ys, xs]
+        boxes = np.empty((4, n_regions), dtype=np.int64)
+        boxes[0], boxes[2] = np.iinfo(np.int64).max, np.iinfo(np.int64).max
+        boxes[1], boxes[3] = -1, -1
+        np.minimum.at(boxes[0], region, ys)
+        np.maximum.at(boxes[1], region, ys + 1)
+        np.minimum.at(boxes[2], region, xs)
+        np.maximum.at(boxes[3], region, xs + 1)
+        boxes += np.array([[self.sub_y_min], [self.sub_y_min], [self.sub_x_min], [self.sub_x_min]])
+
+        self.labels = labels
+        self.tiles = [tuple(int(v) for v in box) for box in boxes.T]
+        self.tiling = tiling or {"method": "labels"}
+        return self.tiles
+
+    def generate_voronoi(self, n_cells, seed=0):
+        """Разбиение зоны на n_cells ячеек Вороного со случайными центрами (воспроизводимо по seed)."""
+        zone_shape = (self.sub_y_max - self.sub_y_min, self.sub_x_max - self.sub_x_min)
+        rng = np.random.default_rng(seed)
+        seeds = rng.uniform((0, 0), zone_shape, size=(n_cells, 2))
+        return self.set_label_map(voronoi_labels(zone_shape, seeds),
+                                  {"method": "voronoi", "n_cells": n_cells, "seed": seed})
+
+    def generate_contour_regions(self, bath, levels, connected=False):
+        """Разбиение зоны изолиниями батиметрии bath (полное поле или зона) по уровням levels."""
+        bath = np.asarray(bath, dtype=np.float64)
+        if bath.shape == (self.height, self.width):
+            bath = bath[self.sub_y_min:self.sub_y_max, self.sub_x_min:self.sub_x_max]
+        return self.set_label_map(contour_labels(bath, levels, connected),
+                                  {"method": "contours", "levels": [float(v) for v in levels], "connected": connected})
+
+    def _smooth_profile(self, kind, center, size, scale, truncate, lo, hi):
+        """Одномерный профиль гладкой функции, обрезанный до [lo, hi): (первый пиксель, значения)."""
+        if kind == "hat":
+            radius = scale * size
+        else:
+            sigma = scale * size / 2.0
+            radius = truncate * sigma
+        start = max(lo, int(np.floor(center - radius)))
+        end = min(hi, int(np.ceil(center + radius)) + 1)
+        coords = np.arange(start, end, dtype=np.float64)
+        if kind == "hat":
+            profile = np.maximum(1.0 - np.abs(coords - center) / radius, 0.0)
+        else:
+            profile = np.exp(-(coords - center) ** 2 / (2 * sigma ** 2))
+            profile[np.abs(coords - center) > radius] = 0.0
+        return start, profile
+
+    def generate_smooth_basis(self, kind="hat", scale=1.0, truncate=3.0):
+        """
+        Гладкий базис с перекрывающимися компактными носителями, по функции на плитку self.tiles,
+        сразу в формате CSR (SparseBasis, n_layers x H*W) без плотных массивов полного поля.
+
+        Виды функций (центр - центр плитки, h и w - её размеры):
+          "hat"      - билинейная «шапка» (1 - |y - cy| / (scale * h)) * (1 - |x - cx| / (scale * w)),
+                       при scale=1 на равномерных плитках функции образуют разбиение единицы;
+          "gaussian" - гауссиана с sigma = scale * (h, w) / 2, обрезанная на truncate * sigma.
+        Носители обрезаются до subduction_zone.
+        """
+        if kind not in SMOOTH_KINDS:
+            raise ValueError(f"Неизвестный вид гладкого базиса {kind}, доступны: {', '.join(SMOOTH_KINDS)}")
+        if not self.tiles:
+            raise ValueError("Плитки не сгенерированы. Сначала вызовите generate_tiles().")
+        blocks = []
+        for y_min, y_max, x_min, x_max in self.tiles:
+            y0, col = self._smooth_profile(kind, (y_min + y_max - 1) / 2.0, y_max - y_min, scale, truncate,
+                                           self.sub_y_min, self.sub_y_max)
+            x0, row = self._smooth_profile(kind, (x_min + x_max - 1) / 2.0, x_max - x_min, scale, truncate,
+                                           self.sub_x_min, self.sub_x_max)
+            blocks.append((y0, x0, np.multiply.outer(col, row)))
+        self.tiling = dict(self.tiling or {}, smooth={"kind": kind, "scale": scale, "truncate": truncate})
+        return SparseBasis.from_blocks((self.height, self.width), blocks)
+
+    def label_map(self):
+        """
+        Карта меток плиток в координатах subduction_zone, shape зоны, int32:
+        номер плитки пикселя или -1, если пиксель не покрыт плитками.
+        """
+        if not self.tiles:
+            raise ValueError("Плитки не сгенерированы. Сначала вызовите generate_tiles().")
+        if self.labels is not None:
+            return self.labels.copy()
+        labels = np.full((self.sub_y_max - self.sub_y_min, self.sub_x_max - self.sub_x_min), -1, dtype=np.int32)
+        for index, (y_min, y_max, x_min, x_max) in enumerate(self.tiles):
+            labels[y_min - self.sub_y_min:y_max - self.sub_y_min, x_min - self.sub_x_min:x_max - self.sub_x_min] = index
+        return labels
+
+    def tile_manifest(self):
+        """Описание разбиения: размер поля, зона, параметры разбиения и плитки в порядке номеров базисных функций."""
+        if not self.tiles:
+            raise ValueError("Плитки не сгенерированы. Сначала вызовите generate_tiles().")
+        return {
+            "size": list(self.size),
+            "subduction_zone": list(self.subduction_zone),
+            "tiling": self.tiling,
+            "n_tiles": len(self.tiles),
+            # Для разбиения картой меток - ограничивающие прямоугольники областей, сами области - в labels.grid
+            "rectangular": self.labels is None,
+            "tiles": [[int(v) for v in tile] for tile in self.tiles],
+        }
+
+    def write_tiles(self, output_dir):
+        """
+        Записывает в output_dir манифест плиток (tiles.json) и карту меток (labels.grid, двоичная сетка
+        размера зоны). Оба файла одинаковы для равномерного и адаптивного разбиений.
+        """
+        return write_tile_files(output_dir, self.tile_manifest(), self.label_map())
+
+    def generate_basis(self, tile_index, value=1.0, lazy=False):
         """
         Генерирует 2D массив (размера size), заполненный нулями, за исключением одного прямоугольника,
         соответствующего плитке с индексом tile_index, где значения устанавливаются равными value.
+        Если разбиение задано картой меток (set_label_map), вместо прямоугольника - область tile_index.
 
         Параметры:
           tile_index - индекс плитки из ранее сгенерированного списка tiles;
-          value      - значение, которое будет записано внутри выбранной плитки (по умолчанию 1.0).
+          value      - значение, которое будет записано внутри выбранной плитки (по умолчанию 1.0);
+          lazy       - вернуть ленивое поле SeparableField с носителем в плитке вместо массива
+                       (write_to сохраняет только значения плитки и её положение).
         """
         if not self.tiles:
             raise ValueError("Плитки не сгенерированы. Сначала вызовите generate_tiles().")
         if tile_index < 0 or tile_index >= len(self.tiles):
             raise ValueError("Неверный индекс плитки.")
 
-        basis = np.zeros((self.height, self.width), dtype=float)
+        if self.labels is not None:
+            if lazy:
+                raise ValueError("Ленивое поле есть только у прямоугольных плиток, а разбиение задано картой меток")
+            basis = np.zeros((self.height, self.width), dtype=float)
+            zone = basis[self.sub_y_min:self.sub_y_max, self.sub_x_min:self.sub_x_max]
+            zone[self.labels == tile_index] = value
+            return basis
         y_min, y_max, x_min, x_max = self.tiles[tile_index]
+        if lazy:
+            return SeparableField((self.height, self.width),
+                                  [(value, np.ones(y_max - y_min), np.ones(x_max - x_min))],
+                                  offset=(y_min, x_min))
+        basis = np.zeros((self.height, self.width), dtype=float)
         basis[y_min:y_max, x_min:x_max] = value
         return basis
 
@@ -81,6 +435,7 @@ class BasisGenerator:
             raise ValueError("Плитки не сгенерированы. Сначала вызовите generate_tiles().")
 
         import matplotlib.patches as patches
+        import matplotlib.pyplot as plt
 
         fig, ax = plt.subplots(figsize=(8, 6))
         # Рисуем всю область subduction_zone
@@ -121,6 +476,8 @@ class BasisGenerator:
         if not self.tiles:
             raise ValueError("Плитки не сгенерированы. Сначала вызовите generate_tiles().")
 
+        import matplotlib.pyplot as plt
+
         current_index = 0
         fig, ax = plt.subplots(figsize=(3, 2))
         basis = self.generate_basis(tile_index=current_index, value=value)
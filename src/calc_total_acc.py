@@ -1,9 +1,45 @@
 import json
 import os
-import re
 import numpy as np
 from tqdm import tqdm  # Импорт tqdm для отображения прогресса
 
+from src.array_cache import cached_basis, cached_gram, cached_projection, cached_wave
+from src.coef_store import arrays_key, open_checkpoint, open_coefs, open_results, pending_runs, rows_per_chunk
+from src.engines import ENGINES, METRICS, accuracy_chunk, make_engine
+from src.grid_io import atomic_write_json
+from src.instrumentation import stage
+from src.loaders import DEFAULT_CONFIG_PATH, load_config
+from src.memory import RssMonitor, fit_chunk_size, format_size, parse_size
+from src.sparse_basis import SparseBasis
+
+
+def row_chunks(rows, chunk_size):
+    """
+    Разбивает строки коэффициентной сетки на блоки [start, end) по chunk_size строк.
+    Возвращает список пар (start, end).
+    """
+    return [(i, min(i + chunk_size, rows)) for i in range(0, rows, chunk_size)]
+
+
+def split_blocks(row_blocks, chunk_size):
+    """Разбивает блоки строк (start, end) на части не выше chunk_size строк."""
+    return [(s, min(s + chunk_size, end)) for start, end in row_blocks for s in range(start, end, chunk_size)]
+
+
+def default_engine(basis_stack, metrics):
+    """
+    Движок по умолчанию: sparse для разреженного базиса (SparseBasis), gram, если запрошено
+    только rms_accuracy, иначе эталонный reference.
+    """
+    if isinstance(basis_stack, SparseBasis):
+        return "sparse"
+    return "gram" if tuple(metrics) == ("rms_accuracy",) else "reference"
+
+
+def write_run_metadata(out_dir, run):
+    """Атомарно сохраняет сведения о расчёте (память, чанки) в <out_dir>/run_meta.json."""
+    atomic_write_json(os.path.join(out_dir, "run_meta.json"), run, indent=2)
+
 
 def load_json_data(filename):
     """
@@ -11,8 +47,10 @@ def load_json_data(filename):
     1. Массив коэффициентов размера (rows, cols, n_layers)
     2. Массив ошибок размера (rows, cols)
     """
-    with open(filename, "r") as f:
-        data = json.load(f)
+    with stage("json_parse", path=filename) as st:
+        with open(filename, "r") as f:
+            data = json.load(f)
+        st.add(bytes=os.path.getsize(filename), points=len(data))
 
     max_row, max_col = 0, 0
     n_layers = None
@@ -46,19 +84,28 @@ def load_json_data(filename):
 
 
 class TotalAccuracy:
-    def __init__(self, root_folder, bath_name, basis_name, wave_name):
+    def __init__(self, root_folder, bath_name, basis_name, wave_name, streaming=False, cache_dir=None,
+                 config_path=DEFAULT_CONFIG_PATH, zone="subduction_zone"):
+        """
+        Параметры:
+          root_folder - корневая папка с данными;
+          bath_name, basis_name, wave_name - имена bath, набора базисов и волны;
+          streaming - если True, коэффициенты не загружаются целиком, а открываются как
+                      memory-mapped массив (JSON один раз конвертируется в .npy) и читаются по блокам строк;
+          cache_dir - директория для .npy-файлов потокового режима (по умолчанию coeffs/memmap);
+          config_path - путь к zones.json;
+          zone - имя зоны из zones.json, до которой обрезаются волна и базис.
+        """
         self.root_folder = root_folder
         self.bath_name = bath_name
         self.basis_name = basis_name
         self.wave_name = wave_name
 
         # Загружаем конфигурацию зоны из файла zones.json
-        config_path = os.path.join("..", "config", "zones.json")
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = json.load(f)
+        config = load_config(config_path)
         self.size = config["size"]
         self.height, self.width = self.size
-        self.subduction_zone = config["subduction_zone"]
+        self.subduction_zone = config[zone]
         self.sub_y_min, self.sub_y_max, self.sub_x_min, self.sub_x_max = self.subduction_zone
 
         # Формируем пути к файлам
@@ -75,41 +122,71 @@ class TotalAccuracy:
         # Загружаем данные: волну, базисные функции и коэффициенты
         self.wave = self._load_wave()
         self.basis = self._load_basis()
-        self.coefs, self.errors = load_json_data(self.coefs_path)
+        self.gram = None
+        self.projection = None
+        if streaming:
+            self.coefs, self.errors = open_coefs(self.coefs_path, cache_dir)
+        else:
+            self.coefs, self.errors = load_json_data(self.coefs_path)
+
+    @classmethod
+    def from_arrays(cls, wave, basis, coefs, errors=None, gram=None, sources=None, projection=None):
+        """
+        Создаёт калькулятор из уже загруженных массивов, минуя чтение файлов.
+        Используется, когда волна, базис и матрица Грама переиспользуются между расчётами.
+
+        Параметры:
+          wave - обрезанная волна (H, W);
+          basis - базисные функции (n_layers, H, W) или их список;
+          coefs, errors - результат load_json_data или open_coefs;
+          gram - готовая матрица Грама базиса (необязательно);
+          sources - (wave_path, basis_directory, zone), из которых получены wave и basis: тогда матрица
+                    Грама и проекции волны берутся из кеша src.array_cache (необязательно);
+          projection - готовые проекции волны на базис (n_layers,), например из src.engines.wave_projections
+                    для нескольких волн сразу (необязательно).
+        """
+        calculator = cls.__new__(cls)
+        calculator.wave = wave
+        calculator.basis = basis
+        calculator.coefs = coefs
+        calculator.errors = errors
+        calculator.gram = gram
+        calculator.projection = projection
+        calculator.wave_path, calculator.basis_directory, calculator.subduction_zone = sources or (None, None, None)
+        return calculator
 
     def _load_basis(self, regex_pattern=r".*?(\d+)\.wave"):
         """
         Загружает базисные функции из файлов в директории self.basis_directory.
         Имена файлов должны соответствовать шаблону regex_pattern для извлечения индекса.
         Каждая функция обрезается до области subduction_zone.
+        Разреженный базис (basis.csr.npz) загружается как SparseBasis.
+        Базис берётся из кеша src.array_cache: повторная загрузка тех же файлов - memory-mapped массив.
         """
-        files = os.listdir(self.basis_directory)
-        basis_files = {}
-
-        # Фильтрация файлов по регулярному выражению и извлечение индекса
-        for filename in files:
-            match = re.search(regex_pattern, filename)
-            if match:
-                index = int(match.group(1))
-                full_path = os.path.join(self.basis_directory, filename)
-                basis_files[index] = full_path
-
-        loaded_bases = []
-        for index in sorted(basis_files.keys()):
-            data = np.loadtxt(basis_files[index])
-            cropped = data[self.sub_y_min:self.sub_y_max, self.sub_x_min:self.sub_x_max]
-            loaded_bases.append(cropped)
-        return loaded_bases
+        return cached_basis(self.basis_directory, self.subduction_zone, regex_pattern)
 
     def _load_wave(self):
         """
-        Загружает волну из файла self.wave_path и обрезает её до области subduction_zone.
+        Загружает волну из файла self.wave_path и обрезает её до области subduction_zone (через кеш).
         """
-        data = np.loadtxt(self.wave_path)
-        wave = data[self.sub_y_min:self.sub_y_max, self.sub_x_min:self.sub_x_max]
-        return wave
-
+        return cached_wave(self.wave_path, self.subduction_zone)
 
+    def _precomputed(self, engine_name, basis_stack):
+        """
+        Готовые величины для движка engine_name: переданные в from_arrays проекции волны или
+        матрица Грама (в self.gram) и проекции из кеша src.array_cache. Пусто, если движку они
+        не нужны или их неоткуда взять.
+        """
+        if not ENGINES.get(engine_name, ENGINES["reference"]).precomputed:
+            return {}
+        if self.projection is not None:
+            return {"projection": self.projection}
+        if self.basis_directory is None:
+            return {}
+        if self.gram is None:
+            self.gram = cached_gram(self.basis_directory, self.subduction_zone, basis_stack)
+        return {"projection": cached_projection(self.wave_path, self.basis_directory, self.subduction_zone,
+                                                basis_stack, wave=self.wave)}
 
     @staticmethod
     def get_accuracy_static(config_path, wave_path, basis_directory, coefs_path, chunk_size=37):
@@ -126,62 +203,123 @@ class TotalAccuracy:
           - max_value_diff: нормированную разницу максимальных значений.
         """
         # Загружаем конфигурацию зоны
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = json.load(f)
-        subduction_zone = config["subduction_zone"]
-        sub_y_min, sub_y_max, sub_x_min, sub_x_max = subduction_zone
-
-        # Загружаем волну и обрезаем до области subduction_zone
-        data = np.loadtxt(wave_path)
-        wave = data[sub_y_min:sub_y_max, sub_x_min:sub_x_max]
-
-        # Загружаем базисные функции из директории basis_directory
-        files = os.listdir(basis_directory)
-        basis_files = {}
-        regex_pattern = r".*?(\d+)\.wave"
-        for filename in files:
-            match = re.search(regex_pattern, filename)
-            if match:
-                index = int(match.group(1))
-                full_path = os.path.join(basis_directory, filename)
-                basis_files[index] = full_path
-
-        loaded_bases = []
-        for index in sorted(basis_files.keys()):
-            basis_data = np.loadtxt(basis_files[index])
-            cropped = basis_data[sub_y_min:sub_y_max, sub_x_min:sub_x_max]
-            loaded_bases.append(cropped)
-        basis_stack = np.stack(loaded_bases, axis=0)
+        subduction_zone = load_config(config_path)["subduction_zone"]
+
+        # Загружаем волну и базисные функции, обрезанные до области subduction_zone
+        wave = cached_wave(wave_path, subduction_zone)
+        basis_stack = cached_basis(basis_directory, subduction_zone, dense=True)
 
         # Загружаем коэффициенты и ошибки
         coefs, errors = load_json_data(coefs_path)
         rows, cols, _ = coefs.shape
 
-        rms_accuracy = np.empty((rows, cols))
-        max_accuracy = np.empty((rows, cols))
-        max_value_diff = np.empty((rows, cols))
+        results = {key: np.empty((rows, cols)) for key in METRICS}
 
         wave_rms = np.sqrt(np.mean(wave ** 2))
         wave_max = np.max(np.abs(wave))
 
         # Обработка коэффициентной сетки чанками
-        for i in tqdm(range(0, rows, chunk_size), desc="Вычисление точности"):
-            end = min(i + chunk_size, rows)
-            reconstruction_chunk = np.tensordot(coefs[i:end, :, :], basis_stack, axes=([2], [0]))
-            diff_chunk = wave - reconstruction_chunk
-            rms_accuracy[i:end, :] = np.sqrt(np.mean(diff_chunk ** 2, axis=(2, 3))) / wave_rms
-            max_accuracy[i:end, :] = np.max(np.abs(diff_chunk), axis=(2, 3)) / wave_max
-            max_reconstructed_chunk = np.max(np.abs(reconstruction_chunk), axis=(2, 3))
-            max_value_diff[i:end, :] = np.abs(max_reconstructed_chunk - wave_max) / wave_max
-
-        return {
-            "rms_accuracy": rms_accuracy,
-            "max_accuracy": max_accuracy,
-            "max_value_diff": max_value_diff
-        }
+        for i, end in tqdm(row_chunks(rows, chunk_size), desc="Вычисление точности"):
+            chunk = accuracy_chunk(coefs[i:end, :, :], basis_stack, wave, wave_rms, wave_max)
+            for key, block in chunk.items():
+                results[key][i:end, :] = block
+
+        return results
+
+    def basis_stack(self):
+        """Базисные функции одним массивом shape (n_layers, H, W); разреженный базис возвращается как есть."""
+        if isinstance(self.basis, (np.ndarray, SparseBasis)):
+            return self.basis
+        return np.stack(self.basis, axis=0)
+
+    def plan_chunks(self, memory_model, chunk_size=37, row_blocks=None, memory_budget=None, n_metrics=len(METRICS),
+                    memory_limit=None, on_exceed="shrink", results_in_memory=False):
+        """
+        Блоки строк расчёта по модели памяти движка memory_model (pixel_arrays, layer_arrays, concurrency):
+        chunk_size подгоняется под memory_budget и memory_limit (см. iter_accuracy).
+        Возвращает (блоки строк, chunk_size, запрошенный chunk_size, предсказание пика памяти).
+        """
+        rows, cols, n_layers = self.coefs.shape
+        if row_blocks:
+            # Заданные блоки обрабатываются целиком, если помещаются в бюджет и лимит
+            chunk_size = max(end - start for start, end in row_blocks)
+        if memory_budget is not None:
+            budget_rows = rows_per_chunk(memory_budget, cols, n_layers, *self.wave.shape, **memory_model)
+            chunk_size = min(chunk_size, budget_rows) if row_blocks else budget_rows
+        requested_chunk_size = chunk_size
+        chunk_size, prediction = fit_chunk_size(parse_size(memory_limit), on_exceed, rows, cols, n_layers,
+                                                *self.wave.shape, chunk_size, n_metrics=n_metrics,
+                                                results_in_memory=results_in_memory, **memory_model)
+        if chunk_size < requested_chunk_size:
+            print(f"Чанк уменьшен с {requested_chunk_size} до {chunk_size} строк: предсказанный пик "
+                  f"{format_size(prediction['total'])} при лимите {format_size(parse_size(memory_limit))}")
+
+        if row_blocks is None:
+            row_blocks = row_chunks(rows, chunk_size)
+        else:
+            row_blocks = split_blocks(row_blocks, chunk_size)
+        return row_blocks, chunk_size, requested_chunk_size, prediction
+
+    def iter_accuracy(self, chunk_size=37, row_blocks=None, memory_budget=None, metrics=METRICS, engine=None,
+                      memory_limit=None, on_exceed="shrink", results_in_memory=False):
+        """
+        Потоковый расчёт метрик: по мере готовности каждого чанка выдаёт (row_slice, {метрика: блок}),
+        где row_slice - срез строк коэффициентной сетки, блок - массив (строки чанка, cols).
+        Полные карты не хранятся, так что результаты можно сразу писать, рисовать или сводить.
 
+            for rows, blocks in calculator.iter_accuracy(metrics=("rms_accuracy",)):
+                writer[rows] = blocks["rms_accuracy"]
+
+        Параметры chunk_size, row_blocks, memory_budget, metrics, engine, memory_limit, on_exceed -
+        как у get_accuracy; results_in_memory - учитывать ли в предсказании пика памяти полные карты
+        результатов, которые держит вызывающий код. Движок и чанк выбираются до первого блока,
+        self.last_run и self.gram обновляются после последнего.
+        """
+        metrics = tuple(metrics)
+        # Объединяем базисные функции в массив shape (n_layers, H, W)
+        basis_stack = self.basis_stack()
+
+        if engine is None:
+            engine = default_engine(basis_stack, metrics)
+        if isinstance(engine, str):
+            options = self._precomputed(engine, basis_stack)
+            engine = make_engine(engine, self.wave, basis_stack, gram=self.gram, **options)
+        missing = [key for key in metrics if key not in engine.metrics]
+        if missing:
+            raise ValueError(f"Движок {engine.name} не считает метрики: {', '.join(missing)}")
+
+        memory_model = dict(pixel_arrays=engine.pixel_arrays, layer_arrays=engine.layer_arrays,
+                            concurrency=engine.concurrency)
+        row_blocks, chunk_size, requested_chunk_size, prediction = self.plan_chunks(
+            memory_model, chunk_size, row_blocks, memory_budget, len(metrics), memory_limit, on_exceed,
+            results_in_memory)
+
+        # np.asarray читает из memmap только строки текущего блока
+        blocks = (((i, end), np.asarray(self.coefs[i:end, :, :]))
+                  for i, end in tqdm(row_blocks, desc="Вычисление точности"))
+        monitor = RssMonitor().start()
+        try:
+            # Обработка строк коэффициентной сетки чанками
+            for (i, end), chunk in engine.map_chunks(blocks, metrics):
+                yield slice(i, end), {key: chunk[key] for key in metrics}
+                del chunk
+                monitor.mark(i, end)
+        finally:
+            observed = monitor.stop()
+        # Матрица Грама, построенная движком, переиспользуется следующими расчётами с тем же базисом
+        self.gram = engine.gram
+        self.last_run = {
+            "engine": engine.name,
+            "chunk_size": chunk_size,
+            "requested_chunk_size": requested_chunk_size,
+            "memory_limit": parse_size(memory_limit),
+            "predicted": prediction,
+            "peak_rss": observed["peak_rss"],
+            "chunks": observed["chunks"],
+        }
 
-    def get_accuracy(self, chunk_size=37):
+    def get_accuracy(self, chunk_size=37, row_blocks=None, out_dir=None, memory_budget=None, metrics=METRICS,
+                     engine=None, memory_limit=None, on_exceed="shrink", checkpoint=False):
         """
         Вычисляет нормированные показатели аппроксимации для каждой точки
         из загруженных коэффициентов. Для каждой точки (row, col) рассчитываются:
@@ -194,43 +332,76 @@ class TotalAccuracy:
              max_diff = max(abs(diff)) / wave_max,
              где wave_max = max(abs(self.wave)).
 
-        Вычисление производится чанками по строкам с использованием tqdm для отображения прогресса.
+        Вычисление производится чанками по строкам (iter_accuracy) с использованием tqdm для отображения
+        прогресса; блоки собираются в полные карты.
+
+        Параметры:
+          chunk_size - число строк коэффициентной сетки в одном чанке;
+          row_blocks - необязательный список пар (start, end): если задан, считаются только
+                       эти блоки строк, а остальные строки результата заполняются NaN;
+          out_dir    - если задан, карты метрик пишутся в memory-mapped файлы <out_dir>/<metric>.npy
+                       вместо массивов в памяти;
+          memory_budget - бюджет памяти на чанк в байтах; если задан, chunk_size подбирается так,
+                       чтобы временные массивы чанка не превышали бюджет;
+          metrics    - имена вычисляемых метрик;
+          engine     - движок расчёта: имя из src.engines.ENGINES или готовый объект движка.
+                       По умолчанию эталонный reference, а если запрошено только rms_accuracy -
+                       gram (через матрицу Грама базиса без построения реконструкций),
+                       для разреженного базиса (SparseBasis) - sparse.
+                       Совпадение движков с эталоном проверяет scripts/check_engines.py;
+          memory_limit - лимит пиковой памяти процесса (байты или строка '8G'). Пик предсказывается
+                       по формам массивов до начала расчёта (src.memory.predict_peak); при превышении
+                       чанк уменьшается (on_exceed="shrink") или расчёт не начинается с MemoryError
+                       (on_exceed="refuse");
+          checkpoint - расчёт с контрольными точками в out_dir (обязателен): каждый готовый чанк
+                       сбрасывается в memory-mapped карты, а его строки отмечаются в progress.npy
+                       (src.coef_store.open_checkpoint). Повторный запуск с теми же входами пропускает
+                       готовые строки и досчитывает остальные, так что прерванный расчёт не теряется.
+
+        Предсказание, итоговый размер чанка и RSS после каждого чанка сохраняются в self.last_run
+        (и в <out_dir>/run_meta.json, если задан out_dir).
 
         Возвращает:
-          Два 2D массива размера (rows, cols):
-            - rms_accuracy: нормированное RMS отклонение.
-            - max_accuracy: нормированное максимальное отклонение.
+          Словарь {имя метрики: 2D массив (rows, cols)} для запрошенных метрик.
         """
-        # Объединяем базисные функции в массив shape (n_layers, H, W)
-        basis_stack = np.stack(self.basis, axis=0)
-        rows, cols, _ = self.coefs.shape
-
-        rms_accuracy = np.empty((rows, cols))
-        max_accuracy = np.empty((rows, cols))
-        max_value_diff = np.empty((rows, cols))
-        # Вычисляем RMS и максимальное значение волны
-        wave_rms = np.sqrt(np.mean(self.wave ** 2))
-        wave_max = np.max(np.abs(self.wave))
-
-        # Обработка строк коэффициентной сетки чанками
-        for i in tqdm(range(0, rows, chunk_size), desc="Вычисление точности"):
-            end = min(i + chunk_size, rows)
-            # Вычисляем реконструкцию для чанка коэффициентов:
-            # self.coefs[i:end, :, :] имеет shape (chunk, cols, n_layers)
-            # Результат tensordot с basis_stack имеет shape (chunk, cols, H, W)
-            reconstruction_chunk = np.tensordot(self.coefs[i:end, :, :], basis_stack, axes=([2], [0]))
-            # Вычисляем разницу между волной и реконструкцией
-            diff_chunk = self.wave - reconstruction_chunk  # broadcasting: (chunk, cols, H, W)
-            # Нормированное RMS отклонение для каждой точки
-            rms_accuracy[i:end, :] = np.sqrt(np.mean(diff_chunk ** 2, axis=(2, 3))) / wave_rms
-            # Нормированное максимальное отклонение для каждой точки
-            max_accuracy[i:end, :] = np.max(np.abs(diff_chunk), axis=(2, 3)) / wave_max
-            # Вычисляем дополнительный показатель:
-            # Абсолютная разница между максимальным значением реконструкции и wave_max, нормированная на wave_max
-            max_reconstructed_chunk = np.max(np.abs(reconstruction_chunk), axis=(2, 3))
-            max_value_diff[i:end, :] = np.abs(max_reconstructed_chunk - wave_max) / wave_max
-        return {
-        "rms_accuracy": rms_accuracy,
-        "max_accuracy": max_accuracy,
-        "max_value_diff": max_value_diff
-        }
+        metrics = tuple(metrics)
+        if checkpoint and out_dir is None:
+            raise ValueError("Для расчёта с контрольными точками нужен out_dir")
+        rows, cols = self.coefs.shape[:2]
+
+        progress = None
+        if checkpoint:
+            basis_stack = self.basis_stack()
+            basis_arrays = ((basis_stack.indptr, basis_stack.indices, basis_stack.data)
+                            if isinstance(basis_stack, SparseBasis) else (basis_stack,))
+            with stage("checkpoint_key"):
+                inputs_key = arrays_key(self.wave, *basis_arrays, self.coefs)
+            results, progress = open_checkpoint(out_dir, (rows, cols), metrics, inputs_key)
+        elif out_dir is not None:
+            results = open_results(out_dir, (rows, cols), metrics)
+        else:
+            results = {key: np.full((rows, cols), np.nan) for key in metrics}
+
+        skipped_rows = 0
+        if progress is not None:
+            # Готовые строки прошлых запусков не пересчитываются
+            blocks = row_chunks(rows, chunk_size) if row_blocks is None else split_blocks(row_blocks, chunk_size)
+            row_blocks = pending_runs(blocks, progress)
+            skipped_rows = sum(end - start for start, end in blocks) - sum(end - start for start, end in row_blocks)
+
+        for row_slice, chunk in self.iter_accuracy(chunk_size, row_blocks, memory_budget, metrics, engine,
+                                                   memory_limit, on_exceed, results_in_memory=out_dir is None):
+            for key in metrics:
+                results[key][row_slice, :] = chunk[key]
+            if progress is not None:
+                # Строки отмечаются готовыми только после сброса их значений на диск
+                for value in results.values():
+                    value.flush()
+                progress[row_slice] = 1
+                progress.flush()
+        self.last_run["skipped_rows"] = skipped_rows
+        if out_dir is not None:
+            for value in results.values():
+                value.flush()
+            write_run_metadata(out_dir, self.last_run)
+        return results
@@ -0,0 +1,251 @@
+import os
+
+import numpy as np
+from tqdm import tqdm
+
+from src.array_cache import cached_basis, cached_gram, cached_wave
+from src.calc_total_acc import METRICS, TotalAccuracy, default_engine, load_json_data, write_run_metadata
+from src.coef_store import open_coefs, open_results
+from src.engines import ENGINES, GramEngine, gram_matrix, rms_chunks_gram, wave_projections
+from src.instrumentation import stage
+from src.loaders import DEFAULT_CONFIG_PATH, load_config
+from src.memory import RssMonitor, parse_size
+from src.sparse_basis import SparseBasis
+
+
+class TotalAccuracyBatch:
+    """
+    Точность нескольких волн для одного bath и одного базиса: базис загружается один раз,
+    проекции всех волн на базис считаются одним матричным произведением (src.engines.wave_projections),
+    матрица Грама строится (или берётся из кеша) один раз и только для движков, которые её используют.
+    С движком gram блок строк коэффициентов всех волн считается одним сжатием (rms_chunks_gram);
+    с остальными движками каждая волна считается своим TotalAccuracy с общими базисом, матрицей
+    Грама и готовой проекцией - их метрики требуют реконструкций, свои для каждой волны.
+
+        batch = TotalAccuracyBatch(root, "x_200_2000", "basis_12", ["gaus_single_1_real", "async_gaus_single_2"])
+        maps = batch.get_accuracy(metrics=("rms_accuracy",))
+        maps["async_gaus_single_2"]["rms_accuracy"]
+    """
+
+    def __init__(self, root_folder, bath_name, basis_name, wave_names, streaming=False, cache_dir=None,
+                 config_path=DEFAULT_CONFIG_PATH, zone="subduction_zone"):
+        """
+        Параметры:
+          root_folder - корневая папка с данными;
+          bath_name, basis_name - имена bath и базиса;
+          wave_names - список имён волн; коэффициенты каждой волны - файл
+                       case_statistics_{wave_name}_{basis_name}_{bath_name}_all.json;
+          streaming - если True, коэффициенты открываются как memory-mapped массивы и читаются по блокам строк;
+          cache_dir - директория для .npy-файлов потокового режима (по умолчанию coeffs/memmap);
+          config_path - путь к zones.json;
+          zone - имя зоны из zones.json, до которой обрезаются волны и базис.
+        """
+        self.root_folder = root_folder
+        self.bath_name = bath_name
+        self.basis_name = basis_name
+        self.wave_names = list(wave_names)
+
+        config = load_config(config_path)
+        self.subduction_zone = config[zone]
+        # Директория базиса - источник матрицы Грама из кеша (_prepare_gram)
+        self.basis_directory = os.path.join(root_folder, "basises", basis_name)
+
+        basis = cached_basis(self.basis_directory, self.subduction_zone)
+        waves, coefs, errors = [], [], []
+        for wave_name in self.wave_names:
+            waves.append(cached_wave(os.path.join(root_folder, "waves", f"{wave_name}.wave"), self.subduction_zone))
+            coefs_path = os.path.join(root_folder, "coeffs",
+                                      f"case_statistics_{wave_name}_{basis_name}_{bath_name}_all.json")
+            if streaming:
+                wave_coefs, wave_errors = open_coefs(coefs_path, cache_dir)
+            else:
+                wave_coefs, wave_errors = load_json_data(coefs_path)
+            coefs.append(wave_coefs)
+            errors.append(wave_errors)
+        self._setup(self.wave_names, waves, basis, coefs, errors, None)
+
+    @classmethod
+    def from_arrays(cls, waves, basis, coefs, errors=None, gram=None):
+        """
+        Создаёт калькулятор из уже загруженных массивов, минуя чтение файлов.
+
+        Параметры:
+          waves - словарь {wave_name: обрезанная волна (H, W)};
+          basis - базисные функции (n_layers, H, W) или SparseBasis, общие для всех волн;
+          coefs - словарь {wave_name: коэффициенты (rows, cols, n_layers)};
+          errors - словарь {wave_name: ошибки (rows, cols)} (необязательно);
+          gram - готовая матрица Грама базиса (необязательно).
+        """
+        calculator = cls.__new__(cls)
+        calculator.basis_directory = calculator.subduction_zone = None
+        calculator.wave_names = list(waves)
+        errors = errors or {}
+        calculator._setup(calculator.wave_names, [waves[name] for name in calculator.wave_names], basis,
+                          [coefs[name] for name in calculator.wave_names],
+                          [errors.get(name) for name in calculator.wave_names], gram)
+        return calculator
+
+    def _setup(self, wave_names, waves, basis, coefs, errors, gram):
+        """Общие базис и матрица Грама, проекции всех волн одним произведением и калькуляторы волн."""
+        if not isinstance(basis, (np.ndarray, SparseBasis)):
+            basis = np.stack(basis, axis=0)
+        self.basis = basis
+        self.gram = gram
+        with stage("batch_setup", waves=len(wave_names)):
+            self.projections = wave_projections(basis, np.stack(waves, axis=0))
+        self.calculators = {
+            name: TotalAccuracy.from_arrays(wave, basis, wave_coefs, wave_errors, gram=gram, projection=projection)
+            for name, wave, wave_coefs, wave_errors, projection in zip(wave_names, waves, coefs, errors,
+                                                                      self.projections)
+        }
+
+    @property
+    def errors(self):
+        """Карты aprox_error волн: {wave_name: (rows, cols)}."""
+        return {name: calculator.errors for name, calculator in self.calculators.items()}
+
+    def _set_gram(self, gram):
+        self.gram = gram
+        for calculator in self.calculators.values():
+            calculator.gram = gram
+
+    def _share_gram(self, calculator):
+        # Матрица Грама, построенная движком первой волны, достаётся остальным
+        if self.gram is None and calculator.gram is not None:
+            self._set_gram(calculator.gram)
+
+    def _prepare_gram(self, engine):
+        """
+        Матрица Грама из кеша src.array_cache для движков, которые её используют (gram, sparse);
+        для остальных движков она не строится. Без директории базиса (from_arrays) матрицу строит
+        движок первой волны или пакетный расчёт gram.
+        """
+        if self.gram is not None or self.basis_directory is None or not isinstance(engine, str):
+            return
+        if "gram" in ENGINES.get(engine, ENGINES["reference"]).precomputed:
+            self._set_gram(cached_gram(self.basis_directory, self.subduction_zone, self.basis))
+
+    def _batched(self, engine, metrics):
+        """Пакетный расчёт gram возможен: только RMS, и сетки коэффициентов и волны всех волн одной формы."""
+        calculators = list(self.calculators.values())
+        return (engine == GramEngine.name and set(metrics) <= set(GramEngine.metrics)
+                and len({calculator.coefs.shape for calculator in calculators}) == 1
+                and len({calculator.wave.shape for calculator in calculators}) == 1)
+
+    def _iter_gram(self, chunk_size, memory_budget, memory_limit, on_exceed, results_in_memory):
+        """
+        Движок gram для всех волн сразу: блок строк коэффициентов всех волн складывается в массив
+        (n_waves, chunk, cols, n_layers), и RMS всех волн считается одним сжатием с общей матрицей Грама.
+        Выдаёт (wave_name, row_slice, {"rms_accuracy": блок}): блок за блоком, внутри блока - волны по порядку.
+        """
+        calculators = [self.calculators[name] for name in self.wave_names]
+        first = calculators[0]
+        if self.gram is None:
+            self._set_gram(self.basis.gram() if isinstance(self.basis, SparseBasis) else gram_matrix(self.basis))
+        waves = np.stack([calculator.wave for calculator in calculators])
+        wave_sq_sums = np.sum(waves ** 2, axis=(1, 2))
+        wave_rms = np.sqrt(wave_sq_sums / first.wave.size)
+
+        # Временные массивы чанка - у каждой волны свои, как у n_waves одновременных расчётов gram
+        memory_model = dict(pixel_arrays=GramEngine.pixel_arrays, layer_arrays=GramEngine.layer_arrays,
+                            concurrency=len(calculators))
+        row_blocks, chunk_size, requested_chunk_size, prediction = first.plan_chunks(
+            memory_model, chunk_size, None, memory_budget, len(calculators), memory_limit, on_exceed,
+            results_in_memory)
+        monitor = RssMonitor().start()
+        try:
+            for i, end in tqdm(row_blocks, desc="Вычисление точности"):
+                with stage("compute", engine=GramEngine.name, waves=len(calculators)) as st:
+                    # np.asarray читает из memmap только строки текущего блока
+                    coefs_chunks = np.stack([np.asarray(calculator.coefs[i:end, :, :]) for calculator in calculators])
+                    rms = rms_chunks_gram(coefs_chunks, self.gram, self.projections, wave_sq_sums, first.wave.size,
+                                          wave_rms)
+                    st.add(points=rms.size)
+                for name, block in zip(self.wave_names, rms):
+                    yield name, slice(i, end), {"rms_accuracy": block}
+                monitor.mark(i, end)
+        finally:
+            observed = monitor.stop()
+        run = {
+            "engine": GramEngine.name,
+            "batched_waves": len(calculators),
+            "chunk_size": chunk_size,
+            "requested_chunk_size": requested_chunk_size,
+            "memory_limit": parse_size(memory_limit),
+            "predicted": prediction,
+            "peak_rss": observed["peak_rss"],
+            "chunks": observed["chunks"],
+        }
+        for name, calculator in zip(self.wave_names, calculators):
+            calculator.last_run = dict(run)
+            self.last_run[name] = calculator.last_run
+
+    def iter_accuracy(self, chunk_size=37, memory_budget=None, metrics=METRICS, engine=None, memory_limit=None,
+                      on_exceed="shrink"):
+        """
+        Потоковый расчёт всех волн: выдаёт (wave_name, row_slice, {метрика: блок}) по мере готовности
+        чанков (см. TotalAccuracy.iter_accuracy). С движком gram - блок за блоком для всех волн сразу,
+        с остальными движками - волна за волной по порядку wave_names.
+        Сведения о расчёте волн - в self.last_run = {wave_name: last_run}.
+        """
+        metrics = tuple(metrics)
+        engine = default_engine(self.basis, metrics) if engine is None else engine
+        self._prepare_gram(engine)
+        self.last_run = {}
+        if self._batched(engine, metrics):
+            yield from self._iter_gram(chunk_size, memory_budget, memory_limit, on_exceed, results_in_memory=False)
+            return
+        for name, calculator in self.calculators.items():
+            for row_slice, blocks in calculator.iter_accuracy(chunk_size, memory_budget=memory_budget,
+                                                              metrics=metrics, engine=engine,
+                                                              memory_limit=memory_limit, on_exceed=on_exceed):
+                yield name, row_slice, blocks
+            self._share_gram(calculator)
+            self.last_run[name] = calculator.last_run
+
+    def get_accuracy(self, chunk_size=37, out_dir=None, memory_budget=None, metrics=METRICS, engine=None,
+                     memory_limit=None, on_exceed="shrink"):
+        """
+        Карты метрик всех волн (параметры - как у TotalAccuracy.get_accuracy).
+        out_dir - если задан, карты волны пишутся в memory-mapped файлы <out_dir>/<wave_name>/<metric>.npy.
+
+        Возвращает словарь {wave_name: {имя метрики: 2D массив (rows, cols)}};
+        сведения о расчёте волн - в self.last_run = {wave_name: last_run}.
+        """
+        metrics = tuple(metrics)
+        engine = default_engine(self.basis, metrics) if engine is None else engine
+        self._prepare_gram(engine)
+        if self._batched(engine, metrics):
+            return self._get_gram(chunk_size, out_dir, memory_budget, metrics, memory_limit, on_exceed)
+        results = {}
+        self.last_run = {}
+        for name, calculator in self.calculators.items():
+            wave_dir = os.path.join(out_dir, name) if out_dir is not None else None
+            results[name] = calculator.get_accuracy(chunk_size, out_dir=wave_dir, memory_budget=memory_budget,
+                                                    metrics=metrics, engine=engine, memory_limit=memory_limit,
+                                                    on_exceed=on_exceed)
+            self._share_gram(calculator)
+            self.last_run[name] = calculator.last_run
+        return results
+
+    def _get_gram(self, chunk_size, out_dir, memory_budget, metrics, memory_limit, on_exceed):
+        """Полные карты пакетного расчёта gram (_iter_gram) для get_accuracy."""
+        self.last_run = {}
+        results = {}
+        for name, calculator in self.calculators.items():
+            shape = calculator.coefs.shape[:2]
+            if out_dir is not None:
+                results[name] = open_results(os.path.join(out_dir, name), shape, metrics)
+            else:
+                results[name] = {key: np.full(shape, np.nan) for key in metrics}
+        for name, row_slice, blocks in self._iter_gram(chunk_size, memory_budget, memory_limit, on_exceed,
+                                                       results_in_memory=out_dir is None):
+            for key in metrics:
+                results[name][key][row_slice, :] = blocks[key]
+        for name in self.wave_names:
+            self.last_run[name]["skipped_rows"] = 0
+            if out_dir is not None:
+                for value in results[name].values():
+                    value.flush()
+                write_run_metadata(os.path.join(out_dir, name), self.last_run[name])
+        return results
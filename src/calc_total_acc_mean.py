@@ -1,26 +1,15 @@
 import json
 import os
-import re
 import numpy as np
 from tqdm import tqdm  # Импорт tqdm для отображения прогресса
 
+from src.array_cache import cached_basis, cached_wave
+from src.calc_total_acc import METRICS, write_run_metadata
+from src.coef_store import CHUNK_ARRAY_FACTOR, open_coefs, open_results, rows_per_chunk
+from src.instrumentation import stage
+from src.loaders import DEFAULT_CONFIG_PATH, load_config
+from src.memory import RssMonitor, fit_chunk_size, format_size, parse_size
 
-def average_reconstructions(reconstruction_list, basis_name):
-    """
-    Вычисляет среднее арифметическое реконструкций.
-
-    Параметры:
-      reconstruction_list: список numpy-массивов реконструкций.
-      basis_name: имя базисной функции (пока не используется).
-
-    Возвращает:
-      Среднюю реконструкцию как numpy-массив.
-    """
-    mean_reconstruction = np.zeros_like(reconstruction_list[0])
-    for rec in reconstruction_list:
-        mean_reconstruction += rec
-    mean_reconstruction /= len(reconstruction_list)
-    return mean_reconstruction
 
 def load_json_data(filename):
     """
@@ -63,13 +52,19 @@ def load_json_data(filename):
 
 
 class TotalAccuracyMean:
-    def __init__(self, root_folder, bath_name, basis_names, wave_name):
+    def __init__(self, root_folder, bath_name, basis_names, wave_name, streaming=False, cache_dir=None,
+                 config_path=DEFAULT_CONFIG_PATH, zone="subduction_zone"):
         """
         Параметры:
           root_folder - корневая папка с данными;
           bath_name - имя bath;
           basis_names - список имён базисов (например, ['basis1', 'basis2', ...]);
-          wave_name - имя волны.
+          wave_name - имя волны;
+          streaming - если True, коэффициенты каждого базиса открываются как memory-mapped массивы
+                      и читаются по блокам строк, а не держатся в памяти целиком;
+          cache_dir - директория для .npy-файлов потокового режима (по умолчанию coeffs/memmap);
+          config_path - путь к zones.json;
+          zone - имя зоны из zones.json, до которой обрезаются волна и базисы.
         """
         self.root_folder = root_folder
         self.bath_name = bath_name
@@ -77,12 +72,10 @@ class TotalAccuracyMean:
         self.wave_name = wave_name
 
         # Загружаем конфигурацию зоны из файла zones.json
-        config_path = os.path.join("..", "config", "zones.json")
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = json.load(f)
+        config = load_config(config_path)
         self.size = config["size"]
         self.height, self.width = self.size
-        self.subduction_zone = config["subduction_zone"]
+        self.subduction_zone = config[zone]
         self.sub_y_min, self.sub_y_max, self.sub_x_min, self.sub_x_max = self.subduction_zone
 
         # Загружаем волну
@@ -101,84 +94,129 @@ class TotalAccuracyMean:
                 "coeffs",
                 f"case_statistics_{wave_name}_{bn}_{bath_name}_all.json"
             )
-            self.coefs[bn], self.errors[bn] = load_json_data(coefs_path)
+            if streaming:
+                self.coefs[bn], self.errors[bn] = open_coefs(coefs_path, cache_dir)
+            else:
+                self.coefs[bn], self.errors[bn] = load_json_data(coefs_path)
+
+    @classmethod
+    def from_arrays(cls, wave, basis, coefs, errors=None):
+        """
+        Создаёт калькулятор ансамбля из уже загруженных массивов, минуя чтение файлов.
+
+        Параметры:
+          wave - обрезанная волна (H, W);
+          basis - словарь {basis_name: базисные функции (n_layers, H, W)};
+          coefs - словарь {basis_name: коэффициенты (rows, cols, n_layers)};
+          errors - словарь {basis_name: ошибки (rows, cols)} (необязательно).
+        """
+        calculator = cls.__new__(cls)
+        calculator.wave = wave
+        calculator.basis_names = list(basis)
+        calculator.basis = dict(basis)
+        calculator.coefs = dict(coefs)
+        calculator.errors = dict(errors or {})
+        return calculator
 
     def _load_basis(self, basis_directory, regex_pattern=r".*?(\d+)\.wave"):
         """
         Загружает базисные функции из файлов в заданной директории.
         Имена файлов должны соответствовать шаблону regex_pattern для извлечения индекса.
         Каждая функция обрезается до области subduction_zone.
-        Возвращает массив базисных функций с формой (n_layers, H, W).
+        Возвращает массив базисных функций с формой (n_layers, H, W) (из кеша src.array_cache).
         """
-        files = os.listdir(basis_directory)
-        basis_files = {}
-
-        # Фильтрация файлов по регулярному выражению и извлечение индекса
-        for filename in files:
-            match = re.search(regex_pattern, filename)
-            if match:
-                index = int(match.group(1))
-                full_path = os.path.join(basis_directory, filename)
-                basis_files[index] = full_path
-
-        loaded_bases = []
-        for index in sorted(basis_files.keys()):
-            data = np.loadtxt(basis_files[index])
-            cropped = data[self.sub_y_min:self.sub_y_max, self.sub_x_min:self.sub_x_max]
-            loaded_bases.append(cropped)
-        return np.stack(loaded_bases, axis=0)
+        return cached_basis(basis_directory, self.subduction_zone, regex_pattern, dense=True)
 
     def _load_wave(self):
         """
-        Загружает волну из файла self.wave_path и обрезает её до области subduction_zone.
+        Загружает волну из файла self.wave_path и обрезает её до области subduction_zone (через кеш).
         """
-        data = np.loadtxt(self.wave_path)
-        wave = data[self.sub_y_min:self.sub_y_max, self.sub_x_min:self.sub_x_max]
-        return wave
+        return cached_wave(self.wave_path, self.subduction_zone)
 
-    def get_accuracy(self, chunk_size=20):
+    def get_accuracy(self, chunk_size=20, out_dir=None, memory_budget=None, memory_limit=None, on_exceed="shrink"):
         """
         Вычисляет нормированные показатели аппроксимации для каждой точки.
         Реконструкция для каждого чанка вычисляется как среднее арифметическое реконструкций,
         полученных для каждого basis_name.
+
+        Параметры:
+          chunk_size - число строк коэффициентной сетки в одном чанке;
+          out_dir - если задан, карты метрик пишутся в memory-mapped файлы <out_dir>/<metric>.npy;
+          memory_budget - бюджет памяти на чанк в байтах; если задан, chunk_size подбирается по нему;
+          memory_limit, on_exceed - лимит пиковой памяти процесса и реакция на его превышение
+                        ("shrink" - уменьшить чанк, "refuse" - MemoryError до начала расчёта),
+                        как в TotalAccuracy.get_accuracy. Сведения о памяти - в self.last_run.
         """
         # Берем размеры коэффициентов из первого загруженного набора
         first_key = next(iter(self.coefs))
         rows, cols, _ = self.coefs[first_key].shape
-
-        rms_accuracy = np.empty((rows, cols))
-        max_accuracy = np.empty((rows, cols))
-        max_value_diff = np.empty((rows, cols))
+        n_layers = max(self.coefs[bn].shape[2] for bn in self.basis_names)
+        if memory_budget is not None:
+            chunk_size = rows_per_chunk(memory_budget, cols, n_layers, *self.wave.shape,
+                                        n_bases=len(self.basis_names))
+        requested_chunk_size = chunk_size
+        # Сумма реконструкций ансамбля живёт одновременно с временными массивами эталонного расчёта
+        chunk_size, prediction = fit_chunk_size(parse_size(memory_limit), on_exceed, rows, cols, n_layers,
+                                                *self.wave.shape, chunk_size, pixel_arrays=CHUNK_ARRAY_FACTOR + 1,
+                                                n_bases=len(self.basis_names), results_in_memory=out_dir is None)
+        if chunk_size < requested_chunk_size:
+            print(f"Чанк уменьшен с {requested_chunk_size} до {chunk_size} строк: предсказанный пик "
+                  f"{format_size(prediction['total'])} при лимите {format_size(parse_size(memory_limit))}")
+
+        if out_dir is not None:
+            results = open_results(out_dir, (rows, cols), METRICS)
+        else:
+            results = {key: np.empty((rows, cols)) for key in METRICS}
         # Вычисляем RMS и максимальное значение волны
         wave_rms = np.sqrt(np.mean(self.wave ** 2))
         wave_max = np.max(np.abs(self.wave))
 
+        monitor = RssMonitor().start()
         # Обработка строк коэффициентной сетки чанками
         for i in tqdm(range(0, rows, chunk_size), desc="Вычисление точности"):
             end = min(i + chunk_size, rows)
-            reconstruction_list = []
-            # Для каждого basis_name вычисляем реконструкцию
-            for bn in self.basis_names:
-                basis_stack = self.basis[bn]  # shape (n_layers, H, W)
-                coefs_chunk = self.coefs[bn][i:end, :, :]  # shape (chunk, cols, n_layers)
-                reconstruction_bn = np.tensordot(coefs_chunk, basis_stack, axes=([2], [0]))
-                reconstruction_list.append(reconstruction_bn)
-            # Вызываем отдельную функцию для усреднения реконструкций,
-            # передавая в неё также имя базисной функции (пока не используется)
-            reconstruction_chunk = average_reconstructions(reconstruction_list, bn)
-
-            # Вычисляем разницу между волной и реконструкцией
-            diff_chunk = self.wave - reconstruction_chunk  # broadcasting: (chunk, cols, H, W)
-            # Нормированное RMS отклонение для каждой точки
-            rms_accuracy[i:end, :] = np.sqrt(np.mean(diff_chunk ** 2, axis=(2, 3))) / wave_rms
-            # Нормированное максимальное отклонение для каждой точки
-            max_accuracy[i:end, :] = np.max(np.abs(diff_chunk), axis=(2, 3)) / wave_max
-            # Дополнительный показатель: нормированная разница между максимальным значением реконструкции и wave_max
-            max_reconstructed_chunk = np.max(np.abs(reconstruction_chunk), axis=(2, 3))
-            max_value_diff[i:end, :] = np.abs(max_reconstructed_chunk - wave_max) / wave_max
-
-        return {
-            "rms_accuracy": rms_accuracy,
-            "max_accuracy": max_accuracy,
-            "max_value_diff": max_value_diff
+            # Реконструкции по basis_name накапливаются в одной сумме, чтобы память чанка
+            # не росла с числом базисов в ансамбле
+            reconstruction_chunk = None
+            with stage("compute", ensemble=len(self.basis_names)) as st:
+                for bn in self.basis_names:
+                    basis_stack = self.basis[bn]  # shape (n_layers, H, W)
+                    coefs_chunk = np.asarray(self.coefs[bn][i:end, :, :])  # shape (chunk, cols, n_layers)
+                    reconstruction_bn = np.tensordot(coefs_chunk, basis_stack, axes=([2], [0]))
+                    if reconstruction_chunk is None:
+                        reconstruction_chunk = reconstruction_bn
+                    else:
+                        reconstruction_chunk += reconstruction_bn
+                    del reconstruction_bn
+                reconstruction_chunk /= len(self.basis_names)
+                st.add(points=(end - i) * cols, pixels=reconstruction_chunk.size)
+
+            with stage("reduce"):
+                # Вычисляем разницу между волной и реконструкцией
+                diff_chunk = self.wave - reconstruction_chunk  # broadcasting: (chunk, cols, H, W)
+                # Нормированное RMS отклонение для каждой точки
+                results["rms_accuracy"][i:end, :] = np.sqrt(np.mean(diff_chunk ** 2, axis=(2, 3))) / wave_rms
+                # Нормированное максимальное отклонение для каждой точки
+                results["max_accuracy"][i:end, :] = np.max(np.abs(diff_chunk), axis=(2, 3)) / wave_max
+                # Дополнительный показатель: нормированная разница между максимальным значением реконструкции и wave_max
+                max_reconstructed_chunk = np.max(np.abs(reconstruction_chunk), axis=(2, 3))
+                results["max_value_diff"][i:end, :] = np.abs(max_reconstructed_chunk - wave_max) / wave_max
+            del reconstruction_chunk, diff_chunk
+            monitor.mark(i, end)
+
+        observed = monitor.stop()
+        self.last_run = {
+            "engine": "reference",
+            "ensemble": list(self.basis_names),
+            "chunk_size": chunk_size,
+            "requested_chunk_size": requested_chunk_size,
+            "memory_limit": parse_size(memory_limit),
+            "predicted": prediction,
+            "peak_rss": observed["peak_rss"],
+            "chunks": observed["chunks"],
         }
+        if out_dir is not None:
+            for value in results.values():
+                value.flush()
+            write_run_metadata(out_dir, self.last_run)
+        return results
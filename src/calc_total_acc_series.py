@@ -0,0 +1,295 @@
+import os
+
+import numpy as np
+from tqdm import tqdm  # Импорт tqdm для отображения прогресса
+
+from src.array_cache import cached_basis, cached_frames, cached_gram
+from src.calc_total_acc import METRICS, load_json_data, row_chunks, write_run_metadata
+from src.coef_store import open_coefs, open_results
+from src.engines import ENGINES, gram_matrix, make_engine, tile_layout, wave_projections
+from src.instrumentation import stage
+from src.loaders import BASIS_REGEX, DEFAULT_CONFIG_PATH, frame_names, load_config
+from src.memory import RssMonitor, fit_chunk_size, format_size, parse_size
+from src.sparse_basis import SparseBasis
+
+# Движки, у которых rms_accuracy считается через матрицу Грама: для ряда - сразу по всем кадрам чанка
+GRAM_RMS_ENGINES = ("gram", "sparse")
+
+
+class TotalAccuracySeries:
+    """
+    Точность аппроксимации временного ряда волны: кадры (T, H, W) и свой набор коэффициентов
+    для каждого кадра. Все кадры считаются за один проход по строкам коэффициентной сетки:
+    базис и матрица Грама общие, проекции всех кадров - одно матричное произведение
+    (src.engines.wave_projections), а rms_accuracy движков gram и sparse считается для всех кадров
+    чанка одной матричной операцией. Остальные метрики - движками кадров с общим базисом.
+
+    Кроме карт каждого кадра считаются карты всего ряда:
+      rms_accuracy   - RMS отклонения по всем кадрам и пикселям, нормированное на RMS всего ряда;
+      max_accuracy   - максимум модуля отклонения по ряду, нормированный на максимум модуля ряда;
+      max_value_diff - наибольшее по кадрам значение метрики кадра (худший кадр).
+    Кадр с нулевой волной нормируется на RMS и максимум всего ряда (для него метрики кадра не определены).
+
+        series = TotalAccuracySeries(root, "x_200_2000", "basis_12", "gaus_single_1_real_t")
+        frames, total = series.get_accuracy(metrics=("rms_accuracy",))
+        frames["rms_accuracy"][t], total["rms_accuracy"]
+    """
+
+    def __init__(self, root_folder, bath_name, basis_name, wave_name, streaming=False, cache_dir=None,
+                 config_path=DEFAULT_CONFIG_PATH, zone="subduction_zone", regex_pattern=BASIS_REGEX):
+        """
+        Параметры:
+          root_folder - корневая папка с данными;
+          bath_name, basis_name - имена bath и базиса;
+          wave_name - имя ряда: директория кадров waves/<wave_name>/ (номер кадра - число в имени файла)
+                      или файл куба кадров waves/<wave_name>.wave (src.grid_io.write_frames).
+                      Коэффициенты кадра - файл case_statistics_{кадр}_{basis_name}_{bath_name}_all.json,
+                      где кадр - имя кадра (src.loaders.frame_names);
+          streaming - если True, коэффициенты кадров открываются как memory-mapped массивы;
+          cache_dir - директория для .npy-файлов потокового режима (по умолчанию coeffs/memmap);
+          config_path - путь к zones.json;
+          zone - имя зоны из zones.json, до которой обрезаются кадры и базис;
+          regex_pattern - номер кадра в имени файла директории кадров.
+        """
+        self.root_folder = root_folder
+        self.bath_name = bath_name
+        self.basis_name = basis_name
+        self.wave_name = wave_name
+
+        config = load_config(config_path)
+        self.subduction_zone = config[zone]
+        self.wave_path = os.path.join(root_folder, "waves", wave_name)
+        if not os.path.isdir(self.wave_path):
+            self.wave_path = os.path.join(root_folder, "waves", f"{wave_name}.wave")
+        self.basis_directory = os.path.join(root_folder, "basises", basis_name)
+
+        frames = cached_frames(self.wave_path, self.subduction_zone, regex_pattern)
+        names = frame_names(self.wave_path, regex_pattern)
+        coefs, errors = [], []
+        for name in names:
+            coefs_path = os.path.join(root_folder, "coeffs",
+                                      f"case_statistics_{name}_{basis_name}_{bath_name}_all.json")
+            if streaming:
+                frame_coefs, frame_errors = open_coefs(coefs_path, cache_dir)
+            else:
+                frame_coefs, frame_errors = load_json_data(coefs_path)
+            coefs.append(frame_coefs)
+            errors.append(frame_errors)
+        self._setup(frames, names, cached_basis(self.basis_directory, self.subduction_zone), coefs, errors, None)
+
+    @classmethod
+    def from_arrays(cls, frames, basis, coefs, errors=None, gram=None, names=None):
+        """
+        Создаёт калькулятор из уже загруженных массивов, минуя чтение файлов.
+
+        Параметры:
+          frames - обрезанные кадры волны (T, H, W);
+          basis - базисные функции (n_layers, H, W) или SparseBasis;
+          coefs - коэффициенты кадров: список T массивов (rows, cols, n_layers) или массив (T, rows, cols, n_layers);
+          errors - ошибки кадров (список или массив (T, rows, cols), необязательно);
+          gram - готовая матрица Грама базиса (необязательно);
+          names - имена кадров (по умолчанию номера).
+        """
+        calculator = cls.__new__(cls)
+        calculator.basis_directory = None
+        names = list(names) if names is not None else [str(t) for t in range(len(frames))]
+        calculator._setup(np.asarray(frames), names, basis, list(coefs),
+                          list(errors) if errors is not None else [None] * len(frames), gram)
+        return calculator
+
+    def _setup(self, frames, names, basis, coefs, errors, gram):
+        """Проверка согласованности кадров и коэффициентов и статистики кадров для нормировки."""
+        if len(names) != frames.shape[0] or len(coefs) != frames.shape[0]:
+            raise ValueError(f"Кадров {frames.shape[0]}, имён {len(names)}, наборов коэффициентов {len(coefs)}")
+        shapes = {tuple(frame_coefs.shape) for frame_coefs in coefs}
+        if len(shapes) != 1:
+            raise ValueError(f"Коэффициенты кадров разной формы: {sorted(shapes)}")
+        if not isinstance(basis, (np.ndarray, SparseBasis)):
+            basis = np.stack(basis, axis=0)
+        self.frames = frames
+        self.frame_names = list(names)
+        self.basis = basis
+        self.coefs = coefs
+        self.errors = errors
+        self.gram = gram
+        self.projections = None
+
+        # Нормировка кадров: собственные RMS и максимум, для нулевого кадра - величины всего ряда
+        sq_sums = np.sum(frames ** 2, axis=(1, 2))
+        abs_max = np.max(np.abs(frames), axis=(1, 2))
+        n_pixels = frames[0].size
+        self.series_rms = np.sqrt(np.sum(sq_sums) / (n_pixels * frames.shape[0]))
+        self.series_max = np.max(abs_max)
+        self.frame_sq_sums = sq_sums
+        self.frame_rms = np.where(sq_sums > 0, np.sqrt(sq_sums / n_pixels), self.series_rms)
+        self.frame_max = np.where(abs_max > 0, abs_max, self.series_max)
+
+    def _gram(self):
+        if self.gram is None:
+            if self.basis_directory is not None:
+                self.gram = cached_gram(self.basis_directory, self.subduction_zone, self.basis)
+            elif isinstance(self.basis, SparseBasis):
+                self.gram = self.basis.gram()
+            else:
+                self.gram = gram_matrix(self.basis)
+        return self.gram
+
+    def _frame_engines(self, engine_name):
+        """Движки кадров с общими базисом, матрицей Грама, проекциями и разметкой плиток."""
+        engine_class = ENGINES[engine_name]
+        basis = self.basis
+        # Перевод базиса в нужный движку вид - один раз на ряд, а не в движке каждого кадра
+        if isinstance(basis, SparseBasis) and not getattr(engine_class, "sparse", False):
+            basis = basis.toarray()
+        elif getattr(engine_class, "sparse", False) and not isinstance(basis, SparseBasis):
+            basis = SparseBasis.from_dense(basis)
+        if getattr(engine_class, "dtype", None) is not None and not isinstance(basis, SparseBasis):
+            basis = basis.astype(engine_class.dtype, copy=False)
+        options = {}
+        if engine_class.precomputed:
+            options["gram"] = self._gram()
+        if engine_name == "tile":
+            options["labels"], options["values"] = tile_layout(basis)
+        engines = []
+        for t, frame in enumerate(self.frames):
+            if "projection" in engine_class.precomputed:
+                options["projection"] = self.projections[t]
+            engine = make_engine(engine_name, frame, basis, **options)
+            engine.wave_rms, engine.wave_max = self.frame_rms[t], self.frame_max[t]
+            engines.append(engine)
+        return engines
+
+    def _rms_frames(self, coefs_frames):
+        """
+        rms_accuracy всех кадров чанка через матрицу Грама (как src.engines.rms_chunk_gram):
+        coefs_frames (T, chunk, cols, n_layers) -> (T, chunk, cols).
+        """
+        quad = np.sum((coefs_frames @ self.gram) * coefs_frames, axis=-1)
+        lin = np.einsum("tijk,tk->tij", coefs_frames, self.projections)
+        mse = np.maximum(self.frame_sq_sums[:, None, None] - 2 * lin + quad, 0.0) / self.frames[0].size
+        return np.sqrt(mse) / self.frame_rms[:, None, None]
+
+    def _series_blocks(self, frame_blocks):
+        """Карты всего ряда для блока строк из карт кадров (T, chunk, cols)."""
+        result = {}
+        if "rms_accuracy" in frame_blocks:
+            sq = (frame_blocks["rms_accuracy"] * self.frame_rms[:, None, None]) ** 2
+            result["rms_accuracy"] = np.sqrt(np.mean(sq, axis=0)) / self.series_rms
+        if "max_accuracy" in frame_blocks:
+            deviation = frame_blocks["max_accuracy"] * self.frame_max[:, None, None]
+            result["max_accuracy"] = np.max(deviation, axis=0) / self.series_max
+        if "max_value_diff" in frame_blocks:
+            result["max_value_diff"] = np.max(frame_blocks["max_value_diff"], axis=0)
+        return result
+
+    def iter_accuracy(self, chunk_size=37, metrics=METRICS, engine=None, memory_limit=None, on_exceed="shrink",
+                      results_in_memory=False):
+        """
+        Потоковый расчёт ряда: по мере готовности чанка выдаёт (row_slice, кадры, ряд), где кадры -
+        {метрика: блок (T, строки чанка, cols)}, ряд - {метрика: блок (строки чанка, cols)}.
+
+        Параметры:
+          chunk_size - число строк коэффициентной сетки в чанке (коэффициенты чанка копируются для всех кадров);
+          metrics - имена вычисляемых метрик;
+          engine - имя движка из src.engines.ENGINES; по умолчанию как у TotalAccuracy.get_accuracy;
+          memory_limit, on_exceed - лимит пиковой памяти и реакция на превышение (src.memory.fit_chunk_size);
+          results_in_memory - учитывать ли в предсказании пика полные карты, которые держит вызывающий код.
+
+        Сведения о расчёте - в self.last_run после последнего блока.
+        """
+        metrics = tuple(metrics)
+        n_frames = self.frames.shape[0]
+        rows, cols, n_layers = self.coefs[0].shape
+        if engine is None and isinstance(self.basis, SparseBasis):
+            engine = "sparse"
+        elif engine is None:
+            engine = "gram" if metrics == ("rms_accuracy",) else "reference"
+        if engine not in ENGINES:
+            raise ValueError(f"Неизвестный движок {engine}; доступны: {', '.join(ENGINES)}")
+        engine_class = ENGINES[engine]
+        missing = [key for key in metrics if key not in engine_class.metrics]
+        if missing:
+            raise ValueError(f"Движок {engine} не считает метрики: {', '.join(missing)}")
+
+        batched_rms = engine in GRAM_RMS_ENGINES and "rms_accuracy" in metrics
+        if self.projections is None and (engine_class.precomputed or batched_rms):
+            # Проекции всех кадров на базис - одно матричное произведение
+            self.projections = wave_projections(self.basis, self.frames)
+        if batched_rms:
+            self._gram()
+        frame_metrics = [key for key in metrics if not (batched_rms and key == "rms_accuracy")]
+        engines = self._frame_engines(engine) if frame_metrics else []
+
+        # Коэффициенты чанка копируются для каждого кадра; временные массивы пикселей - одного кадра
+        layer_arrays = engine_class.layer_arrays * (n_frames if batched_rms else 1)
+        requested_chunk_size = chunk_size
+        chunk_size, prediction = fit_chunk_size(parse_size(memory_limit), on_exceed, rows, cols, n_layers,
+                                                *self.frames.shape[1:], chunk_size,
+                                                pixel_arrays=engine_class.pixel_arrays, layer_arrays=layer_arrays,
+                                                n_bases=n_frames, n_metrics=len(metrics) * (n_frames + 1),
+                                                results_in_memory=results_in_memory)
+        if chunk_size < requested_chunk_size:
+            print(f"Чанк уменьшен с {requested_chunk_size} до {chunk_size} строк: предсказанный пик "
+                  f"{format_size(prediction['total'])} при лимите {format_size(parse_size(memory_limit))}")
+
+        monitor = RssMonitor().start()
+        try:
+            for i, end in tqdm(row_chunks(rows, chunk_size), desc="Вычисление точности ряда"):
+                coefs_frames = np.stack([np.asarray(frame_coefs[i:end, :, :]) for frame_coefs in self.coefs])
+                frame_blocks = {key: np.empty((n_frames, end - i, cols)) for key in metrics}
+                if batched_rms:
+                    with stage("compute", engine=engine, frames=n_frames) as st:
+                        frame_blocks["rms_accuracy"][:] = self._rms_frames(coefs_frames)
+                        st.add(points=n_frames * (end - i) * cols)
+                for t, frame_engine in enumerate(engines):
+                    chunk = frame_engine.chunk(coefs_frames[t], frame_metrics)
+                    for key in frame_metrics:
+                        frame_blocks[key][t] = chunk[key]
+                    del chunk
+                del coefs_frames
+                yield slice(i, end), frame_blocks, self._series_blocks(frame_blocks)
+                monitor.mark(i, end)
+        finally:
+            observed = monitor.stop()
+        self.last_run = {
+            "engine": engine,
+            "frames": n_frames,
+            "chunk_size": chunk_size,
+            "requested_chunk_size": requested_chunk_size,
+            "memory_limit": parse_size(memory_limit),
+            "predicted": prediction,
+            "peak_rss": observed["peak_rss"],
+            "chunks": observed["chunks"],
+        }
+
+    def get_accuracy(self, chunk_size=37, out_dir=None, metrics=METRICS, engine=None, memory_limit=None,
+                     on_exceed="shrink"):
+        """
+        Карты метрик каждого кадра и всего ряда (параметры - как у iter_accuracy).
+        out_dir - если задан, карты ряда пишутся в memory-mapped файлы <out_dir>/<metric>.npy,
+        карты кадров - в <out_dir>/frames/<metric>.npy (T, rows, cols), сведения о расчёте - в run_meta.json.
+
+        Возвращает (кадры, ряд): {метрика: массив (T, rows, cols)} и {метрика: массив (rows, cols)}.
+        """
+        metrics = tuple(metrics)
+        n_frames = self.frames.shape[0]
+        rows, cols = self.coefs[0].shape[:2]
+        if out_dir is not None:
+            frame_results = open_results(os.path.join(out_dir, "frames"), (n_frames, rows, cols), metrics)
+            series_results = open_results(out_dir, (rows, cols), metrics)
+        else:
+            frame_results = {key: np.empty((n_frames, rows, cols)) for key in metrics}
+            series_results = {key: np.empty((rows, cols)) for key in metrics}
+
+        for row_slice, frame_blocks, series_blocks in self.iter_accuracy(chunk_size, metrics, engine, memory_limit,
+                                                                         on_exceed,
+                                                                         results_in_memory=out_dir is None):
+            for key in metrics:
+                frame_results[key][:, row_slice, :] = frame_blocks[key]
+                series_results[key][row_slice, :] = series_blocks[key]
+        self.last_run["frame_names"] = self.frame_names
+        if out_dir is not None:
+            for value in list(frame_results.values()) + list(series_results.values()):
+                value.flush()
+            write_run_metadata(out_dir, self.last_run)
+        return frame_results, series_results
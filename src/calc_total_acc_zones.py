@@ -0,0 +1,269 @@
+import os
+
+import numpy as np
+from tqdm import tqdm  # Импорт tqdm для отображения прогресса
+
+from src.array_cache import cached_basis, cached_wave
+from src.calc_total_acc import METRICS, load_json_data, row_chunks, write_run_metadata
+from src.coef_store import open_coefs, open_results
+from src.engines import rms_chunk_gram
+from src.instrumentation import stage
+from src.loaders import DEFAULT_CONFIG_PATH, bounding_zone, crop, load_config, named_zones
+from src.memory import RssMonitor, fit_chunk_size, format_size, parse_size
+
+# Движки расчёта по зонам: полная реконструкция ячеек или замкнутая форма RMS через матрицы Грама
+ZONE_ENGINES = ("reference", "gram")
+
+
+def zone_cells(zones):
+    """
+    Разбиение объединения зон на непересекающиеся прямоугольные ячейки по всем границам зон.
+    Возвращает (cells, members): cells - список ячеек [y_min, y_max, x_min, x_max], покрытых хотя бы
+    одной зоной, members - {имя зоны: номера её ячеек}. Каждая зона - ровно объединение своих ячеек.
+    """
+    ys = sorted({v for zone in zones.values() for v in zone[:2]})
+    xs = sorted({v for zone in zones.values() for v in zone[2:]})
+    cells, members = [], {name: [] for name in zones}
+    for y_min, y_max in zip(ys, ys[1:]):
+        for x_min, x_max in zip(xs, xs[1:]):
+            owners = [name for name, (zy0, zy1, zx0, zx1) in zones.items()
+                      if zy0 <= y_min and y_max <= zy1 and zx0 <= x_min and x_max <= zx1]
+            if owners:
+                for name in owners:
+                    members[name].append(len(cells))
+                cells.append([y_min, y_max, x_min, x_max])
+    return cells, members
+
+
+class TotalAccuracyZones:
+    """
+    Точность аппроксимации сразу для нескольких именованных зон (например, subduction_zone
+    и mariogramm_zone) за один проход по коэффициентам. Волна и базис загружаются один раз
+    по охватывающему зоны прямоугольнику и делятся на непересекающиеся ячейки по границам зон
+    (zone_cells). Для каждого чанка реконструкция каждой ячейки строится один раз, а по ячейкам
+    считаются частичные суммы (сумма квадратов отклонения, максимумы модуля отклонения
+    и реконструкции); метрики зоны - сведение частичных сумм её ячеек, так что перекрытие зон
+    считается один раз. В движке gram матрицы Грама и проекции зон складываются из матриц ячеек.
+
+        zones = TotalAccuracyZones(root, "x_200_2000", "basis_12", "gaus_single_1_real")
+        maps = zones.get_accuracy()
+        maps["mariogramm_zone"]["rms_accuracy"]
+    """
+
+    def __init__(self, root_folder, bath_name, basis_name, wave_name, zones=("subduction_zone", "mariogramm_zone"),
+                 streaming=False, cache_dir=None, config_path=DEFAULT_CONFIG_PATH):
+        """
+        Параметры:
+          root_folder - корневая папка с данными;
+          bath_name, basis_name, wave_name - имена bath, базиса и волны;
+          zones - имена зон из zones.json;
+          streaming - если True, коэффициенты открываются как memory-mapped массив и читаются по блокам строк;
+          cache_dir - директория для .npy-файлов потокового режима (по умолчанию coeffs/memmap);
+          config_path - путь к zones.json.
+        """
+        self.root_folder = root_folder
+        self.bath_name = bath_name
+        self.basis_name = basis_name
+        self.wave_name = wave_name
+
+        zones = named_zones(load_config(config_path), zones)
+        box = bounding_zone(zones.values())
+        wave_path = os.path.join(root_folder, "waves", f"{wave_name}.wave")
+        basis_directory = os.path.join(root_folder, "basises", basis_name)
+        coefs_path = os.path.join(root_folder, "coeffs",
+                                  f"case_statistics_{wave_name}_{basis_name}_{bath_name}_all.json")
+        wave = cached_wave(wave_path, box)
+        basis = cached_basis(basis_directory, box, dense=True)
+        if streaming:
+            coefs, errors = open_coefs(coefs_path, cache_dir)
+        else:
+            coefs, errors = load_json_data(coefs_path)
+        self._setup(zones, box, wave, basis, coefs, errors)
+
+    @classmethod
+    def from_arrays(cls, zones, wave, basis, coefs, errors=None):
+        """
+        Создаёт калькулятор из уже загруженных массивов, минуя чтение файлов.
+
+        Параметры:
+          zones - {имя зоны: [y_min, y_max, x_min, x_max]} в координатах wave и basis;
+          wave - волна (H, W), например полное поле;
+          basis - базисные функции (n_layers, H, W) в тех же координатах;
+          coefs, errors - результат load_json_data или open_coefs.
+        """
+        calculator = cls.__new__(cls)
+        zones = {name: [int(v) for v in zone] for name, zone in zones.items()}
+        box = bounding_zone(zones.values())
+        y_min, y_max, x_min, x_max = box
+        basis = np.asarray(basis)[:, y_min:y_max, x_min:x_max]
+        calculator._setup(zones, box, crop(np.asarray(wave), box), basis, coefs, errors)
+        return calculator
+
+    def _setup(self, zones, box, wave, basis, coefs, errors):
+        """Ячейки зон, базис и волна ячеек и статистики волны по зонам для нормировки."""
+        self.zones = zones
+        self.box = box
+        self.coefs = coefs
+        self.errors = errors
+        # Координаты ячеек - относительно охватывающего прямоугольника
+        relative = {name: [zone[0] - box[0], zone[1] - box[0], zone[2] - box[2], zone[3] - box[2]]
+                    for name, zone in zones.items()}
+        self.cells, self.members = zone_cells(relative)
+        # Непрерывные копии базиса ячеек: tensordot не копирует срезы на каждом чанке
+        self.cell_basis = [np.ascontiguousarray(basis[:, y0:y1, x0:x1]) for y0, y1, x0, x1 in self.cells]
+        self.cell_wave = [np.ascontiguousarray(wave[y0:y1, x0:x1]) for y0, y1, x0, x1 in self.cells]
+        self.cell_grams = None
+
+        cell_sq = [np.sum(w ** 2) for w in self.cell_wave]
+        cell_max = [np.max(np.abs(w)) for w in self.cell_wave]
+        self.zone_pixels, self.zone_sq_sums, self.wave_rms, self.wave_max = {}, {}, {}, {}
+        for name, cells in self.members.items():
+            self.zone_pixels[name] = sum(self.cell_wave[c].size for c in cells)
+            self.zone_sq_sums[name] = sum(cell_sq[c] for c in cells)
+            self.wave_rms[name] = np.sqrt(self.zone_sq_sums[name] / self.zone_pixels[name])
+            self.wave_max[name] = max(cell_max[c] for c in cells)
+
+    def _zone_grams(self):
+        """Матрицы Грама и проекции волны зон - суммы матриц и проекций их ячеек."""
+        if self.cell_grams is None:
+            with stage("gram_build", layers=self.cell_basis[0].shape[0], cells=len(self.cells)):
+                flat = [b.reshape(b.shape[0], -1) for b in self.cell_basis]
+                self.cell_grams = [f @ f.T for f in flat]
+                self.cell_projections = [f @ w.reshape(-1) for f, w in zip(flat, self.cell_wave)]
+        grams = {name: sum(self.cell_grams[c] for c in cells) for name, cells in self.members.items()}
+        projections = {name: sum(self.cell_projections[c] for c in cells) for name, cells in self.members.items()}
+        return grams, projections
+
+    def _reference_chunk(self, coefs_chunk, metrics):
+        """Частичные суммы ячеек по реконструкциям и метрики зон: {зона: {метрика: (chunk, cols)}}."""
+        sq_sums, dev_max, rec_max = [], [], []
+        with stage("compute", engine="reference", cells=len(self.cells)) as st:
+            for basis_cell, wave_cell in zip(self.cell_basis, self.cell_wave):
+                reconstruction = np.tensordot(coefs_chunk, basis_cell, axes=([2], [0]))
+                # max(|x|) как max(max x, -min x) - без временного массива модулей
+                if "max_value_diff" in metrics:
+                    rec_max.append(np.maximum(np.max(reconstruction, axis=(2, 3)),
+                                              -np.min(reconstruction, axis=(2, 3))))
+                # Дальше reconstruction хранит разницу (со знаком минус - на модуль и квадрат не влияет)
+                np.subtract(reconstruction, wave_cell, out=reconstruction)
+                if "max_accuracy" in metrics:
+                    dev_max.append(np.maximum(np.max(reconstruction, axis=(2, 3)),
+                                              -np.min(reconstruction, axis=(2, 3))))
+                if "rms_accuracy" in metrics:
+                    sq_sums.append(np.einsum("ijkl,ijkl->ij", reconstruction, reconstruction))
+                st.add(pixels=reconstruction.size)
+                del reconstruction
+            st.add(points=coefs_chunk.shape[0] * coefs_chunk.shape[1])
+        result = {}
+        for name, cells in self.members.items():
+            zone_result = {}
+            if "rms_accuracy" in metrics:
+                sq = np.sum([sq_sums[c] for c in cells], axis=0)
+                zone_result["rms_accuracy"] = np.sqrt(sq / self.zone_pixels[name]) / self.wave_rms[name]
+            if "max_accuracy" in metrics:
+                zone_result["max_accuracy"] = np.max([dev_max[c] for c in cells], axis=0) / self.wave_max[name]
+            if "max_value_diff" in metrics:
+                max_reconstructed = np.max([rec_max[c] for c in cells], axis=0)
+                zone_result["max_value_diff"] = np.abs(max_reconstructed - self.wave_max[name]) / self.wave_max[name]
+            result[name] = zone_result
+        return result
+
+    def _gram_chunk(self, coefs_chunk, grams, projections):
+        with stage("compute", engine="gram", zones=len(self.zones)) as st:
+            result = {name: {"rms_accuracy": rms_chunk_gram(coefs_chunk, grams[name], projections[name],
+                                                            self.zone_sq_sums[name], self.zone_pixels[name],
+                                                            self.wave_rms[name])}
+                      for name in self.zones}
+            st.add(points=coefs_chunk.shape[0] * coefs_chunk.shape[1])
+        return result
+
+    def iter_accuracy(self, chunk_size=37, metrics=METRICS, engine=None, memory_limit=None, on_exceed="shrink",
+                      results_in_memory=False):
+        """
+        Потоковый расчёт всех зон: по мере готовности чанка выдаёт (row_slice, {зона: {метрика: блок}}),
+        блок - массив (строки чанка, cols).
+
+        Параметры:
+          chunk_size - число строк коэффициентной сетки в чанке;
+          metrics - имена вычисляемых метрик;
+          engine - "reference" (реконструкции ячеек) или "gram" (только rms_accuracy);
+                   по умолчанию gram для одной rms_accuracy, иначе reference;
+          memory_limit, on_exceed - лимит пиковой памяти и реакция на превышение (src.memory.fit_chunk_size);
+          results_in_memory - учитывать ли в предсказании пика полные карты, которые держит вызывающий код.
+
+        Сведения о расчёте - в self.last_run после последнего блока.
+        """
+        metrics = tuple(metrics)
+        rows, cols, n_layers = self.coefs.shape
+        if engine is None:
+            engine = "gram" if metrics == ("rms_accuracy",) else "reference"
+        if engine not in ZONE_ENGINES:
+            raise ValueError(f"Движок {engine} не поддерживает расчёт по зонам; доступны: {', '.join(ZONE_ENGINES)}")
+        if engine == "gram" and metrics != ("rms_accuracy",):
+            raise ValueError("Движок gram считает только rms_accuracy")
+        grams, projections = self._zone_grams() if engine == "gram" else (None, None)
+
+        # Временный массив пикселей - реконструкция одной (наибольшей) ячейки
+        largest_cell = max(wave_cell.size for wave_cell in self.cell_wave)
+        memory_model = dict(pixel_arrays=1, layer_arrays=0) if engine == "reference" else \
+            dict(pixel_arrays=0, layer_arrays=2)
+        requested_chunk_size = chunk_size
+        chunk_size, prediction = fit_chunk_size(parse_size(memory_limit), on_exceed, rows, cols, n_layers,
+                                                largest_cell, 1, chunk_size, n_metrics=len(metrics) * len(self.zones),
+                                                results_in_memory=results_in_memory, **memory_model)
+        if chunk_size < requested_chunk_size:
+            print(f"Чанк уменьшен с {requested_chunk_size} до {chunk_size} строк: предсказанный пик "
+                  f"{format_size(prediction['total'])} при лимите {format_size(parse_size(memory_limit))}")
+
+        monitor = RssMonitor().start()
+        try:
+            for i, end in tqdm(row_chunks(rows, chunk_size), desc="Вычисление точности по зонам"):
+                coefs_chunk = np.asarray(self.coefs[i:end, :, :])
+                if engine == "gram":
+                    blocks = self._gram_chunk(coefs_chunk, grams, projections)
+                else:
+                    blocks = self._reference_chunk(coefs_chunk, metrics)
+                del coefs_chunk
+                yield slice(i, end), blocks
+                monitor.mark(i, end)
+        finally:
+            observed = monitor.stop()
+        self.last_run = {
+            "engine": engine,
+            "zones": self.zones,
+            "cells": len(self.cells),
+            "chunk_size": chunk_size,
+            "requested_chunk_size": requested_chunk_size,
+            "memory_limit": parse_size(memory_limit),
+            "predicted": prediction,
+            "peak_rss": observed["peak_rss"],
+            "chunks": observed["chunks"],
+        }
+
+    def get_accuracy(self, chunk_size=37, out_dir=None, metrics=METRICS, engine=None, memory_limit=None,
+                     on_exceed="shrink"):
+        """
+        Карты метрик всех зон (параметры - как у iter_accuracy).
+        out_dir - если задан, карты зоны пишутся в memory-mapped файлы <out_dir>/<зона>/<metric>.npy,
+        сведения о расчёте - в <out_dir>/run_meta.json.
+
+        Возвращает словарь {зона: {имя метрики: 2D массив (rows, cols)}}.
+        """
+        metrics = tuple(metrics)
+        rows, cols = self.coefs.shape[:2]
+        if out_dir is not None:
+            results = {name: open_results(os.path.join(out_dir, name), (rows, cols), metrics) for name in self.zones}
+        else:
+            results = {name: {key: np.empty((rows, cols)) for key in metrics} for name in self.zones}
+
+        for row_slice, blocks in self.iter_accuracy(chunk_size, metrics, engine, memory_limit, on_exceed,
+                                                    results_in_memory=out_dir is None):
+            for name, zone_blocks in blocks.items():
+                for key in metrics:
+                    results[name][key][row_slice, :] = zone_blocks[key]
+        if out_dir is not None:
+            for zone_results in results.values():
+                for value in zone_results.values():
+                    value.flush()
+            write_run_metadata(out_dir, self.last_run)
+        return results
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from src.grid_io import atomic_write_json
+from src.instrumentation import stage
+from src.memory import chunk_bytes
+
+_WHITESPACE = re.compile(r"\s*")
+
+# Контрольная точка расчёта в out_dir: описание (форма, метрики, ключ входов) и готовые строки (uint8 на строку)
+CHECKPOINT_NAME = "checkpoint.json"
+PROGRESS_NAME = "progress.npy"
+
+# Оценка числа массивов размера (chunk, cols, H, W), одновременно живущих при расчёте чанка:
+# реконструкция, разница, квадрат/модуль разницы и модуль реконструкции
+CHUNK_ARRAY_FACTOR = 4
+
+
+def iter_json_entries(filename, buffer_size=1 << 20):
+    """
+    Потоково разбирает JSON-файл коэффициентов вида {"[row,col]": {"coefs": [...], "aprox_error": x}, ...}.
+    В памяти одновременно находится только буфер чтения и одна запись.
+
+    Возвращает генератор троек (row, col, value), где value - словарь записи.
+    """
+    decoder = json.JSONDecoder()
+    with open(filename, "r") as f:
+        buf = f.read(buffer_size)
+        eof = not buf
+        pos = _WHITESPACE.match(buf, 0).end()
+        if pos >= len(buf) or buf[pos] != "{":
+            raise ValueError(f"Ожидался JSON-объект в файле {filename}")
+        pos += 1
+
+        while True:
+            start = pos
+            try:
+                pos = _WHITESPACE.match(buf, pos).end()
+                if buf[pos] == ",":
+                    pos = _WHITESPACE.match(buf, pos + 1).end()
+                if buf[pos] == "}":
+                    return
+                key, pos = decoder.raw_decode(buf, pos)
+                pos = _WHITESPACE.match(buf, pos).end()
+                if buf[pos] != ":":
+                    raise ValueError(f"Ожидался ':' после ключа {key} в файле {filename}")
+                pos = _WHITESPACE.match(buf, pos + 1).end()
+                value, pos = decoder.raw_decode(buf, pos)
+            except (IndexError, json.JSONDecodeError):
+                # Запись не поместилась в буфер целиком - дочитываем и разбираем её заново
+                if eof:
+                    raise ValueError(f"Неожиданный конец файла {filename}")
+                chunk = f.read(buffer_size)
+                eof = not chunk
+                buf = buf[start:] + chunk
+                pos = 0
+                continue
+
+            row_str, col_str = key.strip("[]").split(",")
+            yield int(row_str), int(col_str), value
+
+
+def scan_json_shape(filename):
+    """
+    Первый проход по JSON-файлу: определяет размер сетки и число коэффициентов.
+    Возвращает кортеж (rows, cols, n_layers).
+    """
+    max_row, max_col = 0, 0
+    n_layers = None
+    for row, col, value in iter_json_entries(filename):
+        max_row = max(max_row, row)
+        max_col = max(max_col, col)
+        if n_layers is None:
+            n_layers = len(value["coefs"])
+        elif len(value["coefs"]) != n_layers:
+            raise ValueError(f"Непоследовательное число коэффициентов в ключе [{row},{col}]")
+    return max_row + 1, max_col + 1, n_layers
+
+
+def _source_stamp(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def memmap_paths(json_path, cache_dir=None):
+    """Пути к файлам .npy с коэффициентами и ошибками и к файлу метаданных."""
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(json_path), "memmap")
+    base = os.path.join(cache_dir, os.path.splitext(os.path.basename(json_path))[0])
+    return base + ".coefs.npy", base + ".errors.npy", base + ".meta.json"
+
+
+def convert_json_to_memmap(json_path, cache_dir=None, dtype=np.float64):
+    """
+    Преобразует JSON-файл коэффициентов в пару memory-mapped массивов .npy
+    (coefs: (rows, cols, n_layers), errors: (rows, cols)) без загрузки всей сетки в память.
+    Отсутствующие точки заполняются NaN, как в load_json_data. Временные файлы названы по pid:
+    несколько исполнителей могут преобразовывать один файл одновременно.
+
+    Возвращает кортеж путей (coefs_path, errors_path).
+    """
+    coefs_path, errors_path, meta_path = memmap_paths(json_path, cache_dir)
+    os.makedirs(os.path.dirname(coefs_path), exist_ok=True)
+    tmp_suffix = f".{os.getpid()}.tmp"
+
+    with stage("json_parse", path=json_path, streaming=True) as st:
+        rows, cols, n_layers = scan_json_shape(json_path)
+        coefs = open_memmap(coefs_path + tmp_suffix, mode="w+", dtype=dtype, shape=(rows, cols, n_layers))
+        errors = open_memmap(errors_path + tmp_suffix, mode="w+", dtype=dtype, shape=(rows, cols))
+        coefs[:] = np.nan
+        errors[:] = np.nan
+        for row, col, value in iter_json_entries(json_path):
+            coefs[row, col, :] = value["coefs"]
+            errors[row, col] = value["aprox_error"]
+        coefs.flush()
+        errors.flush()
+        del coefs, errors
+        st.add(bytes=os.path.getsize(json_path), points=rows * cols)
+
+    os.replace(coefs_path + tmp_suffix, coefs_path)
+    os.replace(errors_path + tmp_suffix, errors_path)
+    atomic_write_json(meta_path, {"source": _source_stamp(json_path), "shape": [rows, cols, n_layers]},
+                      per_process=True)
+    return coefs_path, errors_path
+
+
+def open_coefs(json_path, cache_dir=None):
+    """
+    Открывает коэффициенты и ошибки как memory-mapped массивы (только чтение).
+    Если кеш .npy отсутствует, устарел относительно JSON-файла или его метаданные не читаются
+    (например, запись прервана), он пересоздаётся.
+
+    Возвращает кортеж (coefs, errors), совместимый с результатом load_json_data.
+    """
+    coefs_path, errors_path, meta_path = memmap_paths(json_path, cache_dir)
+    fresh = False
+    if os.path.exists(coefs_path) and os.path.exists(errors_path) and os.path.exists(meta_path):
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                fresh = json.load(f).get("source") == _source_stamp(json_path)
+        except (OSError, ValueError, AttributeError):
+            fresh = False
+    if not fresh:
+        convert_json_to_memmap(json_path, cache_dir)
+    return np.load(coefs_path, mmap_mode="r"), np.load(errors_path, mmap_mode="r")
+
+
+def rows_per_chunk(memory_budget, cols, n_layers, height, width, n_bases=1, itemsize=8, pixel_arrays=None,
+                   layer_arrays=0, concurrency=1):
+    """
+    Подбирает число строк коэффициентной сетки в чанке так, чтобы временные массивы
+    одного чанка укладывались в memory_budget байт.
+
+    Параметры:
+      memory_budget - бюджет памяти на чанк в байтах;
+      cols, n_layers - размеры сетки коэффициентов;
+      height, width - размер обрезанной волны;
+      n_bases - число одновременно обрабатываемых базисов (для ансамблей);
+      pixel_arrays, layer_arrays, concurrency - модель памяти движка (см. src.engines.ReferenceEngine);
+                   по умолчанию - эталонный расчёт (CHUNK_ARRAY_FACTOR и сумма реконструкций ансамбля).
+    """
+    if pixel_arrays is None:
+        pixel_arrays = CHUNK_ARRAY_FACTOR + (1 if n_bases > 1 else 0)
+    per_row = chunk_bytes(1, cols, n_layers, height, width, pixel_arrays, layer_arrays, n_bases, concurrency,
+                          itemsize)
+    return max(1, int(memory_budget // per_row))
+
+
+def open_results(out_dir, shape, metrics):
+    """
+    Создаёт memory-mapped массивы результатов <out_dir>/<metric>.npy, заполненные NaN.
+    Возвращает словарь {имя метрики: memmap}.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    results = {}
+    for key in metrics:
+        results[key] = open_memmap(os.path.join(out_dir, f"{key}.npy"), mode="w+", dtype=np.float64, shape=shape)
+        results[key][:] = np.nan
+    return results
+
+
+def arrays_key(*arrays):
+    """
+    sha1 содержимого массивов (форма и dtype учитываются). Массив читается по строкам первой оси,
+    поэтому memory-mapped коэффициенты не копируются в память целиком.
+    """
+    h = hashlib.sha1()
+    for array in arrays:
+        h.update(str((np.shape(array), np.asarray(array).dtype.str)).encode("utf-8"))
+        for row in range(0, len(array), 64):
+            h.update(np.ascontiguousarray(array[row:row + 64]).tobytes())
+    return h.hexdigest()
+
+
+def open_checkpoint(out_dir, shape, metrics, inputs_key):
+    """
+    Результаты с контрольными точками: memory-mapped карты <out_dir>/<metric>.npy и карта готовых
+    строк <out_dir>/progress.npy (1 - строка посчитана и сброшена на диск). Если в out_dir уже есть
+    контрольная точка с тем же ключом входов inputs_key, формой и метриками, она открывается на дозапись
+    с сохранением готовых строк, иначе карты создаются заново (NaN) без готовых строк.
+
+    Возвращает (results, progress): словарь {имя метрики: memmap} и memmap progress shape (rows,).
+    """
+    description = {"shape": list(shape), "metrics": list(metrics), "inputs": inputs_key}
+    path = os.path.join(out_dir, CHECKPOINT_NAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            resume = json.load(f) == description
+    except (OSError, ValueError):
+        resume = False
+    progress_path = os.path.join(out_dir, PROGRESS_NAME)
+    if resume:
+        try:
+            results = {key: open_memmap(os.path.join(out_dir, f"{key}.npy"), mode="r+") for key in metrics}
+            progress = open_memmap(progress_path, mode="r+")
+            resume = progress.shape == (shape[0],) and all(value.shape == tuple(shape) for value in results.values())
+        except (OSError, ValueError):
+            resume = False
+    if resume:
+        return results, progress
+
+    # Описание пишется после создания пустых карт: прерванное создание не выглядит как контрольная точка
+    if os.path.exists(path):
+        os.remove(path)
+    results = open_results(out_dir, shape, metrics)
+    progress = open_memmap(progress_path, mode="w+", dtype=np.uint8, shape=(shape[0],))
+    progress.flush()
+    atomic_write_json(path, description)
+    return results, progress
+
+
+def pending_runs(row_blocks, progress):
+    """Части блоков строк (start, end), строки которых ещё не отмечены в progress как готовые."""
+    runs = []
+    for start, end in row_blocks:
+        todo = np.flatnonzero(np.asarray(progress[start:end]) == 0) + start
+        if todo.size == 0:
+            continue
+        # Границы непрерывных отрезков неготовых строк
+        breaks = np.flatnonzero(np.diff(todo) > 1)
+        starts = np.concatenate([[todo[0]], todo[breaks + 1]])
+        ends = np.concatenate([todo[breaks], [todo[-1]]]) + 1
+        runs.extend((int(a), int(b)) for a, b in zip(starts, ends))
+    return runs
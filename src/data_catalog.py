@@ -0,0 +1,274 @@
+import difflib
+import hashlib
+import json
+import os
+import re
+
+from src.grid_io import atomic_write_json
+from src.instrumentation import stage
+from src.loaders import BASIS_EXTRA_FILES, BASIS_REGEX
+
+# Каталог корня данных: <root_folder>/data_catalog.json
+CATALOG_NAME = "data_catalog.json"
+DEFAULT_COEFS_PATTERN = "case_statistics_{wave}_{basis}_{bath}_all.json"
+# Поддиректории корня данных: вид записей -> директория
+SECTIONS = {"waves": "waves", "baths": "bath", "basises": "basises", "coeffs": "coeffs"}
+
+# Кеш хешей содержимого файлов процесса: ключ (path, size, mtime_ns)
+_FILE_HASHES = {}
+
+
+def file_hash(path):
+    """sha1 содержимого файла; повторные вызовы для неизменённого файла берутся из кеша."""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if key not in _FILE_HASHES:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        _FILE_HASHES[key] = h.hexdigest()
+    return _FILE_HASHES[key]
+
+
+def _combined_hash(hashes):
+    h = hashlib.sha1()
+    for value in hashes:
+        h.update(value.encode("utf-8"))
+    return h.hexdigest()
+
+
+def pattern_regex(pattern, names):
+    """
+    Регулярное выражение для имён файлов по шаблону с полями {wave}, {basis}, {bath}.
+    Имена содержат '_', поэтому поле сопоставляется с известными именами names[поле]
+    (длинные - первыми); для поля без известных имён - любая непустая строка.
+    """
+    parts = re.split(r"\{(\w+)\}", pattern)
+    regex = ""
+    for i, part in enumerate(parts):
+        if i % 2 == 0:
+            regex += re.escape(part)
+            continue
+        known = sorted(names.get(part, ()), key=len, reverse=True)
+        alternatives = "|".join(re.escape(name) for name in known) if known else ".+?"
+        regex += f"(?P<{part}>{alternatives})"
+    return re.compile(regex + "$")
+
+
+class DataCatalog:
+    """
+    Индекс корня данных (waves/, bath/, basises/, coeffs/): имена, размеры, время изменения
+    и sha1 содержимого файлов, номера базисных функций и разобранные по шаблону имена файлов
+    коэффициентов. Строится одним проходом по директориям и хранится в data_catalog.json;
+    refresh перехеширует только файлы с изменившимся размером или временем изменения.
+
+        catalog = DataCatalog("data/n_accurate_set").refresh()
+        catalog.coefs_path("x_200_2000", "async_gaus_single_2", "basis_12")
+    """
+
+    def __init__(self, root_folder, coefs_pattern=DEFAULT_COEFS_PATTERN, regex_pattern=BASIS_REGEX):
+        self.root_folder = root_folder
+        self.coefs_pattern = coefs_pattern
+        self.regex_pattern = regex_pattern
+        self.path = os.path.join(root_folder, CATALOG_NAME)
+        self.entries = self._load()
+
+    def _load(self):
+        """Записи сохранённого каталога или пустые разделы, если его нет или он повреждён."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = {}
+        return {section: entries.get(section, {}) for section in SECTIONS}
+
+    def save(self):
+        return atomic_write_json(self.path, self.entries, ensure_ascii=False, indent=1, sort_keys=True)
+
+    def _file_entry(self, path, old, hash_contents):
+        """Запись файла; хеш берётся из старой записи, если размер и время изменения те же."""
+        st = os.stat(path)
+        entry = {"path": os.path.relpath(path, self.root_folder), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        if old is not None and old.get("size") == st.st_size and old.get("mtime_ns") == st.st_mtime_ns:
+            entry["sha1"] = old.get("sha1")
+        else:
+            entry["sha1"] = None
+        if hash_contents and entry["sha1"] is None:
+            entry["sha1"] = file_hash(path)
+        return entry
+
+    def _scan_files(self, directory, old_section, hash_contents):
+        """Файлы directory как {имя без расширения: запись}."""
+        section = {}
+        if not os.path.isdir(directory):
+            return section
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.join(directory, filename)
+            if not os.path.isfile(path) or filename.endswith(".tmp"):
+                continue
+            name = os.path.splitext(filename)[0]
+            section[name] = self._file_entry(path, old_section.get(name), hash_contents)
+        return section
+
+    def _scan_basis(self, directory, old, hash_contents):
+        """Базис: функции по номерам (BASIS_REGEX), разреженный файл и карта меток, если есть."""
+        old = old or {}
+        old_files = {entry["path"]: entry for entry in old.get("files", [])}
+        indexed = {}
+        extra = {}
+        for filename in os.listdir(directory):
+            path = os.path.join(directory, filename)
+            if not os.path.isfile(path) or filename.endswith(".tmp"):
+                continue
+            relative = os.path.relpath(path, self.root_folder)
+            match = re.search(self.regex_pattern, filename)
+            if match:
+                entry = self._file_entry(path, old_files.get(relative), hash_contents)
+                entry["index"] = int(match.group(1))
+                indexed[entry["index"]] = entry
+            else:
+                extra[filename] = self._file_entry(path, old.get("extra", {}).get(filename), hash_contents)
+        files = [indexed[index] for index in sorted(indexed)]
+        record = {"files": files, "extra": extra, "n_layers": len(files)}
+        hashes = [entry["sha1"] for entry in files]
+        record["sha1"] = _combined_hash(hashes) if hashes and None not in hashes else None
+        return record
+
+    def refresh(self, hash_contents=True, save=True):
+        """
+        Пересканирует корень данных. Записи неизменённых файлов (тот же размер и время изменения)
+        переиспользуются вместе с хешами, хешируются только новые и изменённые файлы
+        (hash_contents=False - не хешировать, хеши считаются по требованию в fingerprint).
+        Возвращает self.
+        """
+        root = self.root_folder
+        with stage("catalog_refresh", path=root) as st:
+            old = self.entries
+            entries = {
+                "waves": self._scan_files(os.path.join(root, SECTIONS["waves"]), old["waves"], hash_contents),
+                "baths": self._scan_files(os.path.join(root, SECTIONS["baths"]), old["baths"], hash_contents),
+                "basises": {},
+            }
+            basis_root = os.path.join(root, SECTIONS["basises"])
+            if os.path.isdir(basis_root):
+                for name in sorted(os.listdir(basis_root)):
+                    directory = os.path.join(basis_root, name)
+                    if os.path.isdir(directory):
+                        entries["basises"][name] = self._scan_basis(directory, old["basises"].get(name), hash_contents)
+
+            # Файлы коэффициентов - по полному имени; поля имени разбираются по шаблону и известным именам
+            regex = pattern_regex(self.coefs_pattern, {"wave": entries["waves"], "basis": entries["basises"],
+                                                      "bath": entries["baths"]})
+            entries["coeffs"] = {}
+            coeffs_directory = os.path.join(root, SECTIONS["coeffs"])
+            for filename in sorted(os.listdir(coeffs_directory)) if os.path.isdir(coeffs_directory) else []:
+                path = os.path.join(coeffs_directory, filename)
+                if not os.path.isfile(path) or filename.endswith(".tmp"):
+                    continue
+                entry = self._file_entry(path, old["coeffs"].get(filename), hash_contents)
+                match = regex.match(filename)
+                entry["key"] = match.groupdict() if match else None
+                entries["coeffs"][filename] = entry
+            self.entries = entries
+            st.add(files=self.n_files())
+        if save:
+            self.save()
+        return self
+
+    def n_files(self):
+        basis_files = sum(len(record["files"]) + len(record["extra"]) for record in self.entries["basises"].values())
+        return len(self.entries["waves"]) + len(self.entries["baths"]) + len(self.entries["coeffs"]) + basis_files
+
+    def names(self, section):
+        """Имена волн ("waves"), батиметрий ("baths") или базисов ("basises") каталога."""
+        return sorted(self.entries[section])
+
+    def basis_files(self, basis):
+        """Пути файлов базисных функций базиса по возрастанию номера (вместо os.listdir и regex)."""
+        record = self._get("basises", basis)
+        return [os.path.join(self.root_folder, entry["path"]) for entry in record["files"]]
+
+    def wave_path(self, wave):
+        return os.path.join(self.root_folder, self._get("waves", wave)["path"])
+
+    def bath_path(self, bath):
+        return os.path.join(self.root_folder, self._get("baths", bath)["path"])
+
+    def _get(self, section, name):
+        try:
+            return self.entries[section][name]
+        except KeyError:
+            close = difflib.get_close_matches(name, list(self.entries[section]), n=3)
+            hint = f"; похожие: {', '.join(close)}" if close else ""
+            raise KeyError(f"В каталоге {self.root_folder} нет {section}/{name}{hint}") from None
+
+    def query(self, bath=None, wave=None, basis=None):
+        """Записи файлов коэффициентов, имена которых разобраны с заданными bath, wave и basis (None - любое)."""
+        wanted = {"bath": bath, "wave": wave, "basis": basis}
+        result = []
+        for entry in self.entries["coeffs"].values():
+            key = entry["key"]
+            if key is not None and all(value is None or key.get(field) == value for field, value in wanted.items()):
+                result.append(entry)
+        return result
+
+    def coefs_path(self, bath, wave, basis):
+        """
+        Путь файла коэффициентов тройки (bath, wave, basis) по каталогу; файла нет - KeyError
+        с ожидаемым именем и похожими именами из coeffs/.
+        """
+        entries = self.query(bath, wave, basis)
+        if len(entries) == 1:
+            return os.path.join(self.root_folder, entries[0]["path"])
+        expected = self.coefs_pattern.format(wave=wave, basis=basis, bath=bath)
+        if entries:
+            raise KeyError(f"Несколько файлов коэффициентов для {expected}: "
+                           + ", ".join(entry["path"] for entry in entries))
+        close = difflib.get_close_matches(expected, list(self.entries["coeffs"]), n=3)
+        hint = f"; похожие: {', '.join(close)}" if close else ""
+        raise KeyError(f"Нет файла коэффициентов {expected}{hint}")
+
+    def _sha1(self, entry):
+        if entry.get("sha1") is None:
+            entry["sha1"] = file_hash(os.path.join(self.root_folder, entry["path"]))
+        return entry["sha1"]
+
+    def fingerprint(self, bath, wave, basis):
+        """
+        Ключ содержимого входов тройки для кешей и маркеров: sha1 волны, функций базиса по порядку,
+        имеющихся файлов базиса BASIS_EXTRA_FILES (разреженный файл, карта меток, манифест) по порядку
+        имён и файла коэффициентов (те же хеши, что считает src.sweep.task_inputs_hash по файлам).
+        Возвращает список хешей в этом порядке.
+        """
+        hashes = [self._sha1(self._get("waves", wave))]
+        record = self._get("basises", basis)
+        hashes += [self._sha1(entry) for entry in record["files"]]
+        hashes += [self._sha1(record["extra"][name]) for name in BASIS_EXTRA_FILES if name in record["extra"]]
+        coefs = self.coefs_path(bath, wave, basis)
+        hashes.append(self._sha1(self.entries["coeffs"][os.path.basename(coefs)]))
+        return hashes
+
+    def preflight(self, baths, waves, basises):
+        """
+        Проверка входов серии до расчёта: список описаний недостающих волн, базисов (или базисов
+        без функций) и файлов коэффициентов; пустой список - всё на месте.
+        """
+        problems = []
+        for section, names in (("waves", waves), ("basises", basises)):
+            for name in names:
+                try:
+                    record = self._get(section, name)
+                except KeyError as exc:
+                    problems.append(exc.args[0])
+                    continue
+                if section == "basises" and not record["files"] and not record["extra"]:
+                    problems.append(f"Базис {name} не содержит файлов")
+        for bath in baths:
+            for wave in waves:
+                for basis in basises:
+                    try:
+                        self.coefs_path(bath, wave, basis)
+                    except KeyError as exc:
+                        problems.append(exc.args[0])
+        return problems
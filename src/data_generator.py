@@ -1,56 +1,71 @@
 import os
 import json
 import numpy as np
-import matplotlib.pyplot as plt
+
+from src.fields import SeparableField
 
 
 class ShapeGenerator:
-    def __init__(self):
+    def __init__(self, config_path=os.path.join("config", "zones.json")):
         """
         Инициализация генератора форм.
-        Загружает конфигурацию исключительно из файла config/zones.json.
+        Загружает конфигурацию исключительно из файла config/zones.json
+        (или из файла config_path).
         """
-        config_path = os.path.join("config", "zones.json")
         with open(config_path, 'r', encoding='utf-8') as f:
             config = json.load(f)
         self.height, self.width = config["size"]
 
-    def gradient_x(self, min_value=0.0, max_value=1.0):
+    def _field(self, terms, lazy):
+        """
+        Все формы - суммы внешних произведений профилей по y и x (см. SeparableField).
+        lazy=True возвращает ленивое поле (view(), rows(), write_to()), иначе - готовый массив.
+        """
+        field = SeparableField((self.height, self.width), terms)
+        return field if lazy else field.to_array()
+
+    def gradient_x(self, min_value=0.0, max_value=1.0, lazy=False):
         """
         Генерирует 2D массив с линейным градиентом по оси X.
 
         Параметры:
           min_value: минимальное значение
           max_value: максимальное значение
+          lazy: вернуть ленивое поле SeparableField вместо массива
         """
         x = np.linspace(min_value, max_value, self.width)
-        return np.tile(x, (self.height, 1))
+        return self._field([(1.0, np.ones(self.height), x)], lazy)
 
-    def gradient_y(self, min_value=0.0, max_value=1.0):
+    def gradient_y(self, min_value=0.0, max_value=1.0, lazy=False):
         """
         Генерирует 2D массив с линейным градиентом по оси Y.
 
         Параметры:
           min_value: минимальное значение
           max_value: максимальное значение
+          lazy: вернуть ленивое поле SeparableField вместо массива
         """
-        y = np.linspace(min_value, max_value, self.height)[:, None]
-        return np.tile(y, (1, self.width))
+        y = np.linspace(min_value, max_value, self.height)
+        return self._field([(1.0, y, np.ones(self.width))], lazy)
 
-    def parabola(self, min_value=0.0, max_value=1.0):
+    def _parabola_profile(self, min_value, max_value):
+        y_norm = np.linspace(0, 1, self.height)
+        parabolic = 1 - y_norm ** 2
+        return min_value + (max_value - min_value) * parabolic
+
+    def parabola(self, min_value=0.0, max_value=1.0, lazy=False):
         """
         Генерирует 2D параболическую форму, которая константна по x и изменяется только по y.
         Формула:
             f(y) = min_value + (max_value - min_value) * (1 - y_norm**2),
         где y_norm = y / (height - 1) для y ∈ [0, height-1].
         В результате значение при y = 0 будет max_value, а при y = height-1 – min_value.
+        lazy=True возвращает ленивое поле SeparableField вместо массива.
         """
-        y_norm = np.linspace(0, 1, self.height)
-        parabolic = 1 - y_norm ** 2
-        parabolic_scaled = min_value + (max_value - min_value) * parabolic
-        return np.tile(parabolic_scaled[:, None], (1, self.width))
+        return self._field([(1.0, self._parabola_profile(min_value, max_value), np.ones(self.width))], lazy)
 
-    def parabola_sine(self, min_value=0.0, max_value=1.0, sin_amp=0.5, sin_period_x=50, sin_period_y=50):
+    def parabola_sine(self, min_value=0.0, max_value=1.0, sin_amp=0.5, sin_period_x=50, sin_period_y=50,
+                      lazy=False):
         """
         Генерирует 2D форму: базовая парабола (константная по x, максимум при y=0)
         с добавлением синусоидальной модуляции по обеим осям.
@@ -60,17 +75,23 @@ class ShapeGenerator:
           sin_amp: амплитуда синусоидальной модуляции
           sin_period_x: период синуса по оси X (в пикселях)
           sin_period_y: период синуса по оси Y (в пикселях)
+          lazy: вернуть ленивое поле SeparableField вместо массива
+
+        Модуляция sin(x) * sin(y) разделима, поэтому поле - сумма двух внешних произведений
+        профилей без сеток meshgrid.
         """
-        base = self.parabola(min_value=min_value, max_value=max_value)
         y = np.linspace(0, self.height - 1, self.height)
         x = np.linspace(0, self.width - 1, self.width)
-        X, Y = np.meshgrid(x, y)
-        modulation = sin_amp * (np.sin(2 * np.pi * X / sin_period_x) * np.sin(2 * np.pi * Y / sin_period_y))
-        return base + modulation
+        return self._field([
+            (1.0, self._parabola_profile(min_value, max_value), np.ones(self.width)),
+            (sin_amp, np.sin(2 * np.pi * y / sin_period_y), np.sin(2 * np.pi * x / sin_period_x)),
+        ], lazy)
 
 
 # Пример для самостоятельного тестирования с визуализацией:
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+
     generator = ShapeGenerator()
 
     data_examples = {
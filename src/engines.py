@@ -0,0 +1,421 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src.instrumentation import stage
+from src.sparse_basis import SparseBasis
+
+# Имена метрик, которые возвращает get_accuracy (и в том же порядке сохраняются на диск)
+METRICS = ("rms_accuracy", "max_accuracy", "max_value_diff")
+
+
+def gram_matrix(basis_stack):
+    """Матрица Грама базиса G[i, j] = <b_i, b_j>, shape (n_layers, n_layers)."""
+    with stage("gram_build", layers=basis_stack.shape[0]):
+        flat = basis_stack.reshape(basis_stack.shape[0], -1)
+        return flat @ flat.T
+
+
+def wave_projection(basis_stack, wave):
+    """Проекции волны на базисные функции p[i] = <b_i, wave>, shape (n_layers,)."""
+    return basis_stack.reshape(basis_stack.shape[0], -1) @ wave.reshape(-1)
+
+
+def wave_projections(basis_stack, waves):
+    """
+    Проекции нескольких волн (n_waves, H, W) на базисные функции одним матричным произведением:
+    P[w, i] = <b_i, waves[w]>, shape (n_waves, n_layers). Для SparseBasis - по волне на носителях.
+    """
+    if isinstance(basis_stack, SparseBasis):
+        return np.stack([basis_stack.project(wave) for wave in waves])
+    with stage("projection_build", layers=basis_stack.shape[0], waves=len(waves)):
+        flat = basis_stack.reshape(basis_stack.shape[0], -1)
+        return np.asarray(waves).reshape(len(waves), -1) @ flat.T
+
+
+def rms_chunk_gram(coefs_chunk, gram, projection, wave_sq_sum, n_pixels, wave_rms):
+    """
+    Нормированное RMS отклонение для блока строк без построения реконструкции:
+      ||wave - B c||^2 = <wave, wave> - 2 c·p + c^T G c,
+    где G - матрица Грама базиса, p - проекции волны на базис.
+    Возвращает массив (chunk, cols).
+    """
+    quad = np.sum((coefs_chunk @ gram) * coefs_chunk, axis=-1)
+    lin = coefs_chunk @ projection
+    # Отрицательные значения возможны только из-за округления
+    mse = np.maximum(wave_sq_sum - 2 * lin + quad, 0.0) / n_pixels
+    return np.sqrt(mse) / wave_rms
+
+
+def rms_chunks_gram(coefs_chunks, gram, projections, wave_sq_sums, n_pixels, wave_rms):
+    """
+    rms_chunk_gram для одного блока строк нескольких волн с общим базисом одним сжатием:
+    coefs_chunks (n_waves, chunk, cols, n_layers), projections (n_waves, n_layers),
+    wave_sq_sums и wave_rms - (n_waves,). Возвращает массив (n_waves, chunk, cols).
+    """
+    quad = np.sum((coefs_chunks @ gram) * coefs_chunks, axis=-1)
+    lin = np.einsum("wrcl,wl->wrc", coefs_chunks, projections)
+    mse = np.maximum(wave_sq_sums[:, None, None] - 2 * lin + quad, 0.0) / n_pixels
+    return np.sqrt(mse) / wave_rms[:, None, None]
+
+
+def accuracy_chunk(coefs_chunk, basis_stack, wave, wave_rms, wave_max):
+    """
+    Вычисляет метрики аппроксимации для блока строк коэффициентной сетки.
+
+    Параметры:
+      coefs_chunk: коэффициенты блока, shape (chunk, cols, n_layers);
+      basis_stack: базисные функции, shape (n_layers, H, W);
+      wave: исходная волна, shape (H, W);
+      wave_rms, wave_max: RMS и максимум модуля волны.
+
+    Возвращает словарь {имя метрики: массив (chunk, cols)}.
+    """
+    with stage("compute") as st:
+        # Результат tensordot имеет shape (chunk, cols, H, W)
+        reconstruction_chunk = np.tensordot(coefs_chunk, basis_stack, axes=([2], [0]))
+        st.add(points=coefs_chunk.shape[0] * coefs_chunk.shape[1], pixels=reconstruction_chunk.size)
+    with stage("reduce"):
+        return _reduce_chunk(reconstruction_chunk, wave, wave_rms, wave_max)
+
+
+def _reduce_chunk(reconstruction_chunk, wave, wave_rms, wave_max):
+    """Сводит реконструкции блока (chunk, cols, H, W) к картам метрик (chunk, cols)."""
+    diff_chunk = wave - reconstruction_chunk  # broadcasting: (chunk, cols, H, W)
+    max_reconstructed_chunk = np.max(np.abs(reconstruction_chunk), axis=(2, 3))
+    return {
+        # Нормированное RMS отклонение для каждой точки
+        "rms_accuracy": np.sqrt(np.mean(diff_chunk ** 2, axis=(2, 3))) / wave_rms,
+        # Нормированное максимальное отклонение для каждой точки
+        "max_accuracy": np.max(np.abs(diff_chunk), axis=(2, 3)) / wave_max,
+        # Абсолютная разница между максимальным значением реконструкции и wave_max, нормированная на wave_max
+        "max_value_diff": np.abs(max_reconstructed_chunk - wave_max) / wave_max,
+    }
+
+
+def _abs_max(array, axis):
+    """max(|array|) по осям axis без временного массива модулей (NaN сохраняется)."""
+    return np.maximum(np.max(array, axis=axis), -np.min(array, axis=axis))
+
+
+class ReferenceEngine:
+    """
+    Эталонный движок: полная реконструкция блока через tensordot и прямое вычисление метрик.
+    Остальные движки сверяются с ним (см. src/equivalence.py).
+
+    Движок создаётся для пары (волна, базис) и затем обрабатывает блоки коэффициентов.
+    """
+    name = "reference"
+    # Метрики, которые умеет считать движок
+    metrics = METRICS
+    # Допустимое абсолютное отклонение от эталона для каждой метрики (метрики нормированы)
+    tolerances = {"rms_accuracy": 1e-10, "max_accuracy": 1e-10, "max_value_diff": 1e-10}
+    # Модель памяти чанка для src.memory.predict_peak: число одновременно живых массивов
+    # (chunk, cols, H, W) в единицах float64, временных массивов (chunk, cols, n_layers)
+    # и число чанков, обрабатываемых одновременно
+    pixel_arrays = 4
+    layer_arrays = 0
+    concurrency = 1
+    # Величины, которые движок принимает готовыми (например, из src.array_cache): матрица Грама, проекции волны
+    precomputed = ()
+
+    def __init__(self, wave, basis_stack, gram=None):
+        self.wave = wave
+        self.basis_stack = basis_stack
+        self.gram = gram
+        self.wave_rms = np.sqrt(np.mean(wave ** 2))
+        self.wave_max = np.max(np.abs(wave))
+
+    def chunk(self, coefs_chunk, metrics):
+        """Метрики для блока коэффициентов (chunk, cols, n_layers): {метрика: (chunk, cols)}."""
+        return accuracy_chunk(coefs_chunk, self.basis_stack, self.wave, self.wave_rms, self.wave_max)
+
+    def map_chunks(self, blocks, metrics):
+        """
+        Обрабатывает последовательность ((start, end), coefs_chunk) и выдаёт ((start, end), результат)
+        в том же порядке.
+        """
+        for bounds, coefs_chunk in blocks:
+            yield bounds, self.chunk(coefs_chunk, metrics)
+
+
+class FusedEngine(ReferenceEngine):
+    """
+    Реконструкция через tensordot, но без промежуточных массивов разницы, квадратов и модулей:
+    разница вычитается на месте, сумма квадратов берётся через einsum. Пиковая память чанка
+    в несколько раз меньше, чем у эталона.
+    """
+    name = "fused"
+    dtype = np.float64
+    pixel_arrays = 1
+
+    def __init__(self, wave, basis_stack, gram=None):
+        super().__init__(wave, basis_stack, gram)
+        self.wave_cast = wave.astype(self.dtype, copy=False)
+        self.basis_cast = basis_stack.astype(self.dtype, copy=False)
+
+    def chunk(self, coefs_chunk, metrics):
+        with stage("compute", engine=self.name) as st:
+            coefs_cast = coefs_chunk.astype(self.dtype, copy=False)
+            reconstruction = np.tensordot(coefs_cast, self.basis_cast, axes=([2], [0]))
+            st.add(points=coefs_chunk.shape[0] * coefs_chunk.shape[1], pixels=reconstruction.size)
+            result = {}
+            if "max_value_diff" in metrics:
+                max_reconstructed = _abs_max(reconstruction, (2, 3)).astype(np.float64)
+                result["max_value_diff"] = np.abs(max_reconstructed - self.wave_max) / self.wave_max
+            # Дальше reconstruction хранит разницу (со знаком минус - на модуль и квадрат не влияет)
+            np.subtract(reconstruction, self.wave_cast, out=reconstruction)
+            if "max_accuracy" in metrics:
+                result["max_accuracy"] = _abs_max(reconstruction, (2, 3)).astype(np.float64) / self.wave_max
+            if "rms_accuracy" in metrics:
+                sq_sum = np.einsum("ijkl,ijkl->ij", reconstruction, reconstruction).astype(np.float64)
+                result["rms_accuracy"] = np.sqrt(sq_sum / self.wave.size) / self.wave_rms
+            return result
+
+
+class Float32Engine(FusedEngine):
+    """Как fused, но реконструкция и редукции в float32: вдвое меньше памяти и трафика."""
+    name = "float32"
+    dtype = np.float32
+    pixel_arrays = 0.5
+    tolerances = {"rms_accuracy": 1e-4, "max_accuracy": 1e-5, "max_value_diff": 1e-5}
+
+
+class GramEngine(ReferenceEngine):
+    """
+    Замкнутая форма для RMS через матрицу Грама базиса: O(n_layers^2) на точку без реконструкций.
+    Максимумы так не считаются, поэтому движок поддерживает только rms_accuracy.
+    """
+    name = "gram"
+    metrics = ("rms_accuracy",)
+    pixel_arrays = 0
+    layer_arrays = 2
+    # Вычитание близких величин <w,w> и 2c·p - c^T G c теряет около половины значащих цифр
+    tolerances = {"rms_accuracy": 1e-6}
+    precomputed = ("gram", "projection")
+
+    def __init__(self, wave, basis_stack, gram=None, projection=None):
+        super().__init__(wave, basis_stack, gram)
+        if self.gram is None:
+            self.gram = gram_matrix(basis_stack)
+        self.projection = wave_projection(basis_stack, wave) if projection is None else projection
+        self.wave_sq_sum = np.sum(wave ** 2)
+
+    def chunk(self, coefs_chunk, metrics):
+        with stage("compute", engine=self.name) as st:
+            rms = rms_chunk_gram(coefs_chunk, self.gram, self.projection, self.wave_sq_sum,
+                                 self.wave.size, self.wave_rms)
+            st.add(points=coefs_chunk.shape[0] * coefs_chunk.shape[1])
+        return {"rms_accuracy": rms}
+
+
+class SparseEngine(ReferenceEngine):
+    """
+    Движок для базисов с компактными носителями в формате CSR (src.sparse_basis.SparseBasis):
+    RMS - через разреженную матрицу Грама, реконструкция для максимумов - сложением функций
+    только на их носителях. Стоимость пропорциональна суммарному размеру носителей, а не n_layers * H * W.
+    Плотный базис переводится в CSR.
+    """
+    name = "sparse"
+    pixel_arrays = 1
+    layer_arrays = 2
+    # RMS считается через матрицу Грама, как у движка gram
+    tolerances = {"rms_accuracy": 1e-6, "max_accuracy": 1e-10, "max_value_diff": 1e-10}
+    sparse = True
+    precomputed = ("gram", "projection")
+
+    def __init__(self, wave, basis_stack, gram=None, projection=None):
+        if not isinstance(basis_stack, SparseBasis):
+            basis_stack = SparseBasis.from_dense(basis_stack)
+        super().__init__(wave, basis_stack, gram)
+        if self.gram is None:
+            self.gram = basis_stack.gram()
+        self.projection = basis_stack.project(wave) if projection is None else projection
+        self.wave_sq_sum = np.sum(wave ** 2)
+
+    def chunk(self, coefs_chunk, metrics):
+        with stage("compute", engine=self.name) as st:
+            result = {}
+            if "rms_accuracy" in metrics:
+                result["rms_accuracy"] = rms_chunk_gram(coefs_chunk, self.gram, self.projection, self.wave_sq_sum,
+                                                        self.wave.size, self.wave_rms)
+            if "max_accuracy" in metrics or "max_value_diff" in metrics:
+                reconstruction_chunk = self.basis_stack.reconstruct(coefs_chunk)
+                if "max_value_diff" in metrics:
+                    max_reconstructed = _abs_max(reconstruction_chunk, axis=(2, 3))
+                    result["max_value_diff"] = np.abs(max_reconstructed - self.wave_max) / self.wave_max
+                if "max_accuracy" in metrics:
+                    reconstruction_chunk -= self.wave
+                    result["max_accuracy"] = _abs_max(reconstruction_chunk, axis=(2, 3)) / self.wave_max
+                del reconstruction_chunk
+            st.add(points=coefs_chunk.shape[0] * coefs_chunk.shape[1])
+            return result
+
+
+def tile_layout(basis_stack):
+    """
+    Проверяет, что базис плиточный: носители функций не пересекаются, а внутри носителя
+    функция постоянна (как у BasisGenerator.generate_basis). Форма носителей любая -
+    прямоугольные плитки и области произвольной карты меток обрабатываются одинаково.
+
+    Возвращает (labels, values): labels - массив (H, W) с номером плитки пикселя (-1 вне плиток),
+    values - значение каждой функции на её носителе. Для неплиточного базиса - ValueError.
+    """
+    n_layers = basis_stack.shape[0]
+    flat = basis_stack.reshape(n_layers, -1)
+    support = flat != 0
+    if np.any(support.sum(axis=0) > 1):
+        raise ValueError("Носители базисных функций пересекаются - базис не плиточный")
+    values = np.empty(n_layers)
+    for k in range(n_layers):
+        layer = flat[k][support[k]]
+        if layer.size == 0:
+            raise ValueError(f"Базисная функция {k} тождественно равна нулю")
+        if np.any(layer != layer[0]):
+            raise ValueError(f"Базисная функция {k} не постоянна на своём носителе - базис не плиточный")
+        values[k] = layer[0]
+    labels = np.where(support.any(axis=0), np.argmax(support, axis=0), -1)
+    return labels.reshape(basis_stack.shape[1:]), values
+
+
+def region_stats(labels, wave, n_regions):
+    """
+    Статистики волны по областям карты меток за один проход np.bincount / ufunc.at:
+    число пикселей, сумма, минимум и максимум каждой области (n_regions,) и максимум модуля
+    волны вне областей (метка < 0). Возвращает словарь с ключами counts, sums, min, max, outside_abs_max.
+    """
+    flat_labels = np.asarray(labels).reshape(-1)
+    flat_wave = np.asarray(wave).reshape(-1)
+    inside = flat_labels >= 0
+    region_labels, region_wave = flat_labels[inside], flat_wave[inside]
+    region_min = np.full(n_regions, np.inf)
+    region_max = np.full(n_regions, -np.inf)
+    np.minimum.at(region_min, region_labels, region_wave)
+    np.maximum.at(region_max, region_labels, region_wave)
+    return {
+        "counts": np.bincount(region_labels, minlength=n_regions).astype(np.float64),
+        "sums": np.bincount(region_labels, weights=region_wave, minlength=n_regions),
+        "min": region_min,
+        "max": region_max,
+        # Вне областей реконструкция равна нулю, отклонение - модуль волны
+        "outside_abs_max": np.max(np.abs(flat_wave[~inside])) if np.any(~inside) else 0.0,
+    }
+
+
+class TileEngine(ReferenceEngine):
+    """
+    Аналитический движок для плиточных базисов: реконструкция на плитке k равна c_k * v_k,
+    поэтому все метрики точки выражаются через статистики волны по плиткам
+    (число пикселей, сумма, сумма квадратов, минимум и максимум). Стоимость - O(n_layers) на точку.
+    Максимальные метрики точные, а не оценки.
+    """
+    name = "tile"
+    pixel_arrays = 0
+    layer_arrays = 4
+    tolerances = {"rms_accuracy": 1e-8, "max_accuracy": 1e-10, "max_value_diff": 1e-10}
+
+    def __init__(self, wave, basis_stack, gram=None, labels=None, values=None, stats=None):
+        """
+        labels, values - карта меток (H, W) и значения функций на своих областях, если они уже
+        известны (например, из BasisGenerator.label_map): тогда basis_stack не нужен и не проверяется.
+        stats - готовые статистики волны по областям (region_stats, например из src.tiling_set),
+        чтобы не считать их по пикселям заново.
+        """
+        super().__init__(wave, basis_stack, gram)
+        if labels is None:
+            labels, values = tile_layout(basis_stack)
+        elif values is None:
+            values = np.ones(int(labels.max()) + 1)
+        self.labels = labels
+        self.values = np.asarray(values, dtype=np.float64)
+        if stats is None:
+            stats = region_stats(labels, wave, self.values.size)
+        self.counts, self.sums = stats["counts"], stats["sums"]
+        self.tile_min, self.tile_max = stats["min"], stats["max"]
+        self.outside_abs_max = stats["outside_abs_max"]
+        self.wave_sq_sum = np.sum(wave ** 2)
+
+    @classmethod
+    def from_labels(cls, wave, labels, values=None, stats=None):
+        """Движок для базиса, заданного картой меток: функция k равна values[k] на области k."""
+        return cls(wave, None, labels=labels, values=values, stats=stats)
+
+    def reconstruct(self, coefs):
+        """
+        Реконструкция сбором (gather) по карте меток без tensordot: уровни c_k * v_k
+        раскладываются по пикселям областей. coefs shape (..., n_layers) -> (..., H, W).
+        """
+        levels = np.asarray(coefs) * self.values
+        # Метка -1 (вне областей) указывает на добавленный последним нулевой уровень
+        levels = np.concatenate([levels, np.zeros(levels.shape[:-1] + (1,))], axis=-1)
+        return levels[..., self.labels]
+
+    def chunk(self, coefs_chunk, metrics):
+        with stage("compute", engine=self.name) as st:
+            # Значение реконструкции на каждой плитке, shape (chunk, cols, n_layers)
+            levels = coefs_chunk * self.values
+            result = {}
+            if "rms_accuracy" in metrics:
+                sq_sum = self.wave_sq_sum - 2 * levels @ self.sums + (levels ** 2) @ self.counts
+                result["rms_accuracy"] = np.sqrt(np.maximum(sq_sum, 0.0) / self.wave.size) / self.wave_rms
+            if "max_accuracy" in metrics:
+                tile_dev = np.maximum(self.tile_max - levels, levels - self.tile_min)
+                result["max_accuracy"] = np.maximum(np.max(tile_dev, axis=-1), self.outside_abs_max) / self.wave_max
+            if "max_value_diff" in metrics:
+                max_reconstructed = np.max(np.abs(levels), axis=-1)
+                result["max_value_diff"] = np.abs(max_reconstructed - self.wave_max) / self.wave_max
+            st.add(points=coefs_chunk.shape[0] * coefs_chunk.shape[1])
+            return result
+
+
+class ParallelEngine(ReferenceEngine):
+    """
+    Эталонные вычисления, но блоки обрабатываются пулом потоков (tensordot и редукции numpy
+    отпускают GIL). Одновременно в работе не больше 2 * workers блоков, чтобы не читать
+    весь memmap коэффициентов заранее.
+    """
+    name = "parallel"
+
+    def __init__(self, wave, basis_stack, gram=None, workers=None):
+        super().__init__(wave, basis_stack, gram)
+        self.workers = workers or os.cpu_count() or 1
+        self.concurrency = self.workers
+
+    def chunk(self, coefs_chunk, metrics):
+        # Этап идёт в потоке пула: стек этапов у потока свой, пик RSS такие этапы не измеряют
+        with stage("compute", engine=self.name) as st:
+            reconstruction_chunk = np.tensordot(coefs_chunk, self.basis_stack, axes=([2], [0]))
+            st.add(points=coefs_chunk.shape[0] * coefs_chunk.shape[1], pixels=reconstruction_chunk.size)
+            return _reduce_chunk(reconstruction_chunk, self.wave, self.wave_rms, self.wave_max)
+
+    def map_chunks(self, blocks, metrics):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque()
+            for bounds, coefs_chunk in blocks:
+                pending.append((bounds, pool.submit(self.chunk, coefs_chunk, metrics)))
+                if len(pending) >= 2 * self.workers:
+                    bounds_done, future = pending.popleft()
+                    yield bounds_done, future.result()
+            while pending:
+                bounds_done, future = pending.popleft()
+                yield bounds_done, future.result()
+
+
+ENGINES = {engine.name: engine for engine in
+           (ReferenceEngine, FusedEngine, Float32Engine, GramEngine, SparseEngine, TileEngine, ParallelEngine)}
+
+
+def make_engine(name, wave, basis_stack, gram=None, **options):
+    """
+    Создаёт движок по имени из ENGINES для волны и базиса (плотного массива или SparseBasis).
+    ValueError, если имя неизвестно или базис не подходит движку (например, tile для неплиточного базиса).
+    """
+    if name not in ENGINES:
+        raise ValueError(f"Неизвестный движок {name}; доступны: {', '.join(ENGINES)}")
+    engine_class = ENGINES[name]
+    if isinstance(basis_stack, SparseBasis) and not getattr(engine_class, "sparse", False):
+        # Плотные движки получают базис в виде массива (n_layers, H, W)
+        basis_stack = basis_stack.toarray()
+    return engine_class(wave, basis_stack, gram, **options)
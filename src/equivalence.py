@@ -0,0 +1,193 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from src.basis_generator import compact_labels, label_basis_stack, voronoi_labels
+from src.calc_total_acc import TotalAccuracy
+from src.calc_total_acc_mean import TotalAccuracyMean
+from src.engines import ENGINES, METRICS, make_engine
+from src.synthetic import synthetic_coefs, synthetic_wave, tile_basis_stack, tile_shape, write_config
+
+# Виды случайных случаев: плиточный базис, плиточный с разными значениями на плитках,
+# разбиение картой меток (ячейки Вороного, часть зоны не покрыта), гладкий неплиточный базис
+# (гауссовы «шапки») и ансамбль плиточных базисов
+CASE_KINDS = ("tiles", "tile_values", "regions", "smooth", "ensemble")
+
+
+class Case:
+    """Случайный синтетический случай: волна, базис (или ансамбль), коэффициенты и размер чанка."""
+
+    def __init__(self, name, wave, basis, coefs, chunk_size, members=None):
+        """
+        Параметры:
+          name - описание случая для отчёта;
+          wave - волна (H, W);
+          basis, coefs - базис (n_layers, H, W) и коэффициенты (rows, cols, n_layers);
+                         для ансамбля - объединённый базис и коэффициенты, делённые на число членов;
+          chunk_size - размер чанка (специально неудобный: 1, простые числа, больше числа строк);
+          members - для ансамбля: список пар (базис, коэффициенты) членов ансамбля.
+        """
+        self.name = name
+        self.wave = wave
+        self.basis = basis
+        self.coefs = coefs
+        self.chunk_size = chunk_size
+        self.members = members
+
+
+def _random_zone(rng, max_side):
+    # Стороны зоны кратны 12, чтобы существовали разбиения на 6-48 плиток
+    return [12 * int(rng.integers(2, max(3, max_side // 12) + 1)) for _ in range(2)]
+
+
+def _random_tiles(rng, zone_size):
+    options = []
+    for n_tiles in (6, 8, 9, 12, 16, 18, 24, 36, 48):
+        try:
+            tile_shape(zone_size[0], zone_size[1], n_tiles)
+        except ValueError:
+            continue
+        options.append(n_tiles)
+    return int(rng.choice(options))
+
+
+def _smooth_basis(rng, zone_size, n_layers):
+    height, width = zone_size
+    y, x = np.mgrid[0:height, 0:width]
+    layers = []
+    for _ in range(n_layers):
+        cy, cx = rng.uniform(0, height), rng.uniform(0, width)
+        sigma = rng.uniform(0.1, 0.4) * min(height, width)
+        layers.append(np.exp(-((y - cy) ** 2 + (x - cx) ** 2) / (2 * sigma ** 2)))
+    return np.stack(layers, axis=0)
+
+
+def random_case(rng, kind, workdir, max_side=96):
+    """
+    Строит случайный случай вида kind (см. CASE_KINDS). Область совпадает с зоной,
+    поэтому обрезка не нужна; конфигурация для генераторов пишется в workdir.
+    """
+    zone_size = _random_zone(rng, max_side)
+    config_path = os.path.join(workdir, "zones.json")
+    write_config(config_path, zone_size, zone_size)
+    wave = synthetic_wave(config_path, kind=str(rng.choice(["gaussian", "double_gaussian"])),
+                          amplitude=float(rng.uniform(0.5, 3.0)))
+    # Отрицательные значения и мелкая рябь, чтобы максимумы не совпадали с гладким центром
+    wave = wave * rng.choice([1.0, -1.0]) + 0.05 * rng.standard_normal(wave.shape)
+
+    rows, cols = int(rng.integers(3, 24)), int(rng.integers(3, 24))
+    chunk_size = int(rng.choice([1, 2, 3, 5, 7, 11, rows + 3]))
+    holes = float(rng.choice([0.0, 0.05, 0.3]))
+    noise = float(rng.uniform(0.01, 0.5))
+    seed = int(rng.integers(1 << 31))
+    description = f"{kind} zone={zone_size[0]}x{zone_size[1]} grid={rows}x{cols} chunk={chunk_size} holes={holes}"
+
+    if kind == "ensemble":
+        members = []
+        for k in range(int(rng.integers(2, 5))):
+            stack = tile_basis_stack(config_path, _random_tiles(rng, zone_size))
+            coefs, _ = synthetic_coefs(wave, stack, (rows, cols), noise=noise, holes=holes, seed=seed + k)
+            members.append((stack, coefs))
+        # Среднее реконструкций = реконструкция объединённого базиса с коэффициентами, делёнными на K
+        basis = np.concatenate([stack for stack, _ in members], axis=0)
+        coefs = np.concatenate([c for _, c in members], axis=-1) / len(members)
+        return Case(f"{description} members={len(members)}", wave, basis, coefs, chunk_size, members)
+
+    if kind == "smooth":
+        basis = _smooth_basis(rng, zone_size, int(rng.integers(4, 20)))
+    elif kind == "regions":
+        n_cells = int(rng.integers(4, 40))
+        labels = voronoi_labels(zone_size, rng.uniform((0, 0), zone_size, size=(n_cells, 2)))
+        # Одна ячейка не входит в разбиение: проверяется отклонение вне областей
+        labels[labels == labels[0, 0]] = -1
+        labels, n_regions = compact_labels(labels)
+        basis = label_basis_stack(labels, rng.uniform(0.2, 3.0, size=n_regions))
+    else:
+        basis = tile_basis_stack(config_path, _random_tiles(rng, zone_size))
+        if kind == "tile_values":
+            basis = basis * rng.uniform(0.2, 3.0, size=(basis.shape[0], 1, 1))
+    coefs, _ = synthetic_coefs(wave, basis, (rows, cols), noise=noise, holes=holes, seed=seed)
+    return Case(description, wave, basis, coefs, chunk_size)
+
+
+def reference_maps(case):
+    """Карты метрик эталонной реализации: TotalAccuracy.get_accuracy или TotalAccuracyMean для ансамбля."""
+    if case.members is not None:
+        names = [f"member_{k}" for k in range(len(case.members))]
+        calculator = TotalAccuracyMean.from_arrays(case.wave, dict(zip(names, [b for b, _ in case.members])),
+                                                   dict(zip(names, [c for _, c in case.members])))
+        return calculator.get_accuracy(chunk_size=case.chunk_size)
+    calculator = TotalAccuracy.from_arrays(case.wave, case.basis, case.coefs)
+    return calculator.get_accuracy(chunk_size=case.chunk_size, engine="reference")
+
+
+def compare_maps(reference, candidate, tolerances):
+    """
+    Сравнивает карты метрик кандидата с эталоном.
+    Возвращает {метрика: {"max_dev", "nan_mismatch", "tolerance", "ok"}}.
+    """
+    report = {}
+    for metric, values in candidate.items():
+        expected = reference[metric]
+        nan_mismatch = int(np.count_nonzero(np.isnan(expected) != np.isnan(values)))
+        finite = ~np.isnan(expected) & ~np.isnan(values)
+        max_dev = float(np.max(np.abs(expected[finite] - values[finite]))) if np.any(finite) else 0.0
+        tolerance = tolerances[metric]
+        report[metric] = {"max_dev": max_dev, "nan_mismatch": nan_mismatch, "tolerance": tolerance,
+                          "ok": nan_mismatch == 0 and max_dev <= tolerance}
+    return report
+
+
+def check_case(case, engines=None, repeat=1):
+    """
+    Запускает эталон и каждый движок на случае и сравнивает карты.
+    Неприменимые к случаю движки (например tile для неплиточного базиса) помечаются как skipped.
+
+    Возвращает список словарей {"engine", "case", "skipped", "metrics", "seconds", "reference_seconds", "speedup"}.
+    """
+    engines = list(engines or ENGINES)
+    reference_seconds, reference = _timed(lambda: reference_maps(case), repeat)
+    results = []
+    for name in engines:
+        try:
+            engine = make_engine(name, case.wave, case.basis)
+        except ValueError as error:
+            results.append({"engine": name, "case": case.name, "skipped": str(error)})
+            continue
+        metrics = tuple(m for m in METRICS if m in engine.metrics)
+        calculator = TotalAccuracy.from_arrays(case.wave, case.basis, case.coefs)
+        seconds, maps = _timed(lambda: calculator.get_accuracy(chunk_size=case.chunk_size, metrics=metrics,
+                                                               engine=engine), repeat)
+        results.append({
+            "engine": name,
+            "case": case.name,
+            "skipped": None,
+            "metrics": compare_maps(reference, maps, engine.tolerances),
+            "seconds": seconds,
+            "reference_seconds": reference_seconds,
+            "speedup": reference_seconds / seconds if seconds > 0 else float("inf"),
+        })
+    return results
+
+
+def _timed(func, repeat):
+    best, value = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, value
+
+
+def run_equivalence(n_cases=20, seed=0, engines=None, kinds=CASE_KINDS, max_side=96, repeat=1):
+    """Проверяет движки на n_cases случайных случаях. Возвращает плоский список результатов check_case."""
+    rng = np.random.default_rng(seed)
+    results = []
+    with tempfile.TemporaryDirectory(prefix="diser_equiv_") as workdir:
+        for index in range(n_cases):
+            case = random_case(rng, kinds[index % len(kinds)], workdir, max_side)
+            results.extend(check_case(case, engines, repeat))
+    return results
@@ -0,0 +1,206 @@
+import contextlib
+import io
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from src.data_generator import ShapeGenerator
+from src.grid_io import atomic_write_json
+from src.instrumentation import stage
+from src.result_store import atomic_savetxt
+from src.subduction_generator import SubductionGenerator
+
+# Формы полей: генератор, его метод и вид поля по умолчанию ("bath" - батиметрия, "wave" - волна)
+FORMS = {
+    "gradient_x": (ShapeGenerator, "bath"),
+    "gradient_y": (ShapeGenerator, "bath"),
+    "parabola": (ShapeGenerator, "bath"),
+    "parabola_sine": (ShapeGenerator, "bath"),
+    "gaussian": (SubductionGenerator, "wave"),
+    "double_gaussian": (SubductionGenerator, "wave"),
+}
+# Поддиректория корня данных и расширение файла для каждого вида поля
+KINDS = {"bath": ("bath", ".bath"), "wave": ("waves", ".wave")}
+CATALOG_NAME = "fields_catalog.json"
+
+# Генераторы процесса-исполнителя: ключ (класс, config_path)
+_GENERATORS = {}
+
+
+def expand_family(family):
+    """
+    Разворачивает описание семейства полей в список полей (name, kind, form, params).
+
+    Описание семейства:
+      form - форма из FORMS;
+      kind - "bath" или "wave" (по умолчанию - вид формы из FORMS);
+      params - {параметр: значение или список значений}; перебирается декартово произведение списков;
+      name - шаблон имени с полями-параметрами, например "gaus_double_{amplitude1}_{amplitude2}"
+             (по умолчанию форма и значения перебираемых параметров через '_').
+    """
+    form = family["form"]
+    if form not in FORMS:
+        raise ValueError(f"Неизвестная форма {form}, доступны: {', '.join(FORMS)}")
+    kind = family.get("kind", FORMS[form][1])
+    if kind not in KINDS:
+        raise ValueError(f"Неизвестный вид поля {kind}, доступны: {', '.join(KINDS)}")
+    params = family.get("params", {})
+    keys = list(params)
+    values = [value if isinstance(value, list) else [value] for value in params.values()]
+    varied = [key for key, value in zip(keys, values) if len(value) > 1]
+    template = family.get("name") or "_".join([form] + ["{%s}" % key for key in varied])
+
+    fields = []
+    for combination in itertools.product(*values):
+        field_params = dict(zip(keys, combination))
+        fields.append((template.format(**field_params), kind, form, field_params))
+    return fields
+
+
+class FieldSweepSpec:
+    """
+    Описание пакетной генерации семейств волн и батиметрий: одна команда вместо
+    отдельного запуска scripts/generate_data.py / generate_subduction.py на каждое поле.
+    """
+
+    def __init__(self, root_folder, families, config_path=os.path.join("config", "zones.json"), workers=1,
+                 binary=True):
+        """
+        Параметры:
+          root_folder - корень данных: поля пишутся в <root_folder>/bath/<name>.bath и
+                        <root_folder>/waves/<name>.wave, каталог - в <root_folder>/fields_catalog.json;
+          families - список описаний семейств (см. expand_family);
+          config_path - путь к zones.json;
+          workers - число процессов-исполнителей;
+          binary - писать двоичные сетки (src.grid_io) потоково; False - текст save_array.
+        """
+        self.root_folder = root_folder
+        self.families = list(families)
+        self.config_path = config_path
+        self.workers = workers
+        self.binary = binary
+
+    @classmethod
+    def from_file(cls, path):
+        """Загружает описание из JSON-файла с ключами, совпадающими с параметрами конструктора."""
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(**json.load(f))
+
+    def fields(self):
+        """Все поля всех семейств; повтор имени одного вида - ValueError."""
+        fields, seen = [], set()
+        for family in self.families:
+            for field in expand_family(family):
+                name, kind = field[0], field[1]
+                if (kind, name) in seen:
+                    raise ValueError(f"Имя поля {name} ({kind}) получается в описании несколько раз")
+                seen.add((kind, name))
+                fields.append(field)
+        return fields
+
+    def field_path(self, name, kind):
+        directory, extension = KINDS[kind]
+        return os.path.join(self.root_folder, directory, f"{name}{extension}")
+
+    def catalog_path(self):
+        return os.path.join(self.root_folder, CATALOG_NAME)
+
+
+def load_catalog(path):
+    """Каталог сгенерированных полей {"<kind>/<name>": запись} или пустой словарь."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _generator(cls, config_path):
+    key = (cls.__name__, os.path.abspath(config_path))
+    if key not in _GENERATORS:
+        _GENERATORS[key] = cls(config_path)
+    return _GENERATORS[key]
+
+
+def generate_field(config_path, form, params, path, binary=True):
+    """
+    Строит одно поле формы form с параметрами params и записывает его в path.
+    Возвращает запись каталога без имени: форма, параметры, путь, размер и формат.
+    """
+    cls, _ = FORMS[form]
+    generator = _generator(cls, config_path)
+    with stage("generate", form=form, path=path):
+        # double_gaussian печатает формулу поверхности - в пакетном режиме она не нужна
+        with contextlib.redirect_stdout(io.StringIO()):
+            field = getattr(generator, form)(lazy=True, **params)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if binary:
+        field.write_to(path)
+    else:
+        atomic_savetxt(path, field.to_array())
+    return {"form": form, "params": params, "path": path, "shape": list(field.shape),
+            "format": "grid" if binary else "text"}
+
+
+def _generate_batch(config_path, batch, binary):
+    return [(key, generate_field(config_path, form, params, path, binary))
+            for key, form, params, path in batch]
+
+
+def run_field_sweep(spec, workers=None, force=False, dry_run=False):
+    """
+    Генерирует все поля описания spec и обновляет каталог параметров.
+
+    Поле пропускается, если в каталоге уже есть запись с теми же формой, параметрами и
+    форматом, а файл существует (force=True - генерировать заново). Поля распределяются
+    по процессам пачками, чтобы генераторы и конфигурация создавались один раз на процесс.
+
+    Возвращает словарь {"<kind>/<name>": запись каталога} сгенерированных полей.
+    """
+    workers = workers or spec.workers
+    catalog_path = spec.catalog_path()
+    catalog = load_catalog(catalog_path)
+    fmt = "grid" if spec.binary else "text"
+
+    pending = []
+    for name, kind, form, params in spec.fields():
+        key = f"{kind}/{name}"
+        path = spec.field_path(name, kind)
+        known = catalog.get(key)
+        if (not force and known is not None and known["form"] == form and known["params"] == params
+                and known["format"] == fmt and os.path.exists(path)):
+            continue
+        pending.append((key, form, params, path))
+    print(f"Полей всего: {len(spec.fields())}, к генерации: {len(pending)}")
+    if dry_run or not pending:
+        for key, _, _, path in pending:
+            print(f"  {path}")
+        return {}
+
+    # Каталог пополняется по мере готовности пачек и сохраняется даже при ошибке в одной из них
+    generated = {}
+    try:
+        if workers <= 1:
+            _collect(spec, generated, _generate_batch(spec.config_path, pending, spec.binary))
+        else:
+            # Несколько пачек на процесс выравнивают нагрузку между полями разной стоимости
+            n_batches = min(len(pending), workers * 4)
+            batches = [pending[i::n_batches] for i in range(n_batches)]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(_generate_batch, spec.config_path, batch, spec.binary)
+                           for batch in batches]
+                for future in as_completed(futures):
+                    _collect(spec, generated, future.result())
+    finally:
+        if generated:
+            catalog.update(generated)
+            os.makedirs(spec.root_folder, exist_ok=True)
+            atomic_write_json(catalog_path, catalog, ensure_ascii=False, indent=2, sort_keys=True)
+    return generated
+
+
+def _collect(spec, generated, results):
+    for key, record in results:
+        record["path"] = os.path.relpath(record["path"], spec.root_folder)
+        generated[key] = record
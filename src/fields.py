@@ -0,0 +1,117 @@
+import os
+
+import numpy as np
+
+from src.grid_io import GridWriter
+from src.instrumentation import stage
+
+
+class SeparableField:
+    """
+    Ленивое 2D поле размера shape, заданное суммой внешних произведений одномерных профилей:
+
+        f[y, x] = sum_k scale_k * col_k[y - y0] * row_k[x - x0]   внутри зоны [y0, y0 + h) x [x0, x0 + w),
+        f[y, x] = 0                                                вне зоны.
+
+    Хранит только профили (O(H + W) памяти). Значения строятся по требованию: целиком (to_array),
+    блоками строк (rows) или сразу в файл двоичной сетки (write_to).
+    """
+
+    def __init__(self, shape, terms, offset=(0, 0)):
+        """
+        Параметры:
+          shape - размер полного поля (height, width);
+          terms - список слагаемых (scale, col, row): col длины h, row длины w;
+          offset - левый верхний угол зоны (y0, x0); по умолчанию зона совпадает с полем.
+        """
+        self.shape = tuple(int(n) for n in shape)
+        self.terms = [(scale, np.asarray(col, dtype=np.float64), np.asarray(row, dtype=np.float64))
+                      for scale, col, row in terms]
+        self.offset = tuple(int(n) for n in offset)
+        self.dtype = np.dtype(np.float64)
+        if self.terms:
+            self.zone_shape = (self.terms[0][1].size, self.terms[0][2].size)
+        else:
+            self.zone_shape = (0, 0)
+        for _, col, row in self.terms:
+            if (col.size, row.size) != self.zone_shape:
+                raise ValueError("Профили всех слагаемых должны иметь одинаковые длины")
+        y0, x0 = self.offset
+        if y0 < 0 or x0 < 0 or y0 + self.zone_shape[0] > self.shape[0] or x0 + self.zone_shape[1] > self.shape[1]:
+            raise ValueError("Зона поля выходит за его границы")
+
+    @property
+    def zone(self):
+        """Зона ненулевых значений [y_min, y_max, x_min, x_max]."""
+        y0, x0 = self.offset
+        return [y0, y0 + self.zone_shape[0], x0, x0 + self.zone_shape[1]]
+
+    def _zone_rows(self, start, end):
+        """Значения строк [start, end) зоны (в координатах зоны), shape (end - start, w)."""
+        block = None
+        for scale, col, row in self.terms:
+            term = np.multiply.outer(col[start:end], row)
+            if scale != 1.0:
+                term *= scale
+            if block is None:
+                block = term
+            else:
+                block += term
+        return block
+
+    def rows(self, start, end):
+        """Строки [start, end) полного поля, shape (end - start, width)."""
+        start, end = max(start, 0), min(end, self.shape[0])
+        block = np.zeros((max(end - start, 0), self.shape[1]))
+        y_min, y_max, x_min, x_max = self.zone
+        lo, hi = max(start, y_min), min(end, y_max)
+        if self.terms and lo < hi:
+            block[lo - start:hi - start, x_min:x_max] = self._zone_rows(lo - y_min, hi - y_min)
+        return block
+
+    def to_array(self, rows_per_block=256):
+        """
+        Полное поле одним массивом. Зона заполняется блоками строк, поэтому временные массивы
+        ограничены rows_per_block строками, а не размером поля.
+        """
+        result = np.zeros(self.shape)
+        y_min, y_max, x_min, x_max = self.zone
+        for start in range(0, y_max - y_min, rows_per_block):
+            end = min(start + rows_per_block, y_max - y_min)
+            result[y_min + start:y_min + end, x_min:x_max] = self._zone_rows(start, end)
+        return result
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.to_array()
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    def view(self):
+        """
+        Представление без копирования (np.broadcast_to, только чтение) для полей, зависящих
+        от одной координаты и занимающих всё поле. Для остальных - ValueError.
+        """
+        if len(self.terms) != 1 or self.zone_shape != self.shape:
+            raise ValueError("Представление без копирования есть только у однослагаемого поля на всей области")
+        scale, col, row = self.terms[0]
+        if np.all(row == row[0]):
+            return np.broadcast_to((scale * row[0]) * col[:, None], self.shape)
+        if np.all(col == col[0]):
+            return np.broadcast_to((scale * col[0]) * row[None, :], self.shape)
+        raise ValueError("Поле зависит от обеих координат - представление без копирования невозможно")
+
+    def write_to(self, path, rows_per_block=256, full=False):
+        """
+        Потоково записывает поле в файл двоичной сетки (src.grid_io) блоками строк,
+        не создавая полный массив в памяти. По умолчанию сетка разреженная по зоне: хранятся
+        только значения зоны и её положение; full=True - записать полное поле с нулями. Возвращает path.
+        """
+        if full:
+            shape, offset, rows = self.shape, (0, 0), self.rows
+        else:
+            shape, offset, rows = self.zone_shape, self.offset, self._zone_rows
+        with stage("save", path=path, binary=True) as st:
+            with GridWriter(path, shape, full_shape=self.shape, offset=offset) as writer:
+                for start in range(0, shape[0], rows_per_block):
+                    writer.write_rows(rows(start, min(start + rows_per_block, shape[0])))
+            st.add(pixels=self.shape[0] * self.shape[1], bytes=os.path.getsize(path))
+        return path
@@ -0,0 +1,419 @@
+import bz2
+import json
+import lzma
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from src.instrumentation import stage
+
+# Двоичный формат сетки (файлы можно называть как прежде, например <name>.wave):
+#   8 байт  - сигнатура MAGIC;
+#   4 байта - длина заголовка (uint32, little-endian);
+#   заголовок - JSON {"shape": [h, w], "dtype": "<f8"}, дополненный пробелами до кратности DATA_ALIGN;
+#   данные - значения построчно (C-порядок), читаются через memmap без разбора текста.
+# Разреженная по зоне сетка (поле, равное нулю вне прямоугольной зоны) хранит только значения зоны:
+# в заголовке дополнительно "full_shape": [H, W] - размер полного поля и "offset": [y0, x0] - угол зоны,
+# а "shape" - размер зоны. Вне зоны поле считается нулевым.
+MAGIC = b"DISGRID1"
+DATA_ALIGN = 64
+_LENGTH = struct.Struct("<I")
+# Двоичный формат карты результатов из блоков (write_result):
+#   8 байт  - сигнатура RESULT_MAGIC;
+#   4 байта - длина заголовка (uint32, little-endian);
+#   заголовок - JSON {"shape", "dtype", "chunks": [высота, ширина блока], "compression", "level", "shuffle",
+#               "offsets" и "sizes" блоков относительно начала данных (блоки построчно), "meta"};
+#   данные - блоки карты, каждый сжат отдельно, поэтому прямоугольник читается без распаковки всей карты.
+RESULT_MAGIC = b"DISCHNK1"
+# Расширение карт write_result (<metric>.res); прежние деревья хранили карты текстом в <metric>.txt
+RESULT_SUFFIX = ".res"
+LEGACY_SUFFIX = ".txt"
+# Суффикс текстовых копий export_text
+EXPORT_SUFFIX = ".export.txt"
+# Сжатие блоков без потерь: имя -> (сжатие(data, level), распаковка)
+COMPRESSORS = {
+    "zlib": (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    "bz2": (lambda data, level: bz2.compress(data, level), bz2.decompress),
+    "lzma": (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+
+
+def is_grid_file(path):
+    """True, если файл записан в двоичном формате сетки (а не текстом save_array)."""
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def is_result_file(path):
+    """True, если файл записан в двоичном формате карты результатов из блоков (write_result)."""
+    with open(path, "rb") as f:
+        return f.read(len(RESULT_MAGIC)) == RESULT_MAGIC
+
+
+def existing_result_path(path):
+    """
+    Путь карты для чтения: сам path, а если карты <name>.res нет - прежняя текстовая <name>.txt
+    рядом (деревья результатов, записанные до формата write_result). Иначе path без изменений.
+    """
+    if not os.path.exists(path) and path.endswith(RESULT_SUFFIX):
+        legacy = path[:-len(RESULT_SUFFIX)] + LEGACY_SUFFIX
+        if os.path.exists(legacy):
+            return legacy
+    return path
+
+
+def drop_legacy_result(path):
+    """Удаляет прежнюю текстовую карту <name>.txt, заменённую записанной картой <name>.res."""
+    if path.endswith(RESULT_SUFFIX):
+        legacy = path[:-len(RESULT_SUFFIX)] + LEGACY_SUFFIX
+        if os.path.exists(legacy):
+            os.remove(legacy)
+
+
+def _encode_header(header, magic=MAGIC):
+    raw = json.dumps(header).encode("utf-8")
+    prefix = len(magic) + _LENGTH.size
+    padded = -(-(prefix + len(raw) + 1) // DATA_ALIGN) * DATA_ALIGN - prefix
+    raw = raw + b" " * (padded - len(raw) - 1) + b"\n"
+    return magic + _LENGTH.pack(len(raw)) + raw
+
+
+def read_header(path, magic=MAGIC):
+    """Заголовок двоичной сетки (или карты результатов, magic=RESULT_MAGIC) и смещение начала данных."""
+    with open(path, "rb") as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError(f"Файл {path} не является двоичной сеткой {magic.decode('ascii')}")
+        (length,) = _LENGTH.unpack(f.read(_LENGTH.size))
+        header = json.loads(f.read(length).decode("utf-8"))
+    return header, len(magic) + _LENGTH.size + length
+
+
+class GridWriter:
+    """
+    Потоковая запись сетки (H, W) блоками строк сверху вниз, без массива целиком в памяти.
+    Файл пишется во временный и переименовывается при успешном закрытии.
+
+        with GridWriter(path, (H, W)) as writer:
+            for block in blocks:
+                writer.write_rows(block)
+    """
+
+    def __init__(self, path, shape, dtype=np.float64, full_shape=None, offset=(0, 0)):
+        """
+        shape - размер записываемых значений; full_shape и offset задаются для разреженной
+        по зоне сетки: тогда shape - размер зоны, а offset - её левый верхний угол в полном поле.
+        """
+        self.path = path
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        self.full_shape = self.shape if full_shape is None else tuple(int(n) for n in full_shape)
+        self.offset = tuple(int(n) for n in offset)
+        y0, x0 = self.offset
+        if y0 < 0 or x0 < 0 or y0 + self.shape[0] > self.full_shape[0] or x0 + self.shape[1] > self.full_shape[1]:
+            raise ValueError("Зона сетки выходит за границы полного поля")
+        self.rows_written = 0
+        self._tmp_path = f"{path}.{os.getpid()}.tmp"
+        self._file = None
+
+    def __enter__(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self._tmp_path, "wb")
+        header = {"shape": list(self.shape), "dtype": self.dtype.str}
+        if self.full_shape != self.shape:
+            header.update(full_shape=list(self.full_shape), offset=list(self.offset))
+        self._file.write(_encode_header(header))
+        return self
+
+    def write_rows(self, block):
+        """Дописывает блок строк shape (n, W)."""
+        block = np.asarray(block, dtype=self.dtype)
+        if block.ndim != 2 or block.shape[1] != self.shape[1]:
+            raise ValueError(f"Ожидался блок строк ширины {self.shape[1]}, получено {block.shape}")
+        if self.rows_written + block.shape[0] > self.shape[0]:
+            raise ValueError("Записано больше строк, чем объявлено в заголовке")
+        self._file.write(np.ascontiguousarray(block).tobytes())
+        self.rows_written += block.shape[0]
+
+    def __exit__(self, exc_type, exc, tb):
+        self._file.close()
+        if exc_type is None and self.rows_written != self.shape[0]:
+            os.remove(self._tmp_path)
+            raise ValueError(f"Записано {self.rows_written} строк из {self.shape[0]}")
+        if exc_type is not None:
+            os.remove(self._tmp_path)
+            return False
+        os.replace(self._tmp_path, self.path)
+        return False
+
+
+def nonzero_zone(data):
+    """
+    Наименьший прямоугольник [y_min, y_max, x_min, x_max], вне которого data равно нулю.
+    Для нулевого массива - пустая зона [0, 0, 0, 0].
+    """
+    data = np.asarray(data)
+    rows = np.flatnonzero(np.any(data != 0, axis=1))
+    if rows.size == 0:
+        return [0, 0, 0, 0]
+    cols = np.flatnonzero(np.any(data[rows[0]:rows[-1] + 1] != 0, axis=0))
+    return [int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1]
+
+
+def write_grid(path, data, rows_per_block=256, zone=None):
+    """
+    Сохраняет 2D массив в двоичном формате сетки (атомарно), сохраняя его тип данных.
+
+    zone - [y_min, y_max, x_min, x_max]: записать разреженную по зоне сетку, только значения зоны
+           (значения data вне зоны должны быть нулевыми); "auto" - зона ненулевых значений (nonzero_zone).
+    """
+    data = np.asarray(data)
+    full_shape, offset = data.shape, (0, 0)
+    if zone is not None:
+        if isinstance(zone, str) and zone == "auto":
+            zone = nonzero_zone(data)
+        y_min, y_max, x_min, x_max = zone
+        data, offset = data[y_min:y_max, x_min:x_max], (y_min, x_min)
+    with stage("save", path=path, binary=True) as st:
+        with GridWriter(path, data.shape, dtype=data.dtype, full_shape=full_shape, offset=offset) as writer:
+            for start in range(0, data.shape[0], rows_per_block):
+                writer.write_rows(data[start:start + rows_per_block])
+        st.add(pixels=data.size, bytes=os.path.getsize(path))
+
+
+def open_grid(path):
+    """
+    Открывает двоичную сетку как memmap (только чтение) без чтения данных.
+    Для разреженной по зоне сетки это значения зоны; её положение - в grid_layout.
+    """
+    header, offset = read_header(path)
+    return np.memmap(path, dtype=np.dtype(header["dtype"]), mode="r", offset=offset,
+                     shape=tuple(header["shape"]))
+
+
+def grid_layout(path):
+    """
+    Размер полного поля и зона хранимых значений двоичной сетки: (full_shape, [y_min, y_max, x_min, x_max]).
+    Для обычной сетки зона совпадает со всем полем.
+    """
+    header, _ = read_header(path)
+    shape = tuple(header["shape"])
+    if len(shape) != 2:
+        raise ValueError(f"Файл {path} - куб кадров {list(shape)}, а не сетка; он читается read_frames")
+    full_shape = tuple(header.get("full_shape", shape))
+    y0, x0 = header.get("offset", (0, 0))
+    return full_shape, [y0, y0 + shape[0], x0, x0 + shape[1]]
+
+
+def read_field(path, zone=None):
+    """
+    Загружает 2D поле из файла в любом из форматов: двоичная сетка (в том числе разреженная
+    по зоне), карта результатов из блоков (write_result) или текст save_array. Возвращает обычный
+    массив (копию), файл не остаётся открытым.
+
+    Если задана зона [y_min, y_max, x_min, x_max], возвращается только она; для двоичной сетки
+    с диска читаются только строки зоны. Без zone разреженная сетка разворачивается в полное поле -
+    это единственный случай, когда нули вне зоны создаются в памяти.
+    Для отсутствующей карты <name>.res читается прежняя <name>.txt (existing_result_path).
+    """
+    path = existing_result_path(path)
+    if is_result_file(path):
+        return read_result(path, zone)
+    if is_grid_file(path):
+        full_shape, stored = grid_layout(path)
+        if zone is None:
+            zone = [0, full_shape[0], 0, full_shape[1]]
+        y_min, y_max, x_min, x_max = zone
+        grid = open_grid(path)
+        if stored[0] <= y_min and y_max <= stored[1] and stored[2] <= x_min and x_max <= stored[3]:
+            # Зона внутри хранимых значений: обрезка - срез memmap без лишних нулей
+            data = np.array(grid[y_min - stored[0]:y_max - stored[0], x_min - stored[2]:x_max - stored[2]],
+                            dtype=np.float64)
+        else:
+            data = np.zeros((y_max - y_min, x_max - x_min))
+            lo_y, hi_y = max(y_min, stored[0]), min(y_max, stored[1])
+            lo_x, hi_x = max(x_min, stored[2]), min(x_max, stored[3])
+            if lo_y < hi_y and lo_x < hi_x:
+                data[lo_y - y_min:hi_y - y_min, lo_x - x_min:hi_x - x_min] = \
+                    grid[lo_y - stored[0]:hi_y - stored[0], lo_x - stored[2]:hi_x - stored[2]]
+        del grid
+        return data
+    data = np.loadtxt(path)
+    if zone is not None:
+        y_min, y_max, x_min, x_max = zone
+        data = data[y_min:y_max, x_min:x_max]
+    return data
+
+
+def write_frames(path, frames, names=None):
+    """
+    Сохраняет кадры волны (T, H, W) одним файлом в двоичном формате сетки (атомарно):
+    в заголовке "shape": [T, H, W] и необязательные имена кадров "frames", данные - кадры подряд.
+    """
+    frames = np.asarray(frames)
+    if frames.ndim != 3:
+        raise ValueError(f"Ожидались кадры shape (T, H, W), получено {frames.shape}")
+    dtype = frames.dtype.newbyteorder("<")
+    header = {"shape": list(frames.shape), "dtype": dtype.str}
+    if names is not None:
+        if len(names) != frames.shape[0]:
+            raise ValueError(f"Имён кадров {len(names)}, а кадров {frames.shape[0]}")
+        header["frames"] = list(names)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with stage("save", path=path, binary=True, frames=frames.shape[0]) as st:
+        with open(tmp_path, "wb") as f:
+            f.write(_encode_header(header))
+            for frame in frames:
+                f.write(np.ascontiguousarray(frame, dtype=dtype).tobytes())
+        os.replace(tmp_path, path)
+        st.add(pixels=frames.size, bytes=os.path.getsize(path))
+
+
+def read_frames(path, zone=None):
+    """
+    Загружает кадры из файла write_frames, обрезанные до зоны [y_min, y_max, x_min, x_max]
+    (с диска читаются только строки зоны каждого кадра).
+    Возвращает (массив float64 (T, h, w), имена кадров из заголовка или None).
+    """
+    header, offset = read_header(path)
+    if len(header["shape"]) != 3:
+        raise ValueError(f"Файл {path} - сетка {header['shape']}, а не куб кадров")
+    cube = np.memmap(path, dtype=np.dtype(header["dtype"]), mode="r", offset=offset, shape=tuple(header["shape"]))
+    if zone is not None:
+        y_min, y_max, x_min, x_max = zone
+        cube = cube[:, y_min:y_max, x_min:x_max]
+    data = np.array(cube, dtype=np.float64)
+    del cube
+    return data, header.get("frames")
+
+
+def _chunk_grid(shape, chunks):
+    """Границы блоков по строкам и столбцам для карты shape и размера блока chunks."""
+    return ([(y, min(y + chunks[0], shape[0])) for y in range(0, shape[0], chunks[0])],
+            [(x, min(x + chunks[1], shape[1])) for x in range(0, shape[1], chunks[1])])
+
+
+def write_result(path, data, chunks=(64, 64), compression=None, level=1, shuffle=True, meta=None):
+    """
+    Сохраняет 2D карту результатов в двоичном формате из блоков (атомарно: временный файл и rename),
+    без потери точности и в исходном типе данных.
+
+    Параметры:
+      chunks - размер блока (строки, столбцы); блок - единица сжатия и чтения прямоугольника;
+      compression - сжатие блоков без потерь из COMPRESSORS или None (по умолчанию: несжатая запись
+                    быстрее текста на порядок, а шумные карты метрик сжимаются слабо);
+      level - уровень сжатия (1 - быстрый: запись карт не должна занимать заметную часть расчёта);
+      shuffle - перед сжатием переставить байты значений (сначала все первые байты, затем вторые, ...):
+                у соседних значений совпадают старшие байты, и сжатие заметно лучше;
+      meta - JSON-совместимые сведения о расчёте (входные данные, движок, время), хранятся в заголовке.
+    """
+    data = np.asarray(data)
+    if data.ndim != 2:
+        raise ValueError(f"Ожидалась 2D карта, получено {data.shape}")
+    if compression is not None and compression not in COMPRESSORS:
+        raise ValueError(f"Неизвестное сжатие {compression}, доступны: {', '.join(COMPRESSORS)}")
+    dtype = data.dtype.newbyteorder("<")
+    chunks = (max(1, min(chunks[0], data.shape[0] or 1)), max(1, min(chunks[1], data.shape[1] or 1)))
+    with stage("save", path=path, binary=True, compression=compression) as st:
+        payloads = []
+        row_bounds, col_bounds = _chunk_grid(data.shape, chunks)
+        for y0, y1 in row_bounds:
+            for x0, x1 in col_bounds:
+                raw = np.ascontiguousarray(data[y0:y1, x0:x1], dtype=dtype).tobytes()
+                if compression is not None:
+                    if shuffle and dtype.itemsize > 1:
+                        raw = np.frombuffer(raw, dtype=np.uint8).reshape(-1, dtype.itemsize).T.tobytes()
+                    raw = COMPRESSORS[compression][0](raw, level)
+                payloads.append(raw)
+        sizes = [len(payload) for payload in payloads]
+        header = {"shape": list(data.shape), "dtype": dtype.str, "chunks": list(chunks),
+                  "compression": compression, "level": level, "shuffle": bool(shuffle and compression),
+                  "offsets": [int(v) for v in np.concatenate([[0], np.cumsum(sizes)[:-1]])] if sizes else [],
+                  "sizes": sizes, "meta": meta or {}}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(_encode_header(header, RESULT_MAGIC))
+                for payload in payloads:
+                    f.write(payload)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        st.add(pixels=data.size, bytes=os.path.getsize(path))
+    return path
+
+
+def result_header(path):
+    """Заголовок карты результатов: размер, блоки, сжатие и сведения о расчёте (ключ "meta")."""
+    return read_header(path, RESULT_MAGIC)[0]
+
+
+def read_result(path, zone=None):
+    """
+    Загружает карту результатов (write_result) или её прямоугольник zone = [y_min, y_max, x_min, x_max]:
+    читаются и распаковываются только блоки, пересекающие zone. Части zone за пределами карты - нули.
+    """
+    header, data_offset = read_header(path, RESULT_MAGIC)
+    shape, chunks = tuple(header["shape"]), tuple(header["chunks"])
+    dtype = np.dtype(header["dtype"])
+    if zone is None:
+        zone = [0, shape[0], 0, shape[1]]
+    y_min, y_max, x_min, x_max = zone
+    out = np.zeros((y_max - y_min, x_max - x_min), dtype=np.float64)
+    row_bounds, col_bounds = _chunk_grid(shape, chunks)
+    decompress = COMPRESSORS[header["compression"]][1] if header["compression"] is not None else None
+    with open(path, "rb") as f:
+        for i, (y0, y1) in enumerate(row_bounds):
+            lo_y, hi_y = max(y0, y_min), min(y1, y_max)
+            if lo_y >= hi_y:
+                continue
+            for j, (x0, x1) in enumerate(col_bounds):
+                lo_x, hi_x = max(x0, x_min), min(x1, x_max)
+                if lo_x >= hi_x:
+                    continue
+                k = i * len(col_bounds) + j
+                f.seek(data_offset + header["offsets"][k])
+                raw = f.read(header["sizes"][k])
+                if decompress is not None:
+                    raw = decompress(raw)
+                    if header["shuffle"] and dtype.itemsize > 1:
+                        raw = np.frombuffer(raw, dtype=np.uint8).reshape(dtype.itemsize, -1).T.tobytes()
+                block = np.frombuffer(raw, dtype=dtype).reshape(y1 - y0, x1 - x0)
+                out[lo_y - y_min:hi_y - y_min, lo_x - x_min:hi_x - x_min] = \
+                    block[lo_y - y0:hi_y - y0, lo_x - x0:hi_x - x0]
+    return out
+
+
+def export_text(path, text_path=None):
+    """
+    Текстовая копия карты из любого формата read_field (%.6f, как save_array) для просмотра вручную.
+    По умолчанию пишется рядом: <path>.export.txt. Возвращает путь текстового файла.
+    """
+    text_path = text_path or path + EXPORT_SUFFIX
+    np.savetxt(text_path, read_field(path), fmt='%.6f')
+    return text_path
+
+
+def atomic_write_json(path, data, per_process=False, **options):
+    """
+    Атомарно записывает data в JSON-файл path: во временный файл рядом и os.replace, так что
+    читатель видит прежний или новый файл целиком. per_process=True - имя временного файла с pid
+    (файл пишут несколько процессов). options передаются json.dump (indent, sort_keys, ...).
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp" if per_process else path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, **options)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,154 @@
+import json
+import os
+import threading
+import time
+
+from src.memory import read_peak_rss, reset_peak_rss
+
+# Переменная окружения, включающая запись трассы во всех процессах (в том числе в исполнителях пула)
+TRACE_ENV = "DISER_TRACE"
+
+_sink = None
+_sink_lock = threading.Lock()
+# Стек вложенных этапов - свой у каждого потока (фоновая загрузка и запись идут в своих потоках).
+# Пиковый RSS (VmHWM) общий для процесса и сбрасывается на границах этапов, поэтому его измеряют
+# только этапы главного потока; этапы других потоков пишутся с peak_rss = None и именем потока,
+# а пик RSS не сбрасывают, чтобы не занижать его у идущего в это время этапа главного потока.
+_local = threading.local()
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def enable(path):
+    """
+    Включает запись событий в файл path в формате JSON lines (дописывание в конец).
+    Несколько процессов могут писать в один файл: каждое событие - одна строка одним вызовом write.
+    """
+    global _sink
+    disable()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    _sink = open(path, "a", encoding="utf-8", buffering=1)
+
+
+def disable():
+    """Выключает запись событий."""
+    global _sink
+    if _sink is not None:
+        _sink.close()
+    _sink = None
+
+
+def enabled():
+    return _sink is not None
+
+
+def _emit(record):
+    record["pid"] = os.getpid()
+    record["time"] = time.time()
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with _sink_lock:
+        _sink.write(line)
+
+
+class _NullStage:
+    """Этап-заглушка, когда инструментирование выключено: ничего не измеряет и не пишет."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def add(self, **counters):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.counters = {}
+        self.peak_rss = 0
+
+    def add(self, **counters):
+        """Увеличивает счётчики этапа (например points, pixels, bytes)."""
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def __enter__(self):
+        stack = _stack()
+        self.main_thread = threading.current_thread() is threading.main_thread()
+        if not self.main_thread:
+            stack.append(self)
+            self.start = time.perf_counter()
+            return self
+        if stack:
+            # Пик родительского этапа до начала вложенного
+            stack[-1].peak_rss = max(stack[-1].peak_rss, read_peak_rss() or 0)
+        reset_peak_rss()
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        stack = _stack()
+        stack.pop()
+        if self.main_thread:
+            self.peak_rss = max(self.peak_rss, read_peak_rss() or 0)
+            if stack:
+                stack[-1].peak_rss = max(stack[-1].peak_rss, self.peak_rss)
+            reset_peak_rss()
+        else:
+            self.peak_rss = None
+
+        record = {"type": "stage", "stage": self.name, "seconds": seconds, "peak_rss": self.peak_rss}
+        if not self.main_thread:
+            record["thread"] = threading.current_thread().name
+        record.update(self.fields)
+        if self.counters:
+            record["counters"] = self.counters
+            if seconds > 0:
+                record["rates"] = {f"{key}_per_s": value / seconds for key, value in self.counters.items()}
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        if _sink is not None:
+            _emit(record)
+        return False
+
+
+def stage(name, **fields):
+    """
+    Контекстный менеджер для замера этапа: время, пиковый RSS и счётчики.
+
+        with stage("wave_load", path=path) as st:
+            data = ...
+            st.add(bytes=size)
+
+    Если инструментирование выключено, возвращается общий объект-заглушка без накладных расходов.
+    """
+    if _sink is None:
+        return _NULL_STAGE
+    return _Stage(name, fields)
+
+
+def count(name, value, **fields):
+    """Записывает отдельное значение счётчика вне этапа."""
+    if _sink is None:
+        return
+    record = {"type": "counter", "counter": name, "value": value}
+    record.update(fields)
+    _emit(record)
+
+
+if os.environ.get(TRACE_ENV):
+    enable(os.environ[TRACE_ENV])
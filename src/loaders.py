@@ -0,0 +1,173 @@
+import json
+import os
+import re
+
+import numpy as np
+
+from src.basis_generator import LABELS_GRID, TILES_MANIFEST
+from src.grid_io import open_grid, read_field, read_frames, read_header
+from src.instrumentation import stage
+from src.sparse_basis import SPARSE_BASIS_NAME, SparseBasis
+
+DEFAULT_CONFIG_PATH = os.path.join("..", "config", "zones.json")
+BASIS_REGEX = r".*?(\d+)\.wave"
+# Файлы директории базиса помимо функций, от которых зависит загруженный базис (load_basis),
+# в порядке имён: так они входят в ключи кеша и хеши входов
+BASIS_EXTRA_FILES = (SPARSE_BASIS_NAME, LABELS_GRID, TILES_MANIFEST)
+
+
+def load_config(config_path=DEFAULT_CONFIG_PATH):
+    """Загружает конфигурацию из файла zones.json."""
+    with open(config_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def list_basis_files(basis_directory, regex_pattern=BASIS_REGEX):
+    """
+    Возвращает пути к файлам базисных функций в директории basis_directory,
+    упорядоченные по числовому индексу, извлекаемому регулярным выражением.
+    """
+    basis_files = {}
+    for filename in os.listdir(basis_directory):
+        match = re.search(regex_pattern, filename)
+        if match:
+            basis_files[int(match.group(1))] = os.path.join(basis_directory, filename)
+    return [basis_files[index] for index in sorted(basis_files)]
+
+
+def crop(data, zone):
+    """Обрезает 2D массив до области zone = [y_min, y_max, x_min, x_max]."""
+    y_min, y_max, x_min, x_max = zone
+    return data[y_min:y_max, x_min:x_max]
+
+
+def named_zones(config, names):
+    """
+    Координаты именованных зон конфигурации zones.json: {имя: [y_min, y_max, x_min, x_max]}.
+    Неизвестное имя или пустая зона - ValueError.
+    """
+    zones = {}
+    for name in names:
+        if name not in config:
+            known = [key for key, value in config.items() if key != "size" and isinstance(value, list)]
+            raise ValueError(f"В конфигурации нет зоны {name}; есть: {', '.join(known)}")
+        y_min, y_max, x_min, x_max = (int(v) for v in config[name])
+        if y_min >= y_max or x_min >= x_max:
+            raise ValueError(f"Пустая зона {name}: {config[name]}")
+        zones[name] = [y_min, y_max, x_min, x_max]
+    return zones
+
+
+def bounding_zone(zones):
+    """Наименьший прямоугольник [y_min, y_max, x_min, x_max], содержащий все зоны."""
+    zones = list(zones)
+    return [min(z[0] for z in zones), max(z[1] for z in zones), min(z[2] for z in zones), max(z[3] for z in zones)]
+
+
+def load_wave(wave_path, zone):
+    """
+    Загружает волну из файла (текст save_array или двоичная сетка src.grid_io)
+    и обрезает её до области zone.
+    """
+    with stage("wave_load", path=wave_path) as st:
+        wave = read_field(wave_path, zone)
+        st.add(bytes=os.path.getsize(wave_path), pixels=wave.size)
+    return wave
+
+
+def frame_names(wave_path, regex_pattern=BASIS_REGEX):
+    """
+    Имена кадров временного ряда волны: для директории кадров - имена файлов без расширения
+    по возрастанию номера (regex_pattern, как у базиса), для файла куба кадров (src.grid_io.write_frames) -
+    имена из заголовка или <имя файла>_<номер кадра>.
+    """
+    if os.path.isdir(wave_path):
+        return [os.path.splitext(os.path.basename(path))[0] for path in list_basis_files(wave_path, regex_pattern)]
+    header, _ = read_header(wave_path)
+    if header.get("frames") is not None:
+        return list(header["frames"])
+    stem = os.path.splitext(os.path.basename(wave_path))[0]
+    return [f"{stem}_{t}" for t in range(header["shape"][0])]
+
+
+def load_wave_frames(wave_path, zone, regex_pattern=BASIS_REGEX):
+    """
+    Загружает кадры временного ряда волны, обрезанные до области zone, как массив (T, H, W):
+    из директории кадров (файл на кадр в любом формате read_field, порядок - по номеру в имени)
+    или из одного файла куба кадров (src.grid_io.write_frames).
+    """
+    with stage("wave_load", path=wave_path, frames=True) as st:
+        if os.path.isdir(wave_path):
+            paths = list_basis_files(wave_path, regex_pattern)
+            if not paths:
+                raise ValueError(f"В директории {wave_path} нет кадров волны")
+            frames = np.stack([read_field(path, zone) for path in paths], axis=0)
+            st.add(bytes=sum(os.path.getsize(path) for path in paths), pixels=frames.size)
+        else:
+            frames, _ = read_frames(wave_path, zone)
+            st.add(bytes=os.path.getsize(wave_path), pixels=frames.size)
+    return frames
+
+
+def load_basis_stack(basis_directory, zone, regex_pattern=BASIS_REGEX):
+    """
+    Загружает базисные функции из директории (текст или двоичные сетки), обрезает каждую
+    до области zone и возвращает массив формы (n_layers, H, W).
+    """
+    with stage("basis_load", path=basis_directory) as st:
+        paths = list_basis_files(basis_directory, regex_pattern)
+        loaded_bases = [read_field(path, zone) for path in paths]
+        st.add(bytes=sum(os.path.getsize(path) for path in paths), layers=len(paths))
+        return np.stack(loaded_bases, axis=0)
+
+
+def load_basis(basis_directory, zone, regex_pattern=BASIS_REGEX):
+    """
+    Загружает базис директории: разреженный (файл basis.csr.npz, см. src.sparse_basis) - как SparseBasis,
+    обрезанный до zone, иначе - плотный массив load_basis_stack. Директория разбиения без файлов
+    базисных функций (только tiles.json и labels.grid, см. src.tiling_set) - через load_label_basis.
+    """
+    sparse_path = os.path.join(basis_directory, SPARSE_BASIS_NAME)
+    if not os.path.exists(sparse_path):
+        if not list_basis_files(basis_directory, regex_pattern) and \
+                os.path.exists(os.path.join(basis_directory, LABELS_GRID)):
+            return load_label_basis(basis_directory, zone)
+        return load_basis_stack(basis_directory, zone, regex_pattern)
+    with stage("basis_load", path=basis_directory, sparse=True) as st:
+        basis = SparseBasis.load(sparse_path).crop(zone)
+        st.add(bytes=os.path.getsize(sparse_path), layers=basis.n_layers)
+        return basis
+
+
+def load_label_map_in_zone(basis_directory, zone):
+    """
+    Карта меток разбиения (labels.grid), перенесённая в область zone полного поля:
+    shape зоны, -1 вне плиток. Возвращает (labels, n_tiles).
+    """
+    with open(os.path.join(basis_directory, TILES_MANIFEST), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    grid = open_grid(os.path.join(basis_directory, LABELS_GRID))
+    tiles_y_min, _, tiles_x_min, _ = manifest["subduction_zone"]
+    y_min, y_max, x_min, x_max = zone
+    labels = np.full((y_max - y_min, x_max - x_min), -1, dtype=np.int32)
+    lo_y, hi_y = max(y_min, tiles_y_min), min(y_max, tiles_y_min + grid.shape[0])
+    lo_x, hi_x = max(x_min, tiles_x_min), min(x_max, tiles_x_min + grid.shape[1])
+    if lo_y < hi_y and lo_x < hi_x:
+        labels[lo_y - y_min:hi_y - y_min, lo_x - x_min:hi_x - x_min] = \
+            grid[lo_y - tiles_y_min:hi_y - tiles_y_min, lo_x - tiles_x_min:hi_x - tiles_x_min]
+    del grid
+    return labels, manifest["n_tiles"]
+
+
+def load_label_basis(basis_directory, zone, value=1.0):
+    """
+    Плотный базис (n_tiles, H, W) из карты меток разбиения: функция k равна value на плитке k.
+    Плитки, не попавшие в zone, дают нулевые слои, так что номера слоёв совпадают с номерами плиток.
+    """
+    with stage("basis_load", path=basis_directory, labels=True) as st:
+        labels, n_tiles = load_label_map_in_zone(basis_directory, zone)
+        stack = np.zeros((n_tiles,) + labels.shape)
+        ys, xs = np.nonzero(labels >= 0)
+        stack[labels[ys, xs], ys, xs] = value
+        st.add(bytes=os.path.getsize(os.path.join(basis_directory, LABELS_GRID)), layers=n_tiles)
+        return stack
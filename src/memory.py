@@ -0,0 +1,207 @@
+import os
+import re
+import threading
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_SIZE_RE = re.compile(r"^\s*([0-9.]+)\s*([kmgt]?)i?b?\s*$", re.IGNORECASE)
+_SIZE_UNITS = {"": 1, "k": 2 ** 10, "m": 2 ** 20, "g": 2 ** 30, "t": 2 ** 40}
+
+
+def parse_size(text):
+    """Размер памяти из строки: '8G', '512M', '1.5GiB' или число байт. None остаётся None."""
+    if text is None or isinstance(text, (int, float)):
+        return None if text is None else int(text)
+    match = _SIZE_RE.match(text)
+    if not match:
+        raise ValueError(f"Не удалось разобрать размер памяти: {text}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).lower()])
+
+
+def format_size(size):
+    """Размер в байтах в виде '1.23 ГБ' для сообщений."""
+    if size is None:
+        return "?"
+    for unit, name in ((2 ** 30, "ГБ"), (2 ** 20, "МБ"), (2 ** 10, "КБ")):
+        if abs(size) >= unit:
+            return f"{size / unit:.2f} {name}"
+    return f"{size} Б"
+
+
+def current_rss():
+    """Текущий RSS процесса в байтах (Linux: /proc/self/statm) или None, если недоступен."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def read_peak_rss():
+    """
+    Пиковый RSS процесса в байтах. На Linux берётся VmHWM из /proc/self/status
+    (его можно сбросить, см. reset_peak_rss), иначе - ru_maxrss за всё время процесса.
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+def reset_peak_rss():
+    """Сбрасывает VmHWM до текущего RSS (Linux >= 4.0), чтобы измерять пик отдельного этапа."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def available_memory():
+    """Доступная память узла (MemAvailable) в байтах или None."""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def chunk_bytes(chunk_rows, cols, n_layers, height, width, pixel_arrays, layer_arrays=0, n_bases=1,
+                concurrency=1, itemsize=8):
+    """
+    Оценка временной памяти на обработку chunk_rows строк коэффициентной сетки.
+
+    Параметры:
+      pixel_arrays - число одновременно живых массивов (chunk, cols, H, W) в единицах float64;
+      layer_arrays - число временных массивов (chunk, cols, n_layers) сверх самих коэффициентов;
+      n_bases - число базисов ансамбля (коэффициенты каждого копируются в чанк);
+      concurrency - число одновременно обрабатываемых чанков.
+    """
+    per_row = cols * height * width * itemsize * pixel_arrays
+    per_row += cols * n_layers * itemsize * (n_bases + layer_arrays)
+    return int(chunk_rows * per_row * concurrency)
+
+
+def predict_peak(rows, cols, n_layers, height, width, chunk_size, pixel_arrays, layer_arrays=0, n_bases=1,
+                 concurrency=1, n_metrics=3, results_in_memory=True, baseline=None):
+    """
+    Предсказывает пиковую память расчёта по формам массивов, до начала вычислений.
+
+    Пик = baseline (уже занятая память: загруженные волна, базис, коэффициенты)
+          + карты результатов в памяти + временные массивы одного чанка.
+
+    Возвращает словарь {"baseline", "results", "chunk", "per_row", "total", "chunk_size"} в байтах.
+    """
+    if baseline is None:
+        baseline = current_rss() or 0
+    results = rows * cols * 8 * n_metrics if results_in_memory else 0
+    per_row = chunk_bytes(1, cols, n_layers, height, width, pixel_arrays, layer_arrays, n_bases, concurrency)
+    chunk = per_row * min(chunk_size, rows)
+    return {"baseline": baseline, "results": results, "chunk": chunk, "per_row": per_row,
+            "total": baseline + results + chunk, "chunk_size": chunk_size}
+
+
+def _with_chunk_size(prediction, chunk_size):
+    prediction = dict(prediction, chunk_size=chunk_size, chunk=prediction["per_row"] * chunk_size)
+    prediction["total"] = prediction["baseline"] + prediction["results"] + prediction["chunk"]
+    return prediction
+
+
+def fit_chunk_size(memory_limit, on_exceed, rows, cols, n_layers, height, width, chunk_size, **kwargs):
+    """
+    Проверяет предсказанный пик памяти против memory_limit.
+
+    Если предсказание превышает лимит:
+      on_exceed="shrink" - chunk_size уменьшается до наибольшего, укладывающегося в лимит;
+      on_exceed="refuse" - MemoryError без начала расчёта.
+    MemoryError также, если лимит не выдерживается даже при чанке в одну строку.
+
+    Возвращает (chunk_size, prediction).
+    """
+    if on_exceed not in ("shrink", "refuse"):
+        raise ValueError(f"on_exceed должен быть 'shrink' или 'refuse', получено {on_exceed}")
+    prediction = predict_peak(rows, cols, n_layers, height, width, chunk_size, **kwargs)
+    if memory_limit is None or prediction["total"] <= memory_limit:
+        return chunk_size, prediction
+
+    message = (f"Предсказанный пик памяти {format_size(prediction['total'])} превышает лимит "
+               f"{format_size(memory_limit)} (уже занято {format_size(prediction['baseline'])}, "
+               f"результаты {format_size(prediction['results'])}, чанк из {chunk_size} строк "
+               f"{format_size(prediction['chunk'])})")
+    if on_exceed == "refuse":
+        raise MemoryError(message)
+
+    room = memory_limit - prediction["baseline"] - prediction["results"]
+    fitted = int(room // prediction["per_row"]) if room > 0 and prediction["per_row"] > 0 else 0
+    if fitted < 1:
+        raise MemoryError(message + "; не помещается даже чанк из одной строки")
+    return fitted, _with_chunk_size(prediction, fitted)
+
+
+class RssMonitor:
+    """
+    Фоновый опрос RSS процесса во время расчёта. Метка mark(start, end) после каждого чанка
+    фиксирует текущий RSS и максимум RSS, замеченный с предыдущей метки.
+
+        monitor = RssMonitor().start()
+        for ...:
+            ...
+            monitor.mark(i, end)
+        summary = monitor.stop()
+    """
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.chunks = []
+        self._window_peak = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _poll(self):
+        rss = current_rss()
+        if rss is not None:
+            with self._lock:
+                self._window_peak = max(self._window_peak, rss)
+
+    def start(self):
+        if current_rss() is None:
+            # Без /proc опрашивать нечего: метки будут без RSS
+            return self
+        self._poll()
+
+        def loop():
+            while not self._stop.wait(self.interval):
+                self._poll()
+
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def mark(self, start, end):
+        """Записывает RSS после обработки строк [start, end) и пик за время их обработки."""
+        self._poll()
+        rss = current_rss()
+        with self._lock:
+            self.chunks.append({"rows": [start, end], "rss": rss, "peak_rss": self._window_peak or None})
+            self._window_peak = rss or 0
+
+    def stop(self):
+        """Останавливает опрос. Возвращает сводку {"peak_rss", "chunks"}."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        peaks = [chunk["peak_rss"] for chunk in self.chunks if chunk["peak_rss"]]
+        return {"peak_rss": max(peaks) if peaks else None, "chunks": self.chunks}
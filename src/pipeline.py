@@ -0,0 +1,110 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Prefetcher:
+    """
+    Загрузка входов следующих задач в фоновом потоке, пока текущая задача считается:
+    итерация выдаёт (item, load(item)) в исходном порядке, загружено заранее не больше depth задач.
+    Чтение файлов, разбор и BLAS в numpy отпускают GIL, поэтому загрузка и расчёт идут одновременно;
+    исключение загрузки поднимается при получении этой задачи.
+
+        for task, inputs in Prefetcher(load_inputs, tasks, depth=2):
+            compute(task, inputs)
+    """
+
+    def __init__(self, load, items, depth=1):
+        self.load = load
+        self.items = list(items)
+        self.depth = max(1, int(depth))
+
+    def __iter__(self):
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch") as pool:
+            pending = deque()
+            items = iter(self.items)
+            # Первая задача тоже входит в depth: после её выдачи вперёд загружается не больше depth задач
+            for item in items:
+                pending.append((item, pool.submit(self.load, item)))
+                if len(pending) >= self.depth:
+                    break
+            while pending:
+                item, future = pending.popleft()
+                for following in items:
+                    pending.append((following, pool.submit(self.load, following)))
+                    break
+                try:
+                    yield item, future.result()
+                except BaseException:
+                    for _, waiting in pending:
+                        waiting.cancel()
+                    raise
+
+
+class BackgroundWriter:
+    """
+    Запись результатов в фоновом потоке: задания выполняются строго по очереди (порядок записи
+    карт, манифестов и маркеров завершения сохраняется), в очереди не больше max_pending заданий -
+    submit ждёт, если запись отстаёт. После первой ошибки остальные задания не выполняются
+    (маркер задачи не пишется раньше её карт), а ошибка поднимается в submit или drain.
+
+        with BackgroundWriter() as writer:
+            writer.submit(write_result, path, data)
+    """
+
+    def __init__(self, max_pending=4):
+        self.max_pending = max(1, int(max_pending))
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="writer")
+        self._pending = deque()
+        self._error = None
+        self._lock = threading.Lock()
+
+    def _run(self, function, args, kwargs):
+        with self._lock:
+            if self._error is not None:
+                return None
+        try:
+            return function(*args, **kwargs)
+        except BaseException as exc:
+            with self._lock:
+                self._error = exc
+            raise
+
+    def _raise_error(self):
+        with self._lock:
+            error = self._error
+        if error is not None:
+            raise error
+
+    def submit(self, function, *args, **kwargs):
+        """Ставит вызов function(*args, **kwargs) в очередь записи."""
+        self._raise_error()
+        while len(self._pending) >= self.max_pending:
+            self._pending.popleft().exception()
+            self._raise_error()
+        future = self._pool.submit(self._run, function, args, kwargs)
+        self._pending.append(future)
+        return future
+
+    def drain(self):
+        """Ждёт завершения всех заданий; поднимает первую ошибку записи."""
+        while self._pending:
+            self._pending.popleft().exception()
+        self._raise_error()
+
+    def close(self):
+        try:
+            self.drain()
+        finally:
+            self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Основная ошибка важнее ошибки записи: дожидаемся уже поставленных заданий молча
+            self._pool.shutdown(wait=True)
+        return False
@@ -0,0 +1,295 @@
+import json
+import os
+
+import numpy as np
+
+from src.grid_io import EXPORT_SUFFIX, LEGACY_SUFFIX, RESULT_SUFFIX, atomic_write_json, read_field
+from src.instrumentation import stage
+
+# Куб результатов в директории: индекс (JSON) и два двоичных файла без заголовка (C-порядок):
+#   cube.json        - {"axes": {ось: [метки]}, "shape": [rows, cols], "dtype": "<f8"};
+#   cube.dat         - значения, shape (bath, wave, basis, metric, rows, cols), NaN там, где карты нет;
+#   cube_filled.dat  - uint8 (bath, wave, basis, metric): 1, если карта записана целиком.
+# Разные ячейки (bath, wave, basis, metric) не пересекаются в файле, поэтому процессы серии
+# могут писать в куб одновременно; индекс меняется только при добавлении меток (extend).
+CUBE_INDEX = "cube.json"
+CUBE_DATA = "cube.dat"
+CUBE_FILLED = "cube_filled.dat"
+LABEL_AXES = ("bath", "wave", "basis", "metric")
+AXES = LABEL_AXES + ("row", "col")
+# Метка волны для дерева data/final/<bath>/<basis>/<metric>.txt, где оси волны нет
+FINAL_WAVE = "final"
+
+
+class ResultCube:
+    """
+    Все карты метрик серии расчётов в одном memory-mapped массиве с именованными осями
+    (bath, wave, basis, metric, row, col) вместо дерева файлов
+    <bath>/<wave>/<basis>/<metric>.res (или текстовых <metric>.txt). Выборка карт - срез memmap без разбора текста:
+
+        cube = ResultCube("data/res_real")
+        maps = cube.select(bath="x_200_2000", wave="async_gaus_single_2", metric="rms_accuracy")
+        # maps.shape == (n_basis, rows, cols)
+    """
+
+    def __init__(self, directory, mode="r"):
+        """
+        Открывает существующий куб. mode - "r" (только чтение) или "r+" (запись карт).
+        Куба нет - FileNotFoundError (создание - ResultCube.create).
+        """
+        self.directory = directory
+        self.mode = mode
+        with open(os.path.join(directory, CUBE_INDEX), "r", encoding="utf-8") as f:
+            self.index = json.load(f)
+        self.axes = {axis: list(self.index["axes"][axis]) for axis in LABEL_AXES}
+        self._positions = {axis: {label: i for i, label in enumerate(labels)} for axis, labels in self.axes.items()}
+        self.map_shape = tuple(self.index["shape"])
+        self.dtype = np.dtype(self.index["dtype"])
+        cells = tuple(len(self.axes[axis]) for axis in LABEL_AXES)
+        self.data = np.memmap(os.path.join(directory, CUBE_DATA), dtype=self.dtype, mode=mode,
+                              shape=cells + self.map_shape)
+        self.filled = np.memmap(os.path.join(directory, CUBE_FILLED), dtype=np.uint8, mode=mode, shape=cells)
+
+    @classmethod
+    def create(cls, directory, baths, waves, basises, metrics, shape, dtype=np.float64):
+        """Создаёт пустой куб (все значения NaN) с заданными метками осей и размером карты shape."""
+        os.makedirs(directory, exist_ok=True)
+        axes = {"bath": list(baths), "wave": list(waves), "basis": list(basises), "metric": list(metrics)}
+        for axis, labels in axes.items():
+            if len(set(labels)) != len(labels):
+                raise ValueError(f"Повторяющиеся метки на оси {axis}")
+        cells = tuple(len(axes[axis]) for axis in LABEL_AXES)
+        dtype = np.dtype(dtype).newbyteorder("<")
+        with stage("cube_create", path=directory, cells=int(np.prod(cells))):
+            # Данные создаются до индекса: куб с индексом всегда полный
+            data = np.memmap(os.path.join(directory, CUBE_DATA), dtype=dtype, mode="w+",
+                             shape=cells + tuple(shape))
+            data[:] = np.nan
+            data.flush()
+            del data
+            filled = np.memmap(os.path.join(directory, CUBE_FILLED), dtype=np.uint8, mode="w+", shape=cells)
+            filled.flush()
+            del filled
+            atomic_write_json(os.path.join(directory, CUBE_INDEX),
+                              {"axes": axes, "shape": [int(n) for n in shape], "dtype": dtype.str},
+                              ensure_ascii=False, indent=2)
+        return cls(directory, mode="r+")
+
+    @classmethod
+    def open_or_create(cls, directory, baths, waves, basises, metrics, shape, dtype=np.float64):
+        """Открывает куб для записи, добавляя недостающие метки (extend), или создаёт новый."""
+        if not os.path.exists(os.path.join(directory, CUBE_INDEX)):
+            return cls.create(directory, baths, waves, basises, metrics, shape, dtype)
+        cube = cls(directory, mode="r+")
+        if cube.map_shape != tuple(shape):
+            raise ValueError(f"Размер карт куба {cube.map_shape} не совпадает с {tuple(shape)}")
+        return cube.extend(bath=baths, wave=waves, basis=basises, metric=metrics)
+
+    def labels(self, axis):
+        return list(self.axes[axis])
+
+    def cell(self, bath, wave, basis, metric):
+        """Номера меток ячейки по осям; метки нет на оси - KeyError."""
+        key = {"bath": bath, "wave": wave, "basis": basis, "metric": metric}
+        try:
+            return tuple(self._positions[axis][key[axis]] for axis in LABEL_AXES)
+        except KeyError as exc:
+            raise KeyError(f"Метки {exc.args[0]} нет в кубе {self.directory}") from None
+
+    def has(self, bath, wave, basis, metric):
+        """True, если карта ячейки записана целиком."""
+        try:
+            return bool(self.filled[self.cell(bath, wave, basis, metric)])
+        except KeyError:
+            return False
+
+    def read(self, bath, wave, basis, metric):
+        """Карта одной ячейки (rows, cols) - представление memmap без копирования."""
+        return self.data[self.cell(bath, wave, basis, metric)]
+
+    def write(self, bath, wave, basis, metric, values, start=0):
+        """
+        Записывает строки [start, start + len(values)) карты ячейки. Карта, записанная целиком,
+        отмечается в cube_filled.dat.
+        """
+        if self.mode == "r":
+            raise ValueError("Куб открыт только для чтения")
+        values = np.asarray(values)
+        if values.ndim != 2 or values.shape[1] != self.map_shape[1] or start + values.shape[0] > self.map_shape[0]:
+            raise ValueError(f"Блок {values.shape} со строки {start} не помещается в карту {self.map_shape}")
+        cell = self.cell(bath, wave, basis, metric)
+        self.data[cell][start:start + values.shape[0]] = values
+        if start == 0 and values.shape[0] == self.map_shape[0]:
+            self.filled[cell] = 1
+
+    def _axis_index(self, axis, value):
+        """Индекс оси для select: None - вся ось, метка - одно значение, список меток - срез или массив."""
+        if value is None:
+            return slice(None)
+        if isinstance(value, str):
+            return self._positions[axis][value]
+        positions = [self._positions[axis][label] for label in value]
+        # Подряд идущие метки выбираются срезом - представлением memmap без копирования
+        if positions and positions == list(range(positions[0], positions[0] + len(positions))):
+            return slice(positions[0], positions[0] + len(positions))
+        return np.asarray(positions, dtype=np.int64)
+
+    def select(self, bath=None, wave=None, basis=None, metric=None):
+        """
+        Выборка карт по меткам осей. Каждая ось - None (все метки), одна метка (ось исчезает)
+        или список меток (в заданном порядке). Результат - memmap-представление или, если метки
+        идут не подряд, массив.
+        """
+        key = [self._axis_index(axis, value) for axis, value in
+               zip(LABEL_AXES, (bath, wave, basis, metric))]
+        result = self.data[tuple(slice(None) if isinstance(index, np.ndarray) else index for index in key)]
+        # Списки меток не подряд - по одной оси за раз, без совместной fancy-индексации numpy
+        for i, index in enumerate(key):
+            if isinstance(index, np.ndarray):
+                axis = i - sum(1 for previous in key[:i] if isinstance(previous, int))
+                result = np.take(result, index, axis=axis)
+        return result
+
+    def extend(self, **labels):
+        """
+        Добавляет метки на оси (bath=[...], wave=[...], ...). Если новых меток нет, куб не меняется;
+        иначе файлы переписываются с новыми размерами (записанные карты сохраняются).
+        Возвращает куб, открытый для записи.
+        """
+        new_axes = {axis: list(self.axes[axis]) for axis in LABEL_AXES}
+        for axis, values in labels.items():
+            if axis not in new_axes:
+                raise ValueError(f"Неизвестная ось {axis}, доступны: {', '.join(LABEL_AXES)}")
+            new_axes[axis] += [label for label in values if label not in self._positions[axis]]
+        if new_axes == self.axes:
+            return self if self.mode == "r+" else ResultCube(self.directory, mode="r+")
+
+        with stage("cube_extend", path=self.directory):
+            tmp_directory = self.directory.rstrip(os.sep) + f".{os.getpid()}.tmp"
+            grown = ResultCube.create(tmp_directory, *(new_axes[axis] for axis in LABEL_AXES),
+                                      shape=self.map_shape, dtype=self.dtype)
+            # Старые метки сохраняют порядок, новые дописываются в конец оси: старый куб - угол нового
+            corner = tuple(slice(0, len(self.axes[axis])) for axis in LABEL_AXES)
+            for i in range(len(self.axes["bath"])):
+                grown.data[(i,) + corner[1:]] = self.data[i]
+            grown.filled[corner] = self.filled
+            grown.data.flush()
+            grown.filled.flush()
+            del grown
+            self.close()
+            for name in (CUBE_DATA, CUBE_FILLED, CUBE_INDEX):
+                os.replace(os.path.join(tmp_directory, name), os.path.join(self.directory, name))
+            os.rmdir(tmp_directory)
+        return ResultCube(self.directory, mode="r+")
+
+    def flush(self):
+        if self.mode != "r":
+            self.data.flush()
+            self.filled.flush()
+
+    def close(self):
+        self.flush()
+        self.data = self.filled = None
+
+
+def iter_text_tree(tree_root, wave=FINAL_WAVE):
+    """
+    Карты в дереве файлов <metric>.res (write_result) или <metric>.txt (текст save_array и прежние
+    деревья результатов): (bath, wave, basis, metric, path) для
+    <tree_root>/<bath>/<wave>/<basis>/<metric>.res (data/res_real) и
+    <tree_root>/<bath>/<basis>/<metric>.txt (data/final, метка волны - wave).
+    Если рядом лежат обе карты метрики, берётся .res.
+    """
+    for directory, _, filenames in sorted(os.walk(tree_root)):
+        parts = os.path.relpath(directory, tree_root).split(os.sep)
+        if len(parts) == 3:
+            bath, wave_label, basis = parts
+        elif len(parts) == 2:
+            (bath, basis), wave_label = parts, wave
+        else:
+            continue
+        for filename in sorted(filenames):
+            if filename.endswith(RESULT_SUFFIX):
+                metric = filename[:-len(RESULT_SUFFIX)]
+            # Текстовые копии export_text - не отдельные метрики
+            elif filename.endswith(LEGACY_SUFFIX) and not filename.endswith(EXPORT_SUFFIX):
+                metric = filename[:-len(LEGACY_SUFFIX)]
+                if metric + RESULT_SUFFIX in filenames:
+                    continue
+            else:
+                continue
+            yield bath, wave_label, basis, metric, os.path.join(directory, filename)
+
+
+def import_text_tree(tree_root, cube_directory=None, wave=FINAL_WAVE, force=False):
+    """
+    Переносит карты дерева файлов (iter_text_tree) в куб cube_directory
+    (по умолчанию - сам tree_root). Уже записанные в куб карты пропускаются (force=True - перечитать).
+    Возвращает число перенесённых карт.
+    """
+    cube_directory = cube_directory or tree_root
+    entries = list(iter_text_tree(tree_root, wave))
+    if not entries:
+        raise ValueError(f"В {tree_root} нет карт <bath>/[<wave>/]<basis>/<metric>.res или .txt")
+    axes = [[] for _ in LABEL_AXES]
+    for entry in entries:
+        for labels, label in zip(axes, entry[:4]):
+            if label not in labels:
+                labels.append(label)
+    cube = None
+    imported = 0
+    for bath, wave_label, basis, metric, path in entries:
+        if cube is not None and not force and cube.has(bath, wave_label, basis, metric):
+            continue
+        with stage("cube_import", path=path):
+            values = read_field(path)
+        if cube is None:
+            cube = ResultCube.open_or_create(cube_directory, *axes, shape=values.shape)
+            if not force and cube.has(bath, wave_label, basis, metric):
+                continue
+        if values.shape != cube.map_shape:
+            print(f"Пропущена карта {path}: размер {values.shape} вместо {cube.map_shape}")
+            continue
+        cube.write(bath, wave_label, basis, metric, values)
+        imported += 1
+    cube.flush()
+    return imported
+
+
+def find_cube(path):
+    """Директория куба, содержащего path (сама path или ближайшая родительская с cube.json), или None."""
+    path = os.path.abspath(path)
+    while True:
+        if os.path.exists(os.path.join(path, CUBE_INDEX)):
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def load_tree_maps(base_dir, basises, metric="rms_accuracy"):
+    """
+    Карты metric для списка базисов из директории дерева результатов base_dir
+    (<root>/<bath>/<wave> или <root>/<bath> для data/final). Если для дерева есть куб
+    (import_text_tree) и в нём записаны все карты - одна выборка из memmap, иначе - чтение
+    файлов <base_dir>/<basis>/<metric>.res (read_field; в прежних деревьях - <metric>.txt).
+    Отсутствующая карта - None.
+    """
+    cube_directory = find_cube(base_dir)
+    if cube_directory is not None:
+        parts = os.path.relpath(os.path.abspath(base_dir), cube_directory).split(os.sep)
+        bath, wave = (parts[0], parts[1]) if len(parts) == 2 else (parts[0], FINAL_WAVE)
+        cube = ResultCube(cube_directory)
+        if all(cube.has(bath, wave, basis, metric) for basis in basises):
+            maps = np.asarray(cube.select(bath=bath, wave=wave, basis=list(basises), metric=metric))
+            return list(maps)
+    maps = []
+    for basis in basises:
+        file_path = os.path.join(base_dir, basis, f"{metric}{RESULT_SUFFIX}")
+        try:
+            maps.append(read_field(file_path))
+        except OSError as e:
+            print(f"Ошибка загрузки {file_path}: {e}")
+            maps.append(None)
+    return maps
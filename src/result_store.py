@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from src.calc_total_acc import METRICS, row_chunks
+from src.grid_io import (RESULT_SUFFIX, atomic_write_json, drop_legacy_result, existing_result_path, read_field,
+                         write_result)
+from src.instrumentation import stage
+from src.sparse_basis import SparseBasis
+
+
+def array_hash(array):
+    """Возвращает sha1-хеш содержимого массива (форма и dtype учитываются)."""
+    array = np.ascontiguousarray(array)
+    h = hashlib.sha1()
+    h.update(str((array.shape, array.dtype.str)).encode("utf-8"))
+    h.update(array.tobytes())
+    return h.hexdigest()
+
+
+def atomic_savetxt(path, data):
+    """Сохраняет 2D массив в текстовом формате save_array через временный файл и rename."""
+    with stage("save", path=path) as st:
+        tmp_path = path + ".tmp"
+        np.savetxt(tmp_path, data, fmt='%.6f')
+        os.replace(tmp_path, path)
+        st.add(pixels=np.size(data), bytes=os.path.getsize(path))
+
+
+class ResultStore:
+    """
+    Хранилище карт метрик для одной тройки (bath, wave, basis):
+    data/res_real/<bath>/<wave>/<basis>/<metric>.res. Карты пишутся в двоичном формате из блоков
+    (src.grid_io.write_result) со сведениями о расчёте в заголовке; прежние текстовые карты <metric>.txt
+    читаются и заменяются картой .res при следующей записи.
+
+    Рядом с картами хранится манифест blocks.json с хешем входных данных (волна и базис)
+    и хешами коэффициентов по блокам строк. При повторном запуске пересчитываются только
+    блоки, чьи коэффициенты изменились, а существующие карты дописываются на месте.
+    """
+    MANIFEST_NAME = "blocks.json"
+    # Контрольная точка незавершённого пересчёта (см. TotalAccuracy.get_accuracy(checkpoint=True))
+    CHECKPOINT_DIR = ".checkpoint"
+
+    def __init__(self, result_dir, chunk_size=37, metrics=METRICS, engine=None, memory_limit=None,
+                 on_exceed="shrink", cube=None, cube_key=None, compression=None, writer=None,
+                 checkpoint=False):
+        """
+        Параметры:
+          result_dir - директория с картами метрик;
+          chunk_size - высота блока строк (совпадает с чанком get_accuracy);
+          metrics    - имена метрик, которые хранятся в директории;
+          engine     - движок расчёта для get_accuracy (None - выбор по умолчанию);
+          memory_limit, on_exceed - лимит пиковой памяти и реакция на превышение для get_accuracy;
+          cube, cube_key - куб результатов (src.result_cube.ResultCube, открытый для записи) и ячейка
+                       (bath, wave, basis), в которую дописываются те же карты;
+          compression - сжатие блоков карт (см. write_result), None - без сжатия;
+          writer     - фоновая запись (src.pipeline.BackgroundWriter): карты, куб и манифест пишутся
+                       в её потоке по очереди, update возвращается сразу после расчёта; None - запись на месте;
+          checkpoint - считать с контрольными точками в <result_dir>/.checkpoint: прерванный пересчёт
+                       продолжается с готовых чанков; директория удаляется после записи манифеста.
+        """
+        self.result_dir = result_dir
+        self.chunk_size = chunk_size
+        self.metrics = tuple(metrics)
+        self.engine = engine
+        self.memory_limit = memory_limit
+        self.on_exceed = on_exceed
+        self.cube = cube
+        self.cube_key = cube_key
+        self.compression = compression
+        self.writer = writer
+        self.checkpoint = checkpoint
+        self.manifest_path = os.path.join(result_dir, self.MANIFEST_NAME)
+
+    def metric_path(self, metric):
+        return os.path.join(self.result_dir, f"{metric}{RESULT_SUFFIX}")
+
+    def load_manifest(self):
+        """Возвращает манифест или None, если его нет или он повреждён."""
+        if not os.path.exists(self.manifest_path):
+            return None
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_manifest(self, manifest):
+        atomic_write_json(self.manifest_path, manifest, indent=2)
+
+    @staticmethod
+    def block_hashes(coefs, blocks):
+        """Хеши коэффициентов для каждого блока строк (start, end)."""
+        return [array_hash(coefs[start:end]) for start, end in blocks]
+
+    @staticmethod
+    def inputs_hash(wave, basis):
+        """Хеш обрезанной волны и набора базисных функций (плотного стека или SparseBasis)."""
+        h = hashlib.sha1()
+        h.update(array_hash(wave).encode("utf-8"))
+        if isinstance(basis, SparseBasis):
+            # Разреженный базис хешируется по массивам CSR, без развёртывания в плотный стек
+            h.update(str(basis.shape).encode("utf-8"))
+            for array in (basis.data, basis.indices, basis.indptr):
+                h.update(array_hash(array).encode("utf-8"))
+            return h.hexdigest()
+        for layer in basis:
+            h.update(array_hash(layer).encode("utf-8"))
+        return h.hexdigest()
+
+    def plan(self, wave, basis, coefs):
+        """
+        Определяет, какие блоки строк нужно пересчитать.
+
+        Возвращает кортеж (blocks, stale, manifest):
+          blocks   - все блоки строк сетки коэффициентов;
+          stale    - индексы блоков, требующих пересчёта;
+          manifest - новый манифест, который будет записан после пересчёта.
+        """
+        rows, cols = coefs.shape[:2]
+        blocks = row_chunks(rows, self.chunk_size)
+        manifest = {
+            "shape": [rows, cols],
+            "chunk_size": self.chunk_size,
+            "metrics": list(self.metrics),
+            "inputs": self.inputs_hash(wave, basis),
+            "blocks": self.block_hashes(coefs, blocks),
+        }
+
+        old = self.load_manifest()
+        maps_exist = all(os.path.exists(existing_result_path(self.metric_path(m))) for m in self.metrics)
+        reusable = (
+            old is not None and maps_exist
+            and old.get("shape") == manifest["shape"]
+            and old.get("chunk_size") == manifest["chunk_size"]
+            and old.get("inputs") == manifest["inputs"]
+            and set(self.metrics) <= set(old.get("metrics", []))
+        )
+        if not reusable:
+            return blocks, list(range(len(blocks))), manifest
+
+        old_blocks = old.get("blocks", [])
+        stale = [
+            k for k, block_hash in enumerate(manifest["blocks"])
+            if k >= len(old_blocks) or old_blocks[k] != block_hash
+        ]
+        return blocks, stale, manifest
+
+    def update(self, calculator):
+        """
+        Приводит карты метрик в соответствие с текущими входными данными калькулятора
+        (TotalAccuracy): пересчитывает только изменившиеся блоки строк и дописывает их
+        в существующие карты. Возвращает список пересчитанных блоков (start, end).
+        """
+        blocks, stale, manifest = self.plan(calculator.wave, calculator.basis, calculator.coefs)
+        if not stale:
+            self._submit(self._sync_cube)
+            return []
+
+        os.makedirs(self.result_dir, exist_ok=True)
+        stale_blocks = [blocks[k] for k in stale]
+        full = len(stale) == len(blocks)
+        started = time.perf_counter()
+        checkpoint_dir = os.path.join(self.result_dir, self.CHECKPOINT_DIR) if self.checkpoint else None
+        fresh = calculator.get_accuracy(chunk_size=self.chunk_size, row_blocks=stale_blocks,
+                                        metrics=self.metrics, engine=self.engine,
+                                        memory_limit=self.memory_limit, on_exceed=self.on_exceed,
+                                        out_dir=checkpoint_dir, checkpoint=self.checkpoint)
+        meta = {"inputs": manifest["inputs"], "engine": calculator.last_run["engine"],
+                "chunk_size": calculator.last_run["chunk_size"], "blocks": len(stale_blocks),
+                "seconds": round(time.perf_counter() - started, 3)}
+        # Сведения о памяти последнего пересчёта: предсказание, размер чанка и RSS по чанкам
+        manifest["run"] = calculator.last_run
+        self._submit(self._write, fresh, stale_blocks, full, meta, manifest)
+        return stale_blocks
+
+    def _submit(self, function, *args):
+        if self.writer is None:
+            function(*args)
+        else:
+            self.writer.submit(function, *args)
+
+    def _write(self, fresh, stale_blocks, full, meta, manifest):
+        """Записывает пересчитанные блоки в карты метрик и куб, затем манифест."""
+        for metric in self.metrics:
+            if full:
+                data = fresh[metric]
+            else:
+                # Дописываем пересчитанные блоки в уже сохранённую карту
+                data = read_field(self.metric_path(metric))
+                for start, end in stale_blocks:
+                    data[start:end, :] = fresh[metric][start:end, :]
+            write_result(self.metric_path(metric), data, compression=self.compression, meta=dict(meta, metric=metric))
+            drop_legacy_result(self.metric_path(metric))
+            if self.cube is not None:
+                self.cube.write(*self.cube_key, metric, data)
+
+        # Манифест пишется последним: незавершённый запуск повторится целиком для изменённых блоков
+        if self.cube is not None:
+            self.cube.flush()
+        self._save_manifest(manifest)
+        if self.checkpoint:
+            shutil.rmtree(os.path.join(self.result_dir, self.CHECKPOINT_DIR), ignore_errors=True)
+
+    def _sync_cube(self):
+        """Дописывает в куб актуальные карты, которых в нём ещё нет (куб создан позже карт)."""
+        if self.cube is None:
+            return
+        for metric in self.metrics:
+            if not self.cube.has(*self.cube_key, metric):
+                self.cube.write(*self.cube_key, metric, read_field(self.metric_path(metric)))
+        self.cube.flush()
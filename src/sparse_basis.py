@@ -0,0 +1,200 @@
+import os
+
+import numpy as np
+
+from src.instrumentation import stage
+
+# Имя файла разреженного базиса в директории basises/<basis_name>
+SPARSE_BASIS_NAME = "basis.csr.npz"
+
+
+class SparseBasis:
+    """
+    Базис в формате CSR: матрица (n_layers, H * W), в строке k хранятся только пиксели носителя
+    функции k (indices - плоские номера пикселей по возрастанию, data - значения).
+    Память и вычисления пропорциональны суммарному размеру носителей, а не n_layers * H * W.
+
+    Интерфейс повторяет то, что движкам нужно от плотного массива базиса:
+    проекции волны (project), реконструкции (reconstruct), матрица Грама (gram).
+    """
+
+    def __init__(self, shape, indptr, indices, data):
+        """
+        Параметры:
+          shape - размер поля одной функции (H, W);
+          indptr - границы строк, длина n_layers + 1;
+          indices - плоские номера пикселей (y * W + x), внутри строки по возрастанию;
+          data - значения в этих пикселях.
+        """
+        self.shape = tuple(int(n) for n in shape)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.data = np.asarray(data, dtype=np.float64)
+        if self.indptr[-1] != self.indices.size or self.indices.size != self.data.size:
+            raise ValueError("Несогласованные массивы CSR: indptr, indices и data")
+
+    @property
+    def n_layers(self):
+        return self.indptr.size - 1
+
+    @property
+    def nnz(self):
+        return self.data.size
+
+    def __len__(self):
+        return self.n_layers
+
+    @classmethod
+    def from_dense(cls, basis_stack):
+        """CSR из плотного массива базиса (n_layers, H, W): хранятся только ненулевые значения."""
+        flat = np.asarray(basis_stack).reshape(basis_stack.shape[0], -1)
+        rows, indices = np.nonzero(flat)
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=flat.shape[0]))])
+        return cls(basis_stack.shape[1:], indptr, indices, flat[rows, indices])
+
+    @classmethod
+    def from_blocks(cls, shape, blocks):
+        """
+        CSR из функций, заданных значениями на прямоугольнике носителя.
+
+        Параметры:
+          shape - размер поля (H, W);
+          blocks - список (y0, x0, values): values - 2D значения функции на [y0, y0 + h) x [x0, x0 + w),
+                   вне прямоугольника функция равна нулю; нулевые значения внутри не хранятся.
+        """
+        height, width = shape
+        indptr, indices, data = [0], [], []
+        for y0, x0, values in blocks:
+            values = np.asarray(values, dtype=np.float64)
+            ys, xs = np.nonzero(values)
+            indices.append((ys + y0) * width + xs + x0)
+            data.append(values[ys, xs])
+            indptr.append(indptr[-1] + ys.size)
+        empty = np.empty(0)
+        return cls(shape, indptr, np.concatenate(indices) if indices else empty,
+                   np.concatenate(data) if data else empty)
+
+    def row(self, k):
+        """Носитель и значения функции k: (indices, data)."""
+        start, end = self.indptr[k], self.indptr[k + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    def toarray(self):
+        """Плотный массив базиса (n_layers, H, W)."""
+        dense = np.zeros((self.n_layers, self.shape[0] * self.shape[1]))
+        rows = np.repeat(np.arange(self.n_layers), np.diff(self.indptr))
+        dense[rows, self.indices] = self.data
+        return dense.reshape((self.n_layers,) + self.shape)
+
+    def crop(self, zone):
+        """Базис, обрезанный до области zone = [y_min, y_max, x_min, x_max] (пиксели вне зоны отбрасываются)."""
+        y_min, y_max, x_min, x_max = zone
+        ys, xs = np.divmod(self.indices, self.shape[1])
+        keep = (ys >= y_min) & (ys < y_max) & (xs >= x_min) & (xs < x_max)
+        rows = np.repeat(np.arange(self.n_layers), np.diff(self.indptr))[keep]
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=self.n_layers))])
+        indices = (ys[keep] - y_min) * (x_max - x_min) + xs[keep] - x_min
+        return SparseBasis((y_max - y_min, x_max - x_min), indptr, indices, self.data[keep])
+
+    def project(self, wave):
+        """Проекции волны на базисные функции p[k] = <b_k, wave>, shape (n_layers,)."""
+        rows = np.repeat(np.arange(self.n_layers), np.diff(self.indptr))
+        return np.bincount(rows, weights=self.data * np.asarray(wave).reshape(-1)[self.indices],
+                           minlength=self.n_layers)
+
+    def pixel_groups(self):
+        """
+        Разбиение покрытых пикселей на группы с одинаковым набором функций, ненулевых в пикселе.
+        Список (layers, pixels, values): values shape (len(layers), len(pixels)) - плотный блок
+        матрицы базиса. Строится один раз и кешируется.
+        """
+        if getattr(self, "_groups", None) is None:
+            rows = np.repeat(np.arange(self.n_layers), np.diff(self.indptr))
+            order = np.lexsort((rows, self.indices))
+            pixels, layers, values = self.indices[order], rows[order], self.data[order]
+            covered, starts, counts = np.unique(pixels, return_index=True, return_counts=True)
+            # Набор функций пикселя - строка таблицы, дополненная -1 до наибольшего перекрытия
+            slot = np.arange(pixels.size) - np.repeat(starts, counts)
+            owner = np.repeat(np.arange(covered.size), counts)
+            signature = np.full((covered.size, counts.max(initial=0)), -1, dtype=np.int64)
+            signature[owner, slot] = layers
+            table = np.zeros(signature.shape)
+            table[owner, slot] = values
+            unique, inverse = np.unique(signature, axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            members = np.argsort(inverse, kind="stable")
+            bounds = np.concatenate([[0], np.cumsum(np.bincount(inverse, minlength=unique.shape[0]))])
+            self._groups = []
+            for g, group_layers in enumerate(unique):
+                group_layers = group_layers[group_layers >= 0]
+                selected = members[bounds[g]:bounds[g + 1]]
+                self._groups.append((group_layers, covered[selected],
+                                     np.ascontiguousarray(table[selected, :group_layers.size].T)))
+        return self._groups
+
+    def reconstruct(self, coefs):
+        """
+        Реконструкции sum_k c_k b_k для коэффициентов coefs shape (..., n_layers) -> (..., H, W).
+
+        Для каждой группы пикселей с общим набором функций (pixel_groups) считается одно плотное
+        произведение (точки x функции группы) @ (функции группы x пиксели): O(число точек * nnz)
+        операций через BLAS, без зависимости от n_layers, как у плотного tensordot.
+        """
+        coefs = np.asarray(coefs, dtype=np.float64)
+        flat = coefs.reshape(-1, self.n_layers)
+        out = np.zeros((flat.shape[0], self.shape[0] * self.shape[1]))
+        for layers, pixels, values in self.pixel_groups():
+            out[:, pixels] = flat[:, layers] @ values
+        return out.reshape(coefs.shape[:-1] + self.shape)
+
+    def bounding_boxes(self):
+        """Ограничивающие прямоугольники носителей [y_min, y_max, x_min, x_max], shape (n_layers, 4)."""
+        ys, xs = np.divmod(self.indices, self.shape[1])
+        rows = np.repeat(np.arange(self.n_layers), np.diff(self.indptr))
+        boxes = np.zeros((self.n_layers, 4), dtype=np.int64)
+        boxes[:, 0], boxes[:, 2] = np.iinfo(np.int64).max, np.iinfo(np.int64).max
+        np.minimum.at(boxes[:, 0], rows, ys)
+        np.maximum.at(boxes[:, 1], rows, ys + 1)
+        np.minimum.at(boxes[:, 2], rows, xs)
+        np.maximum.at(boxes[:, 3], rows, xs + 1)
+        return boxes
+
+    def gram(self):
+        """
+        Матрица Грама G[i, j] = <b_i, b_j>, shape (n_layers, n_layers). Скалярные произведения
+        считаются только для пар с пересекающимися ограничивающими прямоугольниками носителей,
+        остальные элементы - нули; стоимость пропорциональна суммарному размеру перекрытий.
+        """
+        with stage("gram_build", layers=self.n_layers, sparse=True):
+            gram = np.zeros((self.n_layers, self.n_layers))
+            boxes = self.bounding_boxes()
+            overlap = ((boxes[:, None, 0] < boxes[None, :, 1]) & (boxes[None, :, 0] < boxes[:, None, 1])
+                       & (boxes[:, None, 2] < boxes[None, :, 3]) & (boxes[None, :, 2] < boxes[:, None, 3]))
+            scratch = np.zeros(self.shape[0] * self.shape[1])
+            for i in range(self.n_layers):
+                indices_i, data_i = self.row(i)
+                scratch[indices_i] = data_i
+                for j in np.flatnonzero(overlap[i, i:]) + i:
+                    indices_j, data_j = self.row(j)
+                    gram[i, j] = gram[j, i] = data_j @ scratch[indices_j]
+                scratch[indices_i] = 0.0
+            return gram
+
+    def to_scipy(self):
+        """Та же матрица как scipy.sparse.csr_matrix (нужен scipy)."""
+        from scipy.sparse import csr_matrix
+
+        return csr_matrix((self.data, self.indices, self.indptr),
+                          shape=(self.n_layers, self.shape[0] * self.shape[1]))
+
+    def save(self, path):
+        """Сохраняет базис в .npz (атомарно)."""
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, shape=np.array(self.shape), indptr=self.indptr, indices=self.indices, data=self.data)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as archive:
+            return cls(tuple(archive["shape"]), archive["indptr"], archive["indices"], archive["data"])
@@ -1,25 +1,33 @@
 import os
 import json
 import numpy as np
-import matplotlib.pyplot as plt
+
+from src.fields import SeparableField
 
 
 class SubductionGenerator:
-    def __init__(self):
+    def __init__(self, config_path=os.path.join("config", "zones.json")):
         """
         Инициализация генератора субдукционной зоны.
-        Конфигурация загружается напрямую из файла config/zones.json.
+        Конфигурация загружается напрямую из файла config/zones.json (или из файла config_path).
         Ожидается, что zones.json содержит:
             "size": [height, width]
             "subduction_zone": [y_min, y_max, x_min, x_max]
         """
-        config_path = os.path.join("config", "zones.json")
         with open(config_path, 'r', encoding='utf-8') as f:
             config = json.load(f)
         self.height, self.width = config["size"]
         self.sub_y_min, self.sub_y_max, self.sub_x_min, self.sub_x_max = config["subduction_zone"]
 
-    def gaussian(self, amplitude=1.0, sigma_x=50.0, sigma_y=50.0):
+    def _field(self, terms, lazy):
+        """
+        Поле, равное нулю вне subduction_zone и сумме внешних произведений профилей внутри неё.
+        lazy=True возвращает ленивое поле SeparableField, иначе - готовый массив.
+        """
+        field = SeparableField((self.height, self.width), terms, offset=(self.sub_y_min, self.sub_x_min))
+        return field if lazy else field.to_array()
+
+    def gaussian(self, amplitude=1.0, sigma_x=50.0, sigma_y=50.0, lazy=False):
         """
         Генерирует 2D массив размера size, где за пределами subduction_zone значения равны 0,
         а внутри subduction_zone расположена гауссова функция с центром в центре этой области.
@@ -31,27 +39,27 @@ class SubductionGenerator:
         Параметры:
           amplitude - максимальное значение гаусса;
           sigma_x - параметр стандартного отклонения по оси x;
-          sigma_y - параметр стандартного отклонения по оси y.
-        """
-        result = np.zeros((self.height, self.width), dtype=float)
+          sigma_y - параметр стандартного отклонения по оси y;
+          lazy - вернуть ленивое поле SeparableField вместо массива.
 
+        Гаусс разделим: exp(-(a + b)) = exp(-a) * exp(-b), поэтому строится как внешнее
+        произведение профилей по y и x без сеток meshgrid (совпадает с прямой формулой
+        с точностью до округления).
+        """
         # Диапазоны индексов для subduction_zone
         y_indices = np.arange(self.sub_y_min, self.sub_y_max)
         x_indices = np.arange(self.sub_x_min, self.sub_x_max)
         if y_indices.size == 0 or x_indices.size == 0:
-            return result
+            return self._field([], lazy)
 
-        # Создаем сетку
-        X, Y = np.meshgrid(x_indices, y_indices)
         center_x = (self.sub_x_min + self.sub_x_max) / 2.0
         center_y = (self.sub_y_min + self.sub_y_max) / 2.0
 
-        gauss = amplitude * np.exp(-(((X - center_x) ** 2 / (2 * sigma_x ** 2)) +
-                                     ((Y - center_y) ** 2 / (2 * sigma_y ** 2))))
-        result[self.sub_y_min:self.sub_y_max, self.sub_x_min:self.sub_x_max] = gauss
-        return result
+        gauss_x = np.exp(-((x_indices - center_x) ** 2 / (2 * sigma_x ** 2)))
+        gauss_y = np.exp(-((y_indices - center_y) ** 2 / (2 * sigma_y ** 2)))
+        return self._field([(amplitude, gauss_y, gauss_x)], lazy)
 
-    def double_gaussian(self, sigma_x=50.0, sigma_y=50.0, amplitude1=1.0, amplitude2=1.0):
+    def double_gaussian(self, sigma_x=50.0, sigma_y=50.0, amplitude1=1.0, amplitude2=1.0, lazy=False):
         """
         Генерирует 2D массив размера size, где за пределами subduction_zone значения равны 0.
         Внутри subduction_zone вычисляются две гауссовы функции по всему региону:
@@ -69,22 +77,23 @@ class SubductionGenerator:
           sigma_x - параметр стандартного отклонения по оси x для обеих гауссовых функций;
           sigma_y - параметр стандартного отклонения по оси y для обеих гауссовых функций;
           amplitude1 - амплитуда для верхнего гауссова распределения;
-          amplitude2 - амплитуда для нижнего гауссова распределения.
-        """
-        result = np.zeros((self.height, self.width), dtype=float)
+          amplitude2 - амплитуда для нижнего гауссова распределения;
+          lazy - вернуть ленивое поле SeparableField вместо массива.
 
+        Оба гаусса имеют общий профиль по x, поэтому сумма - одно внешнее произведение
+        профиля по x и суммы двух профилей по y.
+        """
         y_min = self.sub_y_min
         y_max = self.sub_y_max
         x_min = self.sub_x_min
         x_max = self.sub_x_max
 
         if y_max <= y_min or x_max <= x_min:
-            return result
+            return self._field([], lazy)
 
-        # Создаем сетку для области subduction_zone
+        # Координаты области subduction_zone
         y_indices = np.arange(y_min, y_max)
         x_indices = np.arange(x_min, x_max)
-        X, Y = np.meshgrid(x_indices, y_indices)
         center_x = (x_min + x_max) / 2.0
 
         # Высота субдукционной зоны
@@ -95,12 +104,10 @@ class SubductionGenerator:
         center_y_top = cy + L / 3.0
         center_y_bottom = cy - L / 3.0
 
-        top_gauss = amplitude1 * np.exp(-(((X - center_x) ** 2 / (2 * sigma_x ** 2)) +
-                                          ((Y - center_y_top) ** 2 / (2 * sigma_y ** 2))))
-        bottom_gauss = amplitude2 * np.exp(-(((X - center_x) ** 2 / (2 * sigma_x ** 2)) +
-                                             ((Y - center_y_bottom) ** 2 / (2 * sigma_y ** 2))))
-        double_gauss = top_gauss + bottom_gauss
-        result[y_min:y_max, x_min:x_max] = double_gauss
+        gauss_x = np.exp(-((x_indices - center_x) ** 2 / (2 * sigma_x ** 2)))
+        top_gauss_y = amplitude1 * np.exp(-((y_indices - center_y_top) ** 2 / (2 * sigma_y ** 2)))
+        bottom_gauss_y = amplitude2 * np.exp(-((y_indices - center_y_bottom) ** 2 / (2 * sigma_y ** 2)))
+        result = self._field([(1.0, top_gauss_y + bottom_gauss_y, gauss_x)], lazy)
 
         # Вывод формулы поверхности внутри функции
         print("Формула поверхности f(x,y) для double_gaussian:")
@@ -113,6 +120,8 @@ class SubductionGenerator:
 
 # Пример для самостоятельного тестирования с визуализацией:
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+
     generator = SubductionGenerator()
 
     gauss_data = generator.gaussian(amplitude=1.0, sigma_x=50.0, sigma_y=50.0)
@@ -0,0 +1,392 @@
+import copy
+import hashlib
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+
+from src.array_cache import cached_basis, cached_wave
+from src.calc_total_acc import METRICS, TotalAccuracy, load_json_data
+from src.coef_store import open_coefs, scan_json_shape
+from src.data_catalog import DEFAULT_COEFS_PATTERN, DataCatalog, file_hash
+from src.grid_io import RESULT_SUFFIX, atomic_write_json, drop_legacy_result, read_field, write_result
+from src.instrumentation import stage
+from src.loaders import BASIS_EXTRA_FILES, DEFAULT_CONFIG_PATH, list_basis_files, load_config
+from src.pipeline import BackgroundWriter, Prefetcher
+from src.result_cube import ResultCube
+from src.result_store import ResultStore
+from src.sparse_basis import SPARSE_BASIS_NAME
+
+SweepTask = namedtuple("SweepTask", ["bath", "wave", "basis"])
+
+TASK_MARKER = ".task.json"
+
+
+class SweepSpec:
+    """
+    Описание серии расчётов точности: какие bath, волны и базисы перебираются,
+    какие метрики считаются, в какой зоне и куда пишутся результаты.
+    """
+
+    def __init__(self, root_folder, output_root, baths, waves, basises, metrics=METRICS,
+                 zone="subduction_zone", config_path=DEFAULT_CONFIG_PATH, chunk_size=37,
+                 coefs_pattern=DEFAULT_COEFS_PATTERN, workers=1, streaming=False, engine=None,
+                 memory_limit=None, on_exceed="shrink", cube=None, compression=None, prefetch=0,
+                 checkpoint=False):
+        """
+        Параметры:
+          root_folder - корневая папка с данными (waves/, basises/, coeffs/);
+          output_root - корень результатов: <output_root>/<bath>/<wave>/<basis>/<metric>.res;
+          baths, waves, basises - перебираемые имена;
+          metrics - вычисляемые метрики (подмножество METRICS);
+          zone - имя зоны из zones.json;
+          config_path - путь к zones.json;
+          chunk_size - число строк коэффициентной сетки в чанке;
+          coefs_pattern - шаблон имени файла коэффициентов с полями {wave}, {basis}, {bath};
+          workers - число процессов-исполнителей;
+          streaming - читать коэффициенты по блокам из memory-mapped кеша;
+          engine - движок расчёта из src.engines.ENGINES (None - эталонный, для одной rms_accuracy - gram).
+                   Движки совпадают с эталоном в пределах допусков, поэтому смена движка
+                   не делает завершённые задачи устаревшими;
+          memory_limit - лимит пиковой памяти одного процесса-исполнителя (байты или '8G');
+                   при workers > 1 суммарный лимит равен workers * memory_limit;
+          on_exceed - "shrink" (уменьшить чанк) или "refuse" (задача падает с MemoryError до расчёта);
+          cube - директория куба результатов (src.result_cube): карты метрик и aprox_error каждой задачи
+                 дописываются в него сразу после расчёта; None - только карты в директориях задач.
+                 Задачи очереди (execute_queued_task) куб не пишут, он заполняется после расчёта (fill_cube);
+          compression - сжатие блоков карт результатов (src.grid_io.write_result), None - без сжатия;
+          prefetch - конвейер: входы стольких следующих задач загружаются в фоновом потоке, пока считается
+                 текущая, а карты и маркеры пишутся в фоне (src.pipeline); 0 - загрузка, расчёт
+                 и запись по очереди;
+          checkpoint - считать задачи с контрольными точками по чанкам (ResultStore, checkpoint=True):
+                 задача, прерванная посреди расчёта, при перезапуске досчитывает только оставшиеся строки.
+        """
+        self.root_folder = root_folder
+        self.output_root = output_root
+        self.baths = list(baths)
+        self.waves = list(waves)
+        self.basises = list(basises)
+        self.metrics = tuple(metrics)
+        self.zone = zone
+        self.config_path = config_path
+        self.chunk_size = chunk_size
+        self.coefs_pattern = coefs_pattern
+        self.workers = workers
+        self.streaming = streaming
+        self.engine = engine
+        self.memory_limit = memory_limit
+        self.on_exceed = on_exceed
+        self.cube = cube
+        self.compression = compression
+        self.prefetch = prefetch
+        self.checkpoint = checkpoint
+        self.zone_coords = load_config(config_path)[zone]
+
+    @classmethod
+    def from_file(cls, path):
+        """Загружает описание серии из JSON-файла с ключами, совпадающими с параметрами конструктора."""
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(**json.load(f))
+
+    def wave_path(self, task):
+        return os.path.join(self.root_folder, "waves", f"{task.wave}.wave")
+
+    def basis_directory(self, task):
+        return os.path.join(self.root_folder, "basises", task.basis)
+
+    def coefs_path(self, task):
+        name = self.coefs_pattern.format(wave=task.wave, basis=task.basis, bath=task.bath)
+        return os.path.join(self.root_folder, "coeffs", name)
+
+    def result_dir(self, task):
+        return os.path.join(self.output_root, task.bath, task.wave, task.basis)
+
+    def tasks(self):
+        """
+        Все задачи серии в порядке, максимизирующем переиспользование данных:
+        внешний цикл по базисам (загрузка базиса и матрица Грама - самое дорогое),
+        внутри - по bath и волнам.
+        """
+        return [SweepTask(bath, wave, basis)
+                for basis in self.basises for bath in self.baths for wave in self.waves]
+
+
+def task_inputs_hash(spec, task, catalog=None):
+    """
+    Хеш содержимого всех входов задачи и параметров, влияющих на результат: волны, функций базиса,
+    имеющихся файлов базиса BASIS_EXTRA_FILES (как в ключе кеша базиса) и коэффициентов.
+    catalog - DataCatalog корня данных: хеши файлов берутся из него, без повторного чтения.
+    """
+    h = hashlib.sha1()
+    h.update(json.dumps([spec.zone_coords, list(spec.metrics), spec.chunk_size]).encode("utf-8"))
+    if catalog is not None:
+        hashes = catalog.fingerprint(task.bath, task.wave, task.basis)
+    else:
+        hashes = [file_hash(spec.wave_path(task))]
+        basis_directory = spec.basis_directory(task)
+        hashes += [file_hash(path) for path in list_basis_files(basis_directory)]
+        hashes += [file_hash(os.path.join(basis_directory, name)) for name in BASIS_EXTRA_FILES
+                   if os.path.exists(os.path.join(basis_directory, name))]
+        hashes.append(file_hash(spec.coefs_path(task)))
+    for value in hashes:
+        h.update(value.encode("utf-8"))
+    return h.hexdigest()
+
+
+def is_task_done(spec, task, inputs_hash):
+    """Задача завершена, если в её директории есть маркер с тем же хешем входов."""
+    marker = os.path.join(spec.result_dir(task), TASK_MARKER)
+    try:
+        with open(marker, "r", encoding="utf-8") as f:
+            return json.load(f).get("inputs") == inputs_hash
+    except (OSError, ValueError):
+        return False
+
+
+def mark_task_done(spec, task, inputs_hash, run=None):
+    """
+    Атомарно записывает маркер завершения задачи (atomic_write_json).
+    run - сведения о расчёте (calculator.last_run): в маркер попадают предсказанный и фактический
+    пик памяти, по которым можно планировать число одновременных задач на узле.
+    """
+    marker = os.path.join(spec.result_dir(task), TASK_MARKER)
+    record = {"inputs": inputs_hash, "task": task._asdict()}
+    if run is not None:
+        record["memory"] = {"predicted_peak": run["predicted"]["total"], "peak_rss": run["peak_rss"],
+                            "chunk_size": run["chunk_size"]}
+    atomic_write_json(marker, record)
+
+
+def ensure_cube(spec, tasks):
+    """
+    Создаёт куб результатов серии или добавляет в него метки bath, волн и базисов серии
+    до запуска исполнителей: исполнители только пишут карты в готовый куб.
+    Размер карты берётся из файла коэффициентов первой задачи.
+    """
+    if spec.cube is None or not tasks:
+        return None
+    metrics = list(spec.metrics) + ["aprox_error"]
+    try:
+        cube = ResultCube(spec.cube)
+        shape = cube.map_shape
+        cube.close()
+    except FileNotFoundError:
+        shape = scan_json_shape(spec.coefs_path(tasks[0]))[:2]
+    cube = ResultCube.open_or_create(spec.cube, spec.baths, spec.waves, spec.basises, metrics, shape)
+    cube.close()
+    return spec.cube
+
+
+def group_tasks(tasks):
+    """Группирует задачи по базису с сохранением порядка: одна группа - одна загрузка базиса."""
+    groups = {}
+    for task in tasks:
+        groups.setdefault(task.basis, []).append(task)
+    return list(groups.values())
+
+
+def load_task_inputs(spec, task):
+    """
+    Входы задачи (wave, basis_stack, coefs, errors). Волна и базис берутся из кеша src.array_cache,
+    поэтому задачи с общим базисом загружают его один раз. Базис остаётся SparseBasis для движка
+    sparse, а без заданного движка - если в директории базиса есть разреженный файл; иначе он плотный.
+    """
+    basis_directory = spec.basis_directory(task)
+    sparse = spec.engine == "sparse" or (
+        spec.engine is None and os.path.exists(os.path.join(basis_directory, SPARSE_BASIS_NAME)))
+    with stage("task_load", **task._asdict()):
+        basis_stack = cached_basis(basis_directory, spec.zone_coords, dense=not sparse)
+        wave = cached_wave(spec.wave_path(task), spec.zone_coords)
+        if spec.streaming:
+            coefs, errors = open_coefs(spec.coefs_path(task))
+        else:
+            coefs, errors = load_json_data(spec.coefs_path(task))
+    return wave, basis_stack, coefs, errors
+
+
+def write_task_outputs(spec, task, inputs_hash, errors, cube, run):
+    """Карта aprox_error задачи, её ячейка в кубе и маркер завершения (последним)."""
+    os.makedirs(spec.result_dir(task), exist_ok=True)
+    errors_path = os.path.join(spec.result_dir(task), f"aprox_error{RESULT_SUFFIX}")
+    write_result(errors_path, errors, compression=spec.compression,
+                 meta={"inputs": inputs_hash, "task": task._asdict()})
+    drop_legacy_result(errors_path)
+    if cube is not None:
+        cube.write(*task, "aprox_error", errors)
+        cube.flush()
+    mark_task_done(spec, task, inputs_hash, run)
+
+
+def iter_task_group(spec, tasks_with_hashes):
+    """
+    Выполняет задачи по порядку и выдаёт (task, число пересчитанных блоков строк) после расчёта каждой.
+    Волны, базис, матрица Грама и проекции волн берутся из кеша src.array_cache, общего для запусков
+    и процессов. При spec.prefetch > 0 входы следующих задач загружаются в фоне, пока считается текущая,
+    а результаты пишутся фоновой записью; все записи завершаются до окончания итерации.
+    """
+    hashes = dict(tasks_with_hashes)
+    tasks = [task for task, _ in tasks_with_hashes]
+    if spec.prefetch > 0:
+        inputs = Prefetcher(lambda task: load_task_inputs(spec, task), tasks, depth=spec.prefetch)
+    else:
+        inputs = ((task, load_task_inputs(spec, task)) for task in tasks)
+    cube = ResultCube(spec.cube, mode="r+") if spec.cube is not None else None
+    with BackgroundWriter() if spec.prefetch > 0 else nullcontext() as writer:
+        for task, (wave, basis_stack, coefs, errors) in inputs:
+            inputs_hash = hashes[task]
+            with stage("task", **task._asdict()):
+                calculator = TotalAccuracy.from_arrays(
+                    wave, basis_stack, coefs, errors,
+                    sources=(spec.wave_path(task), spec.basis_directory(task), spec.zone_coords))
+                store = ResultStore(spec.result_dir(task), chunk_size=spec.chunk_size, metrics=spec.metrics,
+                                    engine=spec.engine, memory_limit=spec.memory_limit, on_exceed=spec.on_exceed,
+                                    cube=cube, cube_key=tuple(task), compression=spec.compression, writer=writer,
+                                    checkpoint=spec.checkpoint)
+                updated = store.update(calculator)
+                outputs = (spec, task, inputs_hash, errors, cube, getattr(calculator, "last_run", None))
+                if writer is None:
+                    write_task_outputs(*outputs)
+                else:
+                    writer.submit(write_task_outputs, *outputs)
+            yield task, len(updated)
+
+
+def run_task_group(spec, tasks_with_hashes):
+    """
+    Выполняет группу задач (см. iter_task_group).
+    Возвращает список (task, число пересчитанных блоков строк).
+    """
+    return list(iter_task_group(spec, tasks_with_hashes))
+
+
+def load_catalog(spec):
+    """
+    Каталог корня данных серии (src.data_catalog), обновлённый инкрементально, и проверка входов:
+    недостающие волны, базисы и файлы коэффициентов - ValueError до начала расчётов.
+    """
+    catalog = DataCatalog(spec.root_folder, spec.coefs_pattern).refresh(save=False)
+    try:
+        catalog.save()
+    except OSError:
+        # Корень данных только для чтения: каталог живёт в памяти до конца запуска
+        pass
+    problems = catalog.preflight(spec.baths, spec.waves, spec.basises)
+    if problems:
+        raise ValueError("Не хватает входных данных серии:\n  " + "\n  ".join(problems))
+    return catalog
+
+
+def pending_tasks(spec):
+    """Возвращает список (task, inputs_hash) для незавершённых задач серии."""
+    catalog = load_catalog(spec)
+    pending = []
+    for task in spec.tasks():
+        inputs_hash = task_inputs_hash(spec, task, catalog)
+        if not is_task_done(spec, task, inputs_hash):
+            pending.append((task, inputs_hash))
+    return pending
+
+
+def run_sweep(spec, workers=None, dry_run=False):
+    """
+    Запускает серию расчётов: пропускает задачи с актуальным маркером завершения,
+    группирует остальные по базису и выполняет группы в пуле процессов.
+
+    Параметры:
+      spec - SweepSpec;
+      workers - число процессов (по умолчанию spec.workers);
+      dry_run - только вывести список незавершённых задач.
+
+    Возвращает список выполненных (task, число пересчитанных блоков строк).
+    """
+    workers = workers or spec.workers
+    pending = pending_tasks(spec)
+    print(f"Задач всего: {len(spec.tasks())}, к выполнению: {len(pending)}")
+    if dry_run or not pending:
+        for task, _ in pending:
+            print(f"  {spec.result_dir(task)}")
+        return []
+
+    ensure_cube(spec, [task for task, _ in pending])
+    groups = group_tasks([task for task, _ in pending])
+    hashes = dict(pending)
+    groups = [[(task, hashes[task]) for task in group] for group in groups]
+
+    finished = []
+    if workers <= 1:
+        # Одна последовательность задач: конвейер загружает следующий базис, пока считается текущий
+        for done in iter_task_group(spec, [item for group in groups for item in group]):
+            finished.extend(_report(spec, [done]))
+        return finished
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_task_group, spec, group) for group in groups]
+        for future in as_completed(futures):
+            finished.extend(_report(spec, future.result()))
+    return finished
+
+
+def _report(spec, done):
+    for task, n_blocks in done:
+        status = f"пересчитано блоков: {n_blocks}" if n_blocks else "карты актуальны"
+        print(f"готово {spec.result_dir(task)} ({status})")
+    return done
+
+
+def queue_task_id(index, task):
+    """Идентификатор задачи в очереди; порядковый номер сохраняет порядок серии при захвате."""
+    return f"{index:06d}_{task.basis}_{task.bath}_{task.wave}"
+
+
+def submit_sweep(queue, spec, force=False):
+    """
+    Ставит все задачи серии в очередь WorkQueue в порядке spec.tasks(), чтобы соседние
+    захваты одного исполнителя чаще попадали на уже загруженный базис.
+    Возвращает число добавленных задач.
+    """
+    added = 0
+    for index, task in enumerate(spec.tasks()):
+        added += queue.submit(queue_task_id(index, task), task._asdict(), force=force)
+    return added
+
+
+def execute_queued_task(spec, payload):
+    """
+    Выполняет одну задачу из очереди. Задача с актуальным маркером завершения пропускается.
+    Куб результатов задача не пишет: исполнители работают на разных узлах, а страницы memmap
+    на общей файловой системе между узлами не согласованы - соседние ячейки и флаги заполнения
+    терялись бы. Куб заполняется после расчёта одним процессом (fill_cube).
+    Возвращает JSON-совместимое описание результата.
+    """
+    task = SweepTask(**payload)
+    inputs_hash = task_inputs_hash(spec, task)
+    if is_task_done(spec, task, inputs_hash):
+        return {"skipped": True, "inputs": inputs_hash}
+    spec = copy.copy(spec)
+    spec.cube = None
+    (_, n_blocks), = run_task_group(spec, [(task, inputs_hash)])
+    return {"skipped": False, "inputs": inputs_hash, "blocks": n_blocks}
+
+
+def fill_cube(spec):
+    """
+    Записывает в куб серии карты метрик и aprox_error всех завершённых задач из их директорий
+    (после расчёта через очередь). Ячейки перезаписываются, так что пересчитанные задачи
+    не остаются в кубе со старыми картами. Возвращает число записанных задач.
+    """
+    if spec.cube is None:
+        return 0
+    catalog = load_catalog(spec)
+    done = [task for task in spec.tasks() if is_task_done(spec, task, task_inputs_hash(spec, task, catalog))]
+    if not done:
+        return 0
+    ensure_cube(spec, done)
+    cube = ResultCube(spec.cube, mode="r+")
+    for task in done:
+        with stage("cube_fill", **task._asdict()):
+            for metric in list(spec.metrics) + ["aprox_error"]:
+                cube.write(*task, metric, read_field(os.path.join(spec.result_dir(task), f"{metric}{RESULT_SUFFIX}")))
+    cube.flush()
+    cube.close()
+    return len(done)
@@ -0,0 +1,181 @@
+import contextlib
+import io
+import json
+import os
+
+import numpy as np
+
+from src.basis_generator import BasisGenerator
+from src.data_generator import ShapeGenerator
+from src.result_store import atomic_savetxt
+from src.subduction_generator import SubductionGenerator
+
+COEFS_PATTERN = "case_statistics_{wave}_{basis}_{bath}_all.json"
+
+
+def centered_zone(size, zone_size):
+    """Зона [y_min, y_max, x_min, x_max] размера zone_size в центре области size."""
+    height, width = size
+    zone_height, zone_width = zone_size
+    if zone_height > height or zone_width > width:
+        raise ValueError("Зона не помещается в область")
+    y_min = (height - zone_height) // 2
+    x_min = (width - zone_width) // 2
+    return [y_min, y_min + zone_height, x_min, x_min + zone_width]
+
+
+def write_config(path, size, zone_size):
+    """Записывает zones.json с областью size и зоной subduction_zone размера zone_size в её центре."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    config = {"size": list(size), "subduction_zone": centered_zone(size, zone_size)}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=4)
+    return config
+
+
+def tile_shape(zone_height, zone_width, n_tiles):
+    """
+    Подбирает размер плитки (tile_height, tile_width) так, чтобы зона разбивалась ровно на n_tiles плиток.
+    Из допустимых разбиений выбирается то, у которого плитка ближе всего к квадрату.
+    """
+    best = None
+    for n_y in range(1, n_tiles + 1):
+        if n_tiles % n_y:
+            continue
+        n_x = n_tiles // n_y
+        if zone_height % n_y or zone_width % n_x:
+            continue
+        tile = (zone_height // n_y, zone_width // n_x)
+        score = max(tile) / min(tile)
+        if best is None or score < best[0]:
+            best = (score, tile)
+    if best is None:
+        raise ValueError(f"Зону {zone_height}x{zone_width} нельзя разбить ровно на {n_tiles} плиток")
+    return best[1]
+
+
+def tile_basis_stack(config_path, n_tiles):
+    """Базис из n_tiles плиток BasisGenerator на полной области, shape (n_tiles, height, width)."""
+    generator = BasisGenerator(config_path)
+    zone_height = generator.sub_y_max - generator.sub_y_min
+    zone_width = generator.sub_x_max - generator.sub_x_min
+    generator.generate_tiles(*tile_shape(zone_height, zone_width, n_tiles))
+    return np.stack([generator.generate_basis(i) for i in range(len(generator.tiles))], axis=0)
+
+
+def synthetic_wave(config_path, kind="double_gaussian", amplitude=1.0):
+    """Волна SubductionGenerator на полной области; сигмы - доли размеров зоны."""
+    generator = SubductionGenerator(config_path)
+    sigma_y = (generator.sub_y_max - generator.sub_y_min) / 4.0
+    sigma_x = (generator.sub_x_max - generator.sub_x_min) / 4.0
+    if kind == "gaussian":
+        return generator.gaussian(amplitude=amplitude, sigma_x=sigma_x, sigma_y=sigma_y)
+    # double_gaussian печатает формулу поверхности - здесь она не нужна
+    with contextlib.redirect_stdout(io.StringIO()):
+        return generator.double_gaussian(sigma_x=sigma_x, sigma_y=sigma_y,
+                                         amplitude1=amplitude, amplitude2=amplitude / 2.0)
+
+
+def synthetic_bath(config_path):
+    """Батиметрия ShapeGenerator (парабола с синусоидальной модуляцией) на полной области."""
+    generator = ShapeGenerator(config_path)
+    return generator.parabola_sine(min_value=-4000.0, max_value=-100.0, sin_amp=200.0,
+                                   sin_period_x=generator.width / 8.0, sin_period_y=generator.height / 8.0)
+
+
+def synthetic_coefs(wave, basis_stack, grid, noise=0.1, holes=0.0, seed=0):
+    """
+    Коэффициенты для сетки точек grid = (rows, cols): проекция волны на базис методом
+    наименьших квадратов, возмущённая в каждой точке относительным шумом noise.
+    Доля holes точек пропускается (NaN), как отсутствующие ключи в JSON.
+
+    Возвращает (coefs (rows, cols, n_layers), errors (rows, cols)); errors - RMS невязки точки.
+    """
+    rng = np.random.default_rng(seed)
+    rows, cols = grid
+    flat = basis_stack.reshape(basis_stack.shape[0], -1)
+    best, *_ = np.linalg.lstsq(flat.T, wave.reshape(-1), rcond=None)
+    coefs = best * (1.0 + noise * rng.standard_normal((rows, cols, best.size)))
+
+    gram = flat @ flat.T
+    projection = flat @ wave.reshape(-1)
+    quad = np.sum((coefs @ gram) * coefs, axis=-1)
+    errors = np.sqrt(np.maximum(np.sum(wave ** 2) - 2 * coefs @ projection + quad, 0.0) / wave.size)
+
+    if holes > 0:
+        mask = rng.random((rows, cols)) < holes
+        coefs[mask] = np.nan
+        errors[mask] = np.nan
+    return coefs, errors
+
+
+def write_coefs_json(path, coefs, errors):
+    """
+    Записывает коэффициенты в формате case_statistics: {"[row,col]": {"coefs": [...], "aprox_error": x}}.
+    Точки с NaN-ошибкой пропускаются. Файл пишется по одной записи, без словаря в памяти.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    rows, cols = errors.shape
+    with open(path + ".tmp", "w") as f:
+        f.write("{")
+        first = True
+        for row in range(rows):
+            for col in range(cols):
+                if np.isnan(errors[row, col]):
+                    continue
+                entry = {"coefs": coefs[row, col].tolist(), "aprox_error": float(errors[row, col])}
+                f.write(("" if first else ", ") + f'"[{row},{col}]": ' + json.dumps(entry))
+                first = False
+        f.write("}")
+    os.replace(path + ".tmp", path)
+
+
+def build_dataset(root_folder, size, zone_size, grid, tiles, ensemble=0, bath_name="synthetic_bath",
+                  wave_name="synthetic_wave", noise=0.1, holes=0.0, seed=0):
+    """
+    Создаёт синтетический набор данных в структуре, которую ожидают TotalAccuracy и sweep:
+      <root>/config/zones.json, <root>/bath/<bath>.wave, <root>/waves/<wave>.wave,
+      <root>/basises/basis_<n>/basis_<i>.wave, <root>/coeffs/case_statistics_<wave>_<basis>_<bath>_all.json.
+
+    Параметры:
+      size, zone_size - размеры области и зоны (зона ставится в центр);
+      grid - размер коэффициентной сетки (rows, cols);
+      tiles - числа плиток базисов;
+      ensemble - число дополнительных базисов ens<k>_basis_<n> для ансамблей TotalAccuracyMean
+                 (число плиток берётся по кругу из tiles);
+      noise, holes, seed - параметры synthetic_coefs.
+
+    Возвращает словарь с описанием набора (пути, имена базисов, имена ансамбля).
+    """
+    config_path = os.path.join(root_folder, "config", "zones.json")
+    config = write_config(config_path, size, zone_size)
+    for name in ("bath", "waves", "basises", "coeffs"):
+        os.makedirs(os.path.join(root_folder, name), exist_ok=True)
+
+    atomic_savetxt(os.path.join(root_folder, "bath", f"{bath_name}.wave"), synthetic_bath(config_path))
+    wave = synthetic_wave(config_path)
+    atomic_savetxt(os.path.join(root_folder, "waves", f"{wave_name}.wave"), wave)
+    y_min, y_max, x_min, x_max = config["subduction_zone"]
+    wave_zone = wave[y_min:y_max, x_min:x_max]
+
+    members = [(f"basis_{n}", n) for n in tiles]
+    members += [(f"ens{k}_basis_{tiles[k % len(tiles)]}", tiles[k % len(tiles)]) for k in range(ensemble)]
+    for index, (basis_name, n_tiles) in enumerate(members):
+        basis_directory = os.path.join(root_folder, "basises", basis_name)
+        os.makedirs(basis_directory, exist_ok=True)
+        stack = tile_basis_stack(config_path, n_tiles)
+        for i, basis in enumerate(stack):
+            atomic_savetxt(os.path.join(basis_directory, f"basis_{i}.wave"), basis)
+        coefs, errors = synthetic_coefs(wave_zone, stack[:, y_min:y_max, x_min:x_max], grid,
+                                        noise=noise, holes=holes, seed=seed + index)
+        name = COEFS_PATTERN.format(wave=wave_name, basis=basis_name, bath=bath_name)
+        write_coefs_json(os.path.join(root_folder, "coeffs", name), coefs, errors)
+
+    return {
+        "root_folder": root_folder,
+        "config_path": config_path,
+        "bath": bath_name,
+        "wave": wave_name,
+        "basises": [name for name, _ in members[:len(tiles)]],
+        "ensemble": [name for name, _ in members[len(tiles):]],
+    }
@@ -0,0 +1,236 @@
+import json
+import os
+
+import numpy as np
+
+from src.basis_generator import BasisGenerator, write_tile_files
+from src.engines import region_stats
+from src.grid_io import atomic_write_json
+from src.instrumentation import stage
+
+# Общий манифест набора разбиений в корне: разбиения, их вложенность и номера родительских плиток
+TILINGS_MANIFEST = "tilings.json"
+# Статистики волн по плиткам в директории разбиения: {имя волны: статистики}
+WAVE_STATS_NAME = "wave_stats.json"
+# Статистики, которые складываются по дочерним плиткам
+_SUM_STATS = ("counts", "sums", "sq_sums")
+
+
+def refinement_parents(fine, coarse):
+    """
+    Номер плитки coarse, содержащей каждую плитку fine, shape (n_fine,), если разбиение fine
+    вложено в coarse: каждая плитка fine целиком лежит в одной плитке coarse и оба разбиения
+    покрывают одни и те же пиксели. Иначе None.
+    """
+    fine, coarse = np.asarray(fine), np.asarray(coarse)
+    if fine.shape != coarse.shape or not np.array_equal(fine >= 0, coarse >= 0):
+        return None
+    inside = fine >= 0
+    fine_labels, coarse_labels = fine[inside].astype(np.int64), coarse[inside].astype(np.int64)
+    n_fine = int(fine_labels.max(initial=-1)) + 1
+    parents = np.full(n_fine, -1, dtype=np.int64)
+    parents[fine_labels] = coarse_labels
+    # Плитка fine, пиксели которой попали в разные плитки coarse, перезаписала бы родителя
+    if np.any(parents[fine_labels] != coarse_labels):
+        return None
+    return parents
+
+
+def tile_wave_stats(labels, wave, n_tiles):
+    """
+    Статистики волны по плиткам карты меток (см. src.engines.region_stats) и сумма квадратов
+    sq_sums. Все поля, кроме outside_abs_max, - массивы (n_tiles,).
+    """
+    wave = np.asarray(wave, dtype=np.float64)
+    stats = region_stats(labels, wave, n_tiles)
+    flat_labels = np.asarray(labels).reshape(-1)
+    inside = flat_labels >= 0
+    stats["sq_sums"] = np.bincount(flat_labels[inside], weights=wave.reshape(-1)[inside] ** 2, minlength=n_tiles)
+    return stats
+
+
+def aggregate_stats(stats, parents, n_parents):
+    """
+    Статистики плиток родительского разбиения из статистик дочерних: суммы складываются,
+    минимумы и максимумы берутся по дочерним плиткам, без прохода по пикселям.
+    """
+    aggregated = {key: np.bincount(parents, weights=stats[key], minlength=n_parents) for key in _SUM_STATS}
+    aggregated["min"] = np.full(n_parents, np.inf)
+    aggregated["max"] = np.full(n_parents, -np.inf)
+    np.minimum.at(aggregated["min"], parents, stats["min"])
+    np.maximum.at(aggregated["max"], parents, stats["max"])
+    # Непокрытые пиксели у вложенных разбиений одни и те же
+    aggregated["outside_abs_max"] = stats["outside_abs_max"]
+    return aggregated
+
+
+class TilingSet:
+    """
+    Набор разбиений subduction_zone, построенных за один запуск вместо отдельного generate_basis.py
+    на каждое: каждое разбиение хранится картой меток (tiles.json + labels.grid), без файлов базисных
+    функций на всё поле. Для вложенных разбиений (например, 12 ⊂ 24 ⊂ 48 плиток) записывается
+    родитель и номер родительской плитки для каждой плитки, а статистики волны по плиткам крупного
+    разбиения собираются из статистик мелкого.
+    """
+
+    def __init__(self, config_path=os.path.join("config", "zones.json")):
+        self.generator = BasisGenerator(config_path)
+        self.zone_shape = (self.generator.sub_y_max - self.generator.sub_y_min,
+                           self.generator.sub_x_max - self.generator.sub_x_min)
+        self.tilings = {}  # имя -> {"manifest": манифест плиток, "labels": карта меток зоны}
+        self.parents = {}  # имя -> (имя родителя, номера родительских плиток) или None
+        self.refines = {}  # имя -> список всех разбиений, в которые вложено данное
+
+    @classmethod
+    def from_spec(cls, spec, config_path=os.path.join("config", "zones.json")):
+        """
+        Набор по описанию: список словарей с ключом name и одним из способов разбиения:
+          tile_height, tile_width - равномерные плитки заданного размера;
+          grid: [n_y, n_x]        - равномерная сетка из n_y x n_x плиток;
+          voronoi: n, seed        - ячейки Вороного.
+        """
+        tiling_set = cls(config_path)
+        for entry in spec:
+            entry = dict(entry)
+            name = entry.pop("name")
+            if "voronoi" in entry:
+                tiling_set.add_voronoi(name, entry["voronoi"], entry.get("seed", 0))
+            elif "grid" in entry:
+                n_y, n_x = entry["grid"]
+                height, width = tiling_set.zone_shape
+                if height % n_y or width % n_x:
+                    raise ValueError(f"Зона {height}x{width} не делится на сетку {n_y}x{n_x} ({name})")
+                tiling_set.add_uniform(name, height // n_y, width // n_x)
+            elif "tile_height" in entry and "tile_width" in entry:
+                tiling_set.add_uniform(name, entry["tile_height"], entry["tile_width"])
+            else:
+                raise ValueError(f"Для разбиения {name} не задан способ: tile_height/tile_width, grid или voronoi")
+        return tiling_set
+
+    def _add(self, name):
+        if name in self.tilings:
+            raise ValueError(f"Разбиение {name} задано несколько раз")
+        self.tilings[name] = {"manifest": self.generator.tile_manifest(), "labels": self.generator.label_map()}
+        self.parents.clear()
+
+    def add_uniform(self, name, tile_height, tile_width):
+        """Равномерное разбиение на плитки tile_height x tile_width (см. BasisGenerator.generate_tiles)."""
+        self.generator.generate_tiles(tile_height, tile_width)
+        self._add(name)
+
+    def add_voronoi(self, name, n_cells, seed=0):
+        """Разбиение на ячейки Вороного (см. BasisGenerator.generate_voronoi)."""
+        self.generator.generate_voronoi(n_cells, seed=seed)
+        self._add(name)
+
+    def add_labels(self, name, labels, tiling=None):
+        """Разбиение произвольной картой меток (см. BasisGenerator.set_label_map)."""
+        self.generator.set_label_map(labels, tiling)
+        self._add(name)
+
+    def n_tiles(self, name):
+        return self.tilings[name]["manifest"]["n_tiles"]
+
+    def build_hierarchy(self):
+        """
+        Находит вложенность разбиений. Родитель разбиения - самое мелкое из более крупных разбиений,
+        в которые оно вложено; все такие разбиения - в self.refines. Возвращает self.parents.
+        """
+        with stage("tiling_hierarchy", tilings=len(self.tilings)):
+            self.parents = {name: None for name in self.tilings}
+            self.refines = {name: [] for name in self.tilings}
+            for fine in self.tilings:
+                candidates = []
+                for coarse in self.tilings:
+                    if coarse == fine or self.n_tiles(coarse) >= self.n_tiles(fine):
+                        continue
+                    parents = refinement_parents(self.tilings[fine]["labels"], self.tilings[coarse]["labels"])
+                    if parents is not None:
+                        candidates.append((self.n_tiles(coarse), coarse, parents))
+                self.refines[fine] = sorted(coarse for _, coarse, _ in candidates)
+                if candidates:
+                    _, coarse, parents = max(candidates, key=lambda item: (item[0], item[1]))
+                    self.parents[fine] = (coarse, parents)
+        return self.parents
+
+    def children(self, name):
+        """Разбиения, родитель которых - name."""
+        if not self.parents:
+            self.build_hierarchy()
+        return sorted(child for child, parent in self.parents.items() if parent is not None and parent[0] == name)
+
+    def wave_stats(self, wave):
+        """
+        Статистики волны по плиткам всех разбиений {имя: статистики} (см. tile_wave_stats).
+        По пикселям считаются только разбиения без дочерних; остальные собираются из статистик
+        дочернего разбиения с наименьшим числом плиток (aggregate_stats).
+        """
+        if not self.parents:
+            self.build_hierarchy()
+        wave = self.generator._zone_wave(wave)
+        stats = {}
+        # Сначала мелкие разбиения, чтобы статистики дочерних были готовы к моменту сборки родителя
+        for name in sorted(self.tilings, key=lambda item: (-self.n_tiles(item), item)):
+            children = self.children(name)
+            if children:
+                child = min(children, key=lambda item: (self.n_tiles(item), item))
+                with stage("tile_stats", tiling=name, aggregated=True):
+                    stats[name] = aggregate_stats(stats[child], self.parents[child][1], self.n_tiles(name))
+            else:
+                with stage("tile_stats", tiling=name, aggregated=False):
+                    stats[name] = tile_wave_stats(self.tilings[name]["labels"], wave, self.n_tiles(name))
+        return stats
+
+    def manifest(self):
+        """Общий манифест: для каждого разбиения число плиток, параметры, родитель и дочерние разбиения."""
+        if not self.parents:
+            self.build_hierarchy()
+        tilings = {}
+        for name, entry in self.tilings.items():
+            parent = self.parents[name]
+            tilings[name] = {
+                "n_tiles": self.n_tiles(name),
+                "tiling": entry["manifest"]["tiling"],
+                "parent": None if parent is None else parent[0],
+                "parent_tiles": None if parent is None else [int(v) for v in parent[1]],
+                "refines": self.refines[name],
+                "children": self.children(name),
+            }
+        return {"size": list(self.generator.size), "subduction_zone": list(self.generator.subduction_zone),
+                "tilings": tilings}
+
+    def write(self, output_root, waves=None):
+        """
+        Записывает каждое разбиение в <output_root>/<имя>/ (tiles.json и labels.grid), общий манифест
+        tilings.json в output_root и, если заданы волны {имя волны: поле}, статистики волн по плиткам
+        в <output_root>/<имя>/wave_stats.json. Возвращает путь общего манифеста.
+        """
+        os.makedirs(output_root, exist_ok=True)
+        for name, entry in self.tilings.items():
+            write_tile_files(os.path.join(output_root, name), entry["manifest"], entry["labels"])
+        if waves:
+            per_tiling = {name: {} for name in self.tilings}
+            for wave_name, wave in waves.items():
+                for name, stats in self.wave_stats(wave).items():
+                    per_tiling[name][wave_name] = {key: np.asarray(value).tolist() for key, value in stats.items()}
+            for name, records in per_tiling.items():
+                atomic_write_json(os.path.join(output_root, name, WAVE_STATS_NAME), records, indent=2)
+        manifest_path = os.path.join(output_root, TILINGS_MANIFEST)
+        atomic_write_json(manifest_path, self.manifest(), indent=2)
+        return manifest_path
+
+
+def load_wave_stats(tiling_directory, wave_name):
+    """
+    Статистики волны wave_name по плиткам разбиения из wave_stats.json (массивы numpy)
+    или None, если они не записаны.
+    """
+    try:
+        with open(os.path.join(tiling_directory, WAVE_STATS_NAME), "r", encoding="utf-8") as f:
+            records = json.load(f)
+    except OSError:
+        return None
+    if wave_name not in records:
+        return None
+    return {key: value if np.isscalar(value) else np.asarray(value, dtype=np.float64)
+            for key, value in records[wave_name].items()}
@@ -0,0 +1,286 @@
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import traceback
+
+from src.grid_io import atomic_write_json
+
+PENDING = "pending"
+CLAIMED = "claimed"
+DONE = "done"
+FAILED = "failed"
+
+
+def default_worker_id():
+    """Идентификатор исполнителя: имя узла и pid процесса."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class Lease:
+    """
+    Аренда задачи исполнителем: файл claimed/<task_id>@<worker_id>.json.
+    Пока аренда жива, фоновый поток периодически обновляет mtime файла (heartbeat).
+    """
+
+    def __init__(self, queue, task_id, worker_id, path, payload):
+        self.queue = queue
+        self.task_id = task_id
+        self.worker_id = worker_id
+        self.path = path
+        self.payload = payload
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def heartbeat(self):
+        """Обновляет mtime файла аренды. Если файл исчез (аренду забрали), помечает её потерянной."""
+        try:
+            os.utime(self.path, None)
+        except FileNotFoundError:
+            self.lost = True
+
+    def start_heartbeat(self, interval):
+        def loop():
+            while not self._stop.wait(interval):
+                self.heartbeat()
+                if self.lost:
+                    return
+
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+
+    def stop_heartbeat(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class WorkQueue:
+    """
+    Очередь задач на общей файловой системе без центрального сервиса.
+
+    Каждая задача - JSON-файл, переходящий между каталогами:
+      pending/<id>.json -> claimed/<id>@<worker>.json -> done/<id>.json (или failed/<id>.json).
+    Захват задачи - атомарный rename, поэтому одну задачу получает ровно один исполнитель.
+    Исполнитель продлевает аренду, обновляя mtime файла; аренды без heartbeat дольше
+    lease_seconds возвращаются в pending любым исполнителем.
+    """
+
+    def __init__(self, queue_dir, lease_seconds=600, max_attempts=3):
+        """
+        Параметры:
+          queue_dir - каталог очереди на общей файловой системе;
+          lease_seconds - время жизни аренды без heartbeat;
+          max_attempts - число попыток, после которого задача переносится в failed/.
+        """
+        self.queue_dir = queue_dir
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        for state in (PENDING, CLAIMED, DONE, FAILED):
+            os.makedirs(os.path.join(queue_dir, state), exist_ok=True)
+
+    def _path(self, state, name):
+        return os.path.join(self.queue_dir, state, name)
+
+    def _fs_now(self):
+        """
+        Текущее время по часам файловой системы очереди. Используется вместо time.time(),
+        чтобы расхождение часов узлов не приводило к ложному истечению аренд.
+        Пробный файл получает уникальное имя (mkstemp): у процессов разных узлов pid может совпадать.
+        """
+        fd, probe = tempfile.mkstemp(prefix=".clock.", dir=self.queue_dir)
+        try:
+            return os.fstat(fd).st_mtime
+        finally:
+            os.close(fd)
+            os.remove(probe)
+
+    def submit(self, task_id, payload, force=False):
+        """
+        Ставит задачу в очередь. Уже поставленные, захваченные или выполненные задачи
+        повторно не добавляются (кроме force=True для выполненных и упавших).
+        Возвращает True, если задача добавлена.
+        """
+        name = f"{task_id}.json"
+        if os.path.exists(self._path(PENDING, name)) or self._claimed_files(task_id):
+            return False
+        for state in (DONE, FAILED):
+            if os.path.exists(self._path(state, name)):
+                if not force:
+                    return False
+                os.remove(self._path(state, name))
+        atomic_write_json(self._path(PENDING, name), {"task_id": task_id, "attempts": 0, "payload": payload},
+                          per_process=True, indent=2)
+        return True
+
+    def _claimed_files(self, task_id=None):
+        names = os.listdir(os.path.join(self.queue_dir, CLAIMED))
+        if task_id is not None:
+            names = [n for n in names if n.startswith(f"{task_id}@")]
+        return [n for n in names if n.endswith(".json")]
+
+    def claim(self, worker_id):
+        """
+        Захватывает первую задачу из pending/ (в лексикографическом порядке id).
+        Возвращает Lease или None, если свободных задач нет.
+        """
+        for name in sorted(os.listdir(os.path.join(self.queue_dir, PENDING))):
+            if not name.endswith(".json") or name.startswith("."):
+                continue
+            task_id = name[:-len(".json")]
+            claimed_path = self._path(CLAIMED, f"{task_id}@{worker_id}.json")
+            try:
+                os.rename(self._path(PENDING, name), claimed_path)
+            except FileNotFoundError:
+                # Задачу уже забрал другой исполнитель
+                continue
+            os.utime(claimed_path, None)
+            with open(claimed_path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+            return Lease(self, task_id, worker_id, claimed_path, record["payload"])
+        return None
+
+    def _release(self, lease, state, **extra):
+        staging = self._path(CLAIMED, f".{lease.task_id}@{lease.worker_id}.{state}")
+        # Сначала атомарно забираем файл аренды, чтобы его не вернул в очередь другой узел
+        try:
+            os.rename(lease.path, staging)
+        except FileNotFoundError:
+            lease.lost = True
+            return None
+        with open(staging, "r", encoding="utf-8") as f:
+            record = json.load(f)
+        if state == PENDING:
+            record["attempts"] += 1
+        record.update(extra)
+        record["worker"] = lease.worker_id
+        atomic_write_json(staging, record, per_process=True, indent=2)
+        target_state = state
+        if state == PENDING and record["attempts"] >= self.max_attempts:
+            target_state = FAILED
+        os.rename(staging, self._path(target_state, f"{lease.task_id}.json"))
+        return target_state
+
+    def complete(self, lease, result=None):
+        """
+        Переносит задачу в done/ с результатом выполнения.
+        Возвращает итоговое состояние или None, если аренда уже потеряна.
+        """
+        lease.stop_heartbeat()
+        return self._release(lease, DONE, result=result, finished=time.time())
+
+    def fail(self, lease, error):
+        """
+        Возвращает упавшую задачу в pending/ с увеличенным счётчиком попыток
+        (или в failed/, если попытки исчерпаны). Возвращает итоговое состояние
+        или None, если аренда уже потеряна.
+        """
+        lease.stop_heartbeat()
+        return self._release(lease, PENDING, last_error=error)
+
+    def requeue_expired(self):
+        """
+        Возвращает в pending/ задачи, аренда которых не продлевалась дольше lease_seconds
+        (исполнитель умер или узел недоступен). Возвращает список id возвращённых задач.
+        Если часы файловой системы прочитать не удалось, проверка откладывается до следующего вызова.
+        """
+        try:
+            now = self._fs_now()
+        except OSError as exc:
+            print(f"Проверка аренд пропущена: {exc}")
+            return []
+        requeued = []
+        for name in self._claimed_files():
+            path = self._path(CLAIMED, name)
+            try:
+                expired = now - os.stat(path).st_mtime > self.lease_seconds
+            except FileNotFoundError:
+                continue
+            if not expired:
+                continue
+            task_id, worker_id = name[:-len(".json")].rsplit("@", 1)
+            staging = self._path(CLAIMED, f".{task_id}@{worker_id}.requeue")
+            try:
+                os.rename(path, staging)
+            except FileNotFoundError:
+                continue
+            with open(staging, "r", encoding="utf-8") as f:
+                record = json.load(f)
+            record["attempts"] += 1
+            record["last_error"] = f"аренда исполнителя {worker_id} истекла"
+            atomic_write_json(staging, record, per_process=True, indent=2)
+            target_state = FAILED if record["attempts"] >= self.max_attempts else PENDING
+            os.rename(staging, self._path(target_state, f"{task_id}.json"))
+            requeued.append(task_id)
+        return requeued
+
+    def requeue_failed(self):
+        """Возвращает все задачи из failed/ в pending/ со сброшенным счётчиком попыток."""
+        requeued = []
+        for name in os.listdir(os.path.join(self.queue_dir, FAILED)):
+            if not name.endswith(".json"):
+                continue
+            path = self._path(FAILED, name)
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+            record["attempts"] = 0
+            atomic_write_json(path, record, per_process=True, indent=2)
+            os.rename(path, self._path(PENDING, name))
+            requeued.append(name[:-len(".json")])
+        return requeued
+
+    def status(self):
+        """Число задач в каждом состоянии."""
+        counts = {}
+        for state in (PENDING, CLAIMED, DONE, FAILED):
+            names = os.listdir(os.path.join(self.queue_dir, state))
+            counts[state] = len([n for n in names if n.endswith(".json") and not n.startswith(".")])
+        return counts
+
+
+def run_worker(queue, execute, worker_id=None, heartbeat_interval=None, wait=False, poll_interval=10.0):
+    """
+    Цикл исполнителя: возвращает просроченные аренды, захватывает задачу, выполняет
+    execute(payload) с фоновым heartbeat и переводит задачу в done/ или обратно в pending/.
+
+    Параметры:
+      queue - WorkQueue;
+      execute - функция, выполняющая задачу по её payload и возвращающая JSON-совместимый результат;
+      worker_id - идентификатор исполнителя (по умолчанию <host>-<pid>);
+      heartbeat_interval - период heartbeat (по умолчанию треть времени аренды);
+      wait - ждать новых задач, когда очередь пуста, вместо завершения;
+      poll_interval - пауза между опросами пустой очереди.
+
+    Возвращает число выполненных задач.
+    """
+    worker_id = worker_id or default_worker_id()
+    heartbeat_interval = heartbeat_interval or queue.lease_seconds / 3.0
+    completed = 0
+    while True:
+        queue.requeue_expired()
+        lease = queue.claim(worker_id)
+        if lease is None:
+            counts = queue.status()
+            if not wait and counts[PENDING] == 0 and counts[CLAIMED] == 0:
+                return completed
+            time.sleep(poll_interval)
+            continue
+
+        print(f"[{worker_id}] задача {lease.task_id}")
+        lease.start_heartbeat(heartbeat_interval)
+        try:
+            result = execute(lease.payload)
+        except Exception:
+            state = queue.fail(lease, traceback.format_exc())
+            where = f"перенесена в {state}/" if state else "аренда потеряна"
+            print(f"[{worker_id}] ошибка в задаче {lease.task_id}, {where}")
+            continue
+        if lease.lost or queue.complete(lease, result) is None:
+            # Аренду вернули в очередь, пока задача выполнялась: задачу доделает тот, кто её забрал
+            lease.stop_heartbeat()
+            print(f"[{worker_id}] аренда задачи {lease.task_id} потеряна")
+            continue
+        completed += 1